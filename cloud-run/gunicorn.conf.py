@@ -0,0 +1,56 @@
+# Configuração do gunicorn para o Cloud Run - Importação LINX
+#
+# Uso (na raiz do projeto): gunicorn --config cloud-run/gunicorn.conf.py
+# Os valores podem ser ajustados por variáveis de ambiente, sem rebuild.
+
+import os
+import logging
+
+logger = logging.getLogger('gunicorn.error')
+
+wsgi_app = 'main_cloud_run:app'
+pythonpath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+
+# Um único processo: os jobs de importação e a trava de importação única ficam
+# em memória (import_jobs.JobManager). A concorrência vem das threads, e as
+# importações rodam em uma thread própria, sem ocupar as do servidor.
+workers = int(os.environ.get('GUNICORN_WORKERS', '1'))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+# O Cloud Run controla o tempo máximo das requisições (--timeout do deploy);
+# 0 desativa o timeout de worker do gunicorn
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '0'))
+# Conexões mantidas abertas pelo front-end do Cloud Run entre requisições
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '75'))
+# O Cloud Run espera 10s após o SIGTERM antes de encerrar a instância
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '8'))
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+def post_worker_init(worker):
+    """Aquece o worker (módulos e clientes compartilhados) em segundo plano
+
+    O worker já atende o health check enquanto os clientes são criados; uma
+    importação que chegue antes espera a criação terminar.
+    """
+    from main_cloud_run import warm_up_in_background
+    warm_up_in_background()
+
+def worker_int(worker):
+    """SIGINT/SIGQUIT no worker"""
+    worker_exit(None, worker)
+
+def worker_exit(server, worker):
+    """Registra a importação interrompida pelo encerramento (retomada pelo checkpoint)"""
+    try:
+        from main_cloud_run import jobs
+    except Exception:
+        return
+    running = jobs.running()
+    if running is not None:
+        logger.warning(f"Worker {worker.pid} encerrando com a importação {running.id} em andamento; "
+                       f"a próxima execução continua a partir do checkpoint")
@@ -0,0 +1,59 @@
+"""
+Benchmark dos codecs JSON (json_codec) com pedidos no formato real.
+
+Usa o pedido de exemplo (src/fixtures/sample_order.json) para medir:
+  - decodificação de uma resposta do GetOrderByNumber e de uma página do SearchOrders;
+  - codificação das linhas convertidas (NDJSON dos load jobs/staging do MERGE).
+
+Uso: python3 src/benchmark_json_codec.py [--orders 1000] [--repeat 5]
+"""
+
+import os
+import json
+import timeit
+import argparse
+import yaml
+from json_codec import StdlibCodec, OrjsonCodec
+from order_transformer import OrderTransformer
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE = os.path.join(BASE_DIR, 'src', 'fixtures', 'sample_order.json')
+
+def available_codecs():
+    codecs = [StdlibCodec()]
+    try:
+        codecs.append(OrjsonCodec())
+    except ImportError:
+        print("orjson não instalado: apenas a biblioteca padrão será medida")
+    return codecs
+
+def run(count, repeat):
+    with open(FIXTURE, 'r', encoding='utf-8') as file:
+        order = json.load(file)
+    with open(os.path.join(BASE_DIR, 'config', 'config.yaml'), 'r') as file:
+        table_schema = yaml.safe_load(file)['table_schema']
+
+    order_bytes = json.dumps(order, ensure_ascii=False).encode('utf-8')
+    page_bytes = json.dumps({'Result': [order] * count}, ensure_ascii=False).encode('utf-8')
+    rows = [OrderTransformer(table_schema).transform(order) for _ in range(count)]
+
+    cases = [
+        (f"decodificar GetOrderByNumber x{count}", lambda codec: [codec.loads(order_bytes) for _ in range(count)]),
+        (f"decodificar página com {count} pedidos", lambda codec: codec.loads(page_bytes)),
+        (f"codificar {count} linhas (NDJSON)", lambda codec: b'\n'.join(codec.dumps_bytes(row) for row in rows)),
+    ]
+    codecs = available_codecs()
+    for name, fn in cases:
+        print(f"\n{name}")
+        baseline = None
+        for codec in codecs:
+            best = min(timeit.repeat(lambda: fn(codec), number=1, repeat=repeat))
+            baseline = baseline or best
+            print(f"  {codec.name:<8} {best * 1000:8.2f} ms  ({baseline / best:5.1f}x)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark dos codecs JSON')
+    parser.add_argument('--orders', type=int, default=1000, help='Quantidade de pedidos')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetições (usa o melhor tempo)')
+    args = parser.parse_args()
+    run(args.orders, args.repeat)
@@ -0,0 +1,55 @@
+"""
+Benchmark da leitura de páginas do SearchOrders: json.loads da resposta inteira
+(response.json()) vs. json_stream.iter_array_items (stream=True).
+
+Monta respostas com N cópias do pedido de exemplo (src/fixtures/sample_order.json)
+e mede o tempo e o pico de memória do heap Python (tracemalloc) ao percorrer os
+pedidos, sem contar os bytes da resposta simulada.
+
+Uso: python3 src/benchmark_json_stream.py [--chunk-size 65536]
+"""
+
+import os
+import json
+import time
+import argparse
+import tracemalloc
+from json_stream import iter_array_items
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'sample_order.json')
+
+def build_page(size):
+    with open(FIXTURE, 'r', encoding='utf-8') as file:
+        order = json.load(file)
+    return json.dumps({'Result': [order] * size, 'IsValid': True}, ensure_ascii=False).encode('utf-8')
+
+def chunks(data, chunk_size):
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+def measure(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = fn()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+def run(chunk_size):
+    for size in (100, 1000, 5000):
+        data = build_page(size)
+        print(f"\nPágina com {size} pedidos ({len(data) / 2**20:.1f} MiB)")
+        cases = [
+            ('response.json()', lambda: sum(1 for _ in json.loads(b''.join(chunks(data, chunk_size)))['Result'])),
+            ('iter_array_items', lambda: sum(1 for _ in iter_array_items(chunks(data, chunk_size), 'Result'))),
+        ]
+        for name, fn in cases:
+            count, elapsed, peak = measure(fn)
+            print(f"  {name:<18} {count} pedidos  {elapsed * 1000:8.1f} ms  pico {peak / 2**20:7.2f} MiB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark da leitura em streaming do SearchOrders')
+    parser.add_argument('--chunk-size', type=int, default=65536, help='Bytes por bloco lido')
+    args = parser.parse_args()
+    run(args.chunk_size)
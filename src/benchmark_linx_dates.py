@@ -0,0 +1,78 @@
+"""
+Micro-benchmark da conversão de datas LINX.
+
+Compara as duas implementações antigas (linx_api.py e import_historical_orders.py)
+com linx_dates.convert_linx_date (regex + aritmética inteira + cache) e com a
+variante em lote convert_linx_dates.
+
+Uso: python3 src/benchmark_linx_dates.py [--values 20000] [--repeat 5]
+"""
+
+import random
+import timeit
+import argparse
+from datetime import datetime
+from linx_dates import convert_linx_date, convert_linx_dates, _convert_cached, _format_day
+
+def legacy_linx_api(date_str):
+    """Implementação anterior de linx_api.py"""
+    if not date_str or not date_str.startswith('/Date('):
+        return None
+    try:
+        timestamp_str = date_str.split('(')[1].split(')')[0]
+        timestamp = int(timestamp_str.split('-')[0]) / 1000
+        dt = datetime.fromtimestamp(timestamp)
+        return dt.strftime('%Y-%m-%d %H:%M:%S')
+    except Exception:
+        return None
+
+def legacy_import(date_str):
+    """Implementação anterior de import_historical_orders.py"""
+    if not date_str or not isinstance(date_str, str) or not date_str.startswith('/Date('):
+        return None
+    try:
+        timestamp_str = date_str.split('(')[1].split(')')[0]
+        if not timestamp_str:
+            return None
+        if '-' in timestamp_str[1:]:
+            timestamp_ms, offset = timestamp_str.split('-', 1)
+        else:
+            timestamp_ms = timestamp_str
+        if not timestamp_ms:
+            return None
+        timestamp = int(timestamp_ms) / 1000
+        dt = datetime.fromtimestamp(timestamp)
+        return dt.strftime('%Y-%m-%d %H:%M:%S')
+    except Exception:
+        return None
+
+def sample_values(count, distinct_ratio):
+    """Datas no formato LINX; parte delas repetidas (como datas de nascimento)"""
+    distinct = max(1, int(count * distinct_ratio))
+    pool = [f"/Date({random.randint(946684800000, 1767225600000)}-0300)/" for _ in range(distinct)]
+    return [random.choice(pool) for _ in range(count)]
+
+def run(count, repeat):
+    random.seed(42)
+    for ratio in (1.0, 0.1):
+        values = sample_values(count, ratio)
+        print(f"\n{count} datas, {int(ratio * 100)}% distintas")
+        cases = [
+            ('legado linx_api.py', lambda: [legacy_linx_api(v) for v in values]),
+            ('legado import_historical_orders.py', lambda: [legacy_import(v) for v in values]),
+            ('convert_linx_date (cache frio)', lambda: (_convert_cached.cache_clear(), _format_day.cache_clear(), [convert_linx_date(v) for v in values])),
+            ('convert_linx_date (cache quente)', lambda: [convert_linx_date(v) for v in values]),
+            ('convert_linx_dates (lote)', lambda: (_convert_cached.cache_clear(), _format_day.cache_clear(), convert_linx_dates(values))),
+        ]
+        baseline = None
+        for name, fn in cases:
+            best = min(timeit.repeat(fn, number=1, repeat=repeat))
+            baseline = baseline or best
+            print(f"  {name:<38} {best * 1000:8.2f} ms  ({baseline / best:5.1f}x)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark da conversão de datas LINX')
+    parser.add_argument('--values', type=int, default=20000, help='Quantidade de datas')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetições (usa o melhor tempo)')
+    args = parser.parse_args()
+    run(args.values, args.repeat)
@@ -0,0 +1,99 @@
+"""
+Micro-benchmark da conversão de pedidos LINX (OrderTransformer).
+
+Mede o custo de montar o plano e o custo por pedido de transform() usando o
+pedido de exemplo em src/fixtures/sample_order.json, com a quantidade de itens
+original e ampliada (pedidos grandes). Com pyarrow instalado, compara também
+a geração de um lote Parquet linha a linha (transform + from_pylist) com
+ColumnarOrderTransformer.to_record_batch (tempo e pico do heap Python medido
+com tracemalloc; os buffers do Arrow ficam fora dessa medida).
+
+Uso: python3 src/benchmark_order_transformer.py [--orders 20000] [--repeat 5]
+"""
+
+import os
+import copy
+import json
+import timeit
+import argparse
+import tracemalloc
+import yaml
+from order_transformer import OrderTransformer, ColumnarOrderTransformer
+from load_jobs import arrow_schema, _parse_timestamp, _timestamp_paths
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE = os.path.join(BASE_DIR, 'src', 'fixtures', 'sample_order.json')
+
+def load_table_schema():
+    with open(os.path.join(BASE_DIR, 'config', 'config.yaml'), 'r') as file:
+        return yaml.safe_load(file)['table_schema']
+
+def sample_orders(count, items_per_order=None):
+    """Cópias do pedido de exemplo com números distintos"""
+    with open(FIXTURE, 'r', encoding='utf-8') as file:
+        template = json.load(file)
+    if items_per_order:
+        items = template['Items']
+        template['Items'] = [dict(items[i % len(items)]) for i in range(items_per_order)]
+    orders = []
+    for i in range(count):
+        order = copy.deepcopy(template)
+        order['OrderNumber'] = f"PA-{i:09d}"
+        orders.append(order)
+    return orders
+
+def run(count, repeat):
+    table_schema = load_table_schema()
+    best = min(timeit.repeat(lambda: OrderTransformer(table_schema), number=1, repeat=repeat))
+    print(f"Montagem do plano: {best * 1000:.2f} ms")
+
+    transformer = OrderTransformer(table_schema)
+    for items in (None, 50):
+        orders = sample_orders(count, items)
+        label = f"{len(orders[0]['Items'])} itens"
+        best = min(timeit.repeat(lambda: [transformer.transform(order) for order in orders], number=1, repeat=repeat))
+        print(f"  {count} pedidos com {label:<10} {best * 1000:8.2f} ms  ({best / count * 1e6:6.1f} µs/pedido)")
+
+    try:
+        import pyarrow as pa
+    except ImportError:
+        print("pyarrow não instalado: comparação em colunas ignorada")
+        return
+
+    schema = arrow_schema(table_schema)
+    top, nested = _timestamp_paths(table_schema)
+    columnar = ColumnarOrderTransformer(table_schema)
+
+    def by_rows(orders):
+        """Caminho anterior do backfill parquet: um dicionário por pedido/item"""
+        rows = [transformer.transform(order) for order in orders]
+        for row in rows:
+            for name in top:
+                row[name] = _parse_timestamp(row.get(name))
+            for record, sub in nested:
+                for entry in row.get(record) or []:
+                    entry[sub] = _parse_timestamp(entry.get(sub))
+        return pa.RecordBatch.from_pylist(rows, schema=schema)
+
+    def by_columns(orders):
+        return columnar.to_record_batch(orders)[0]
+
+    print(f"\nLote Parquet ({count} pedidos)")
+    for items in (None, 50):
+        orders = sample_orders(count, items)
+        print(f"  {len(orders[0]['Items'])} itens por pedido")
+        for name, fn in (('linha a linha', by_rows), ('em colunas', by_columns)):
+            best = min(timeit.repeat(lambda: fn(orders), number=1, repeat=repeat))
+            tracemalloc.start()
+            fn(orders)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"    {name:<15} {best * 1000:8.2f} ms  ({best / count * 1e6:6.1f} µs/pedido, "
+                  f"pico {peak / 2**20:6.1f} MiB)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark da conversão de pedidos LINX')
+    parser.add_argument('--orders', type=int, default=20000, help='Quantidade de pedidos')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetições (usa o melhor tempo)')
+    args = parser.parse_args()
+    run(args.orders, args.repeat)
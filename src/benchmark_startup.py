@@ -0,0 +1,78 @@
+"""
+Benchmark da inicialização do serviço do Cloud Run (cold start).
+
+Para cada módulo, importa-o em um interpretador novo com python -X importtime e
+mostra o tempo total e os pacotes de maior tempo acumulado:
+  - main_cloud_run: o que o worker do gunicorn carrega antes de atender;
+  - import_historical_orders: o que fica para o aquecimento/primeira importação.
+
+Com --warm-up também mede a criação dos clientes compartilhados (clients.py),
+que requer as credenciais do Google.
+
+Uso: python3 src/benchmark_startup.py [--top 15] [--repeat 3] [--warm-up]
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+MODULES = ('main_cloud_run', 'import_historical_orders')
+
+def import_times(module):
+    """Executa python -X importtime e retorna {pacote: (self_us, cumulativo_us)}"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=SRC_DIR, capture_output=True, text=True, env=dict(os.environ, K_SERVICE='benchmark')
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Falha ao importar {module}: {result.stderr.strip().splitlines()[-1]}")
+    times = {}
+    for line in result.stderr.splitlines():
+        # "import time:       self [us] |  cumulative | imported package"
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # O nível de aninhamento é indicado pela indentação do nome
+        times[name[1:].rstrip()] = (int(self_us), int(cumulative_us))
+    return times
+
+def direct_imports(times):
+    """Pacotes importados diretamente pelo módulo medido (primeiro nível de indentação)"""
+    return {name.strip(): value for name, value in times.items()
+            if name.startswith('  ') and not name.startswith('   ')}
+
+def run(top, repeat):
+    for module in MODULES:
+        # Melhor de `repeat` execuções (o cache de disco do SO afeta a primeira)
+        runs = [import_times(module) for _ in range(repeat)]
+        best = min(runs, key=lambda times: sum(value[0] for value in times.values()))
+        total = sum(value[0] for value in best.values())
+        print(f"\nimport {module}: {total / 1000:.1f} ms ({len(best)} módulos)")
+        heaviest = sorted(direct_imports(best).items(), key=lambda item: item[1][1], reverse=True)[:top]
+        for name, (_, cumulative_us) in heaviest:
+            print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+def warm_up():
+    import time
+    sys.path.insert(0, SRC_DIR)
+    started = time.perf_counter()
+    from import_historical_orders import shared_clients
+    imported = time.perf_counter()
+    shared_clients()
+    created = time.perf_counter()
+    shared_clients()
+    reused = time.perf_counter()
+    print(f"\nAquecimento: import {(imported - started) * 1000:.1f} ms, "
+          f"clientes {(created - imported) * 1000:.1f} ms, reutilização {(reused - created) * 1000:.3f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark da inicialização do serviço')
+    parser.add_argument('--top', type=int, default=15, help='Pacotes exibidos por módulo')
+    parser.add_argument('--repeat', type=int, default=3, help='Execuções por módulo (usa a melhor)')
+    parser.add_argument('--warm-up', action='store_true', help='Mede também a criação dos clientes')
+    args = parser.parse_args()
+    run(args.top, args.repeat)
+    if args.warm_up:
+        warm_up()
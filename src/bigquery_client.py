@@ -1,11 +1,24 @@
 from google.cloud import bigquery
+from google.api_core.exceptions import NotFound, BadRequest
 import yaml
 import os
+import io
+import uuid
 import logging
 import time
+import threading
+from datetime import datetime, timedelta, UTC
+from json_codec import codec_from_config, get_codec
 
 logger = logging.getLogger(__name__)
 
+# Nomes de tipos do GoogleSQL e os equivalentes devolvidos pela API (legado)
+_TYPE_ALIASES = {'INT64': 'INTEGER', 'FLOAT64': 'FLOAT', 'BOOL': 'BOOLEAN', 'STRUCT': 'RECORD'}
+
+# Margem do filtro de partição do MERGE (upsert_rows): cobre o deslocamento
+# de fuso das datas gravadas antes da conversão em UTC
+PARTITION_FILTER_MARGIN_DAYS = 1
+
 class BigQueryClient:
     def __init__(self, config=None):
         """Inicializa o cliente BigQuery com as configurações do arquivo YAML ou dicionário"""
@@ -23,78 +36,354 @@ class BigQueryClient:
                 self.table_id = config['bigquery']['table_id']
                 self.table_schema = config['table_schema']
         
+        # Limites de flush do escritor em buffer (bigquery.write_buffer)
+        self.write_buffer_config = config['bigquery'].get('write_buffer') or {}
+        # Particionamento e clustering da tabela
+        self.time_partitioning = config['bigquery'].get('time_partitioning')
+        self.clustering_fields = config['bigquery'].get('clustering_fields') or None
+        # Modo de escrita: "insert" (streaming), "upsert" (tabela de staging + MERGE)
+        # ou "storage_write" (Storage Write API, sem duplicatas em retentativas)
+        self.write_mode = config['bigquery'].get('write_mode', 'insert')
+        self.storage_write_config = config['bigquery'].get('storage_write') or {}
+        self._storage_sink = None
+        # Codec JSON do NDJSON de staging e da estimativa de tamanho das linhas (json.codec)
+        self.json = codec_from_config(config)
+        
         self.client = bigquery.Client()
         self.table_ref = f"{self.project_id}.{self.dataset_id}.{self.table_id}"
+        # Metadados da tabela de pedidos em cache (None = ainda não verificada)
+        self._table = None
+        self._table_lock = threading.Lock()
+
+    def get_table(self, refresh=False):
+        """Metadados da tabela de pedidos, em cache no processo
+
+        Só consulta o BigQuery na primeira chamada (ou com refresh=True);
+        levanta NotFound se a tabela não existir.
+        """
+        table = self._table
+        if table is None or refresh:
+            table = self.client.get_table(self.table_ref)
+            self._table = table
+        return table
+
+    def invalidate_table_cache(self):
+        """Descarta os metadados em cache (ex.: após recriar ou alterar a tabela por fora)"""
+        self._table = None
 
     def create_table_if_not_exists(self):
-        """Cria a tabela se ela não existir e aguarda até estar disponível"""
-        try:
-            # Verifica se a tabela existe
-            try:
-                table = self.client.get_table(self.table_ref)
-                logger.info(f"Tabela {self.table_ref} já existe")
+        """Cria a tabela se ela não existir e aguarda até estar disponível
+
+        A verificação é feita uma vez por cliente: depois disso os metadados em
+        cache bastam e nenhuma requisição é feita. A tabela só é criada quando o
+        BigQuery responde NotFound; outros erros (rede, permissão) são propagados.
+        """
+        if self._table is not None:
+            return True
+        with self._table_lock:
+            if self._table is not None:
                 return True
-            except Exception:
-                # Cria a tabela se não existir
-                schema = []
-                for field in self.table_schema:
-                    if field.get('type') == 'RECORD':
-                        # Processa campos RECORD
-                        record_fields = []
-                        for subfield in field.get('fields', []):
-                            record_fields.append(
-                                bigquery.SchemaField(
-                                    name=subfield['name'],
-                                    field_type=subfield['type'],
-                                    mode=subfield.get('mode', 'NULLABLE'),
-                                    description=subfield.get('description', '')
-                                )
-                            )
-                        schema.append(
-                            bigquery.SchemaField(
-                                name=field['name'],
-                                field_type=field['type'],
-                                mode=field['mode'],
-                                description=field.get('description', ''),
-                                fields=record_fields
-                            )
-                        )
-                    else:
-                        # Processa campos normais
-                        schema.append(
-                            bigquery.SchemaField(
-                                name=field['name'],
-                                field_type=field['type'],
-                                mode=field['mode'],
-                                description=field.get('description', '')
-                            )
-                        )
+            try:
+                try:
+                    table = self.client.get_table(self.table_ref)
+                except NotFound:
+                    table = None
+                if table is not None:
+                    logger.info(f"Tabela {self.table_ref} já existe")
+                    self._table = table
+                    # Colunas novas do table_schema (ex.: fingerprint) em tabelas antigas
+                    self.add_missing_columns(self._table)
+                    drift = self.check_schema_drift(self._table)
+                    if drift:
+                        logger.warning(f"Schema de {self.table_ref} difere do table_schema: {drift}")
+                    return True
 
-                table = bigquery.Table(self.table_ref, schema=schema)
+                # Cria a tabela se não existir
+                table = bigquery.Table(self.table_ref, schema=self.build_schema())
+                self.apply_table_layout(table)
                 table = self.client.create_table(table)
                 logger.info(f"Tabela {self.table_ref} criada com sucesso")
                 # Aguarda ativamente até a tabela estar disponível
                 for i in range(30):  # até 30 segundos
                     try:
-                        self.client.get_table(self.table_ref)
+                        table = self.client.get_table(self.table_ref)
                         logger.info(f"Tabela {self.table_ref} disponível após {i+1} segundos.")
                         break
-                    except Exception:
+                    except NotFound:
                         time.sleep(1)
                 else:
                     logger.warning(f"Tabela {self.table_ref} pode não estar disponível após 30 segundos.")
+                self._table = table
                 return True
+            except Exception as e:
+                logger.error(f"Erro ao criar tabela: {str(e)}")
+                raise
+
+    def add_missing_columns(self, table=None):
+        """Acrescenta à tabela as colunas do table_schema que ainda não existem
+
+        O BigQuery só permite adicionar colunas NULLABLE (ou REPEATED); colunas
+        REQUIRED ausentes são apenas registradas no log. Retorna os nomes das
+        colunas adicionadas.
+        """
+        table = table or self.get_table()
+        existing = {field.name for field in table.schema}
+        missing = [field for field in self.build_schema() if field.name not in existing]
+        required = [field.name for field in missing if field.mode == 'REQUIRED']
+        if required:
+            logger.warning(f"Colunas REQUIRED ausentes em {self.table_ref} não podem ser adicionadas: {required}")
+        missing = [field for field in missing if field.mode != 'REQUIRED']
+        if not missing:
+            return []
+        table.schema = list(table.schema) + missing
+        self._table = self.client.update_table(table, ['schema'])
+        added = [field.name for field in missing]
+        logger.info(f"Colunas adicionadas a {self.table_ref}: {added}")
+        return added
+
+    def check_schema_drift(self, table=None):
+        """Compara o schema da tabela com o table_schema do config.yaml
+
+        Retorna um dicionário só com as diferenças encontradas (vazio se os
+        schemas coincidem), com os nomes completos dos campos (ex.: items.SKU):
+          missing - campos do table_schema ausentes na tabela
+          extra   - campos da tabela fora do table_schema
+          changed - (campo, esperado, atual) com tipo ou modo diferentes
+        Sem table, consulta a tabela novamente (refresh) em vez de usar o cache.
+        """
+        table = table or self.get_table(refresh=True)
+        drift = {'missing': [], 'extra': [], 'changed': []}
+
+        def describe(field):
+            field_type = _TYPE_ALIASES.get(field.field_type.upper(), field.field_type.upper())
+            return f"{field_type} {field.mode or 'NULLABLE'}"
+
+        def compare(expected, actual, prefix=''):
+            actual_by_name = {field.name.lower(): field for field in actual}
+            for field in expected:
+                name = prefix + field.name
+                live = actual_by_name.pop(field.name.lower(), None)
+                if live is None:
+                    drift['missing'].append(name)
+                    continue
+                if describe(field) != describe(live):
+                    drift['changed'].append((name, describe(field), describe(live)))
+                if field.fields or live.fields:
+                    compare(field.fields, live.fields, name + '.')
+            drift['extra'].extend(prefix + field.name for field in actual_by_name.values())
+
+        compare(self.build_schema(), table.schema)
+        return {kind: fields for kind, fields in drift.items() if fields}
+
+    def build_schema(self):
+        """Monta a lista de SchemaField a partir de table_schema"""
+        schema = []
+        for field in self.table_schema:
+            if field.get('type') == 'RECORD':
+                # Processa campos RECORD
+                record_fields = []
+                for subfield in field.get('fields', []):
+                    record_fields.append(
+                        bigquery.SchemaField(
+                            name=subfield['name'],
+                            field_type=subfield['type'],
+                            mode=subfield.get('mode', 'NULLABLE'),
+                            description=subfield.get('description', '')
+                        )
+                    )
+                schema.append(
+                    bigquery.SchemaField(
+                        name=field['name'],
+                        field_type=field['type'],
+                        mode=field['mode'],
+                        description=field.get('description', ''),
+                        fields=record_fields
+                    )
+                )
+            else:
+                # Processa campos normais
+                schema.append(
+                    bigquery.SchemaField(
+                        name=field['name'],
+                        field_type=field['type'],
+                        mode=field['mode'],
+                        description=field.get('description', '')
+                    )
+                )
+        return schema
+
+    def apply_table_layout(self, table):
+        """Aplica o particionamento e o clustering configurados a um bigquery.Table"""
+        if self.time_partitioning:
+            table.time_partitioning = bigquery.TimePartitioning(
+                type_=self.time_partitioning.get('type', 'DAY'),
+                field=self.time_partitioning.get('field')
+            )
+        if self.clustering_fields:
+            table.clustering_fields = list(self.clustering_fields)
+        return table
+
+    def migrate_table_layout(self, dry_run=False):
+        """Aplica o particionamento/clustering configurados a uma tabela já existente
+
+        O clustering pode ser alterado diretamente na tabela. Mudar o
+        particionamento exige recriar a tabela:
+          1. uma nova tabela é criada pela API com o schema do table_schema
+             (modos REQUIRED e descrições) e o layout configurado;
+          2. os dados são copiados com INSERT ... SELECT e as contagens conferidas;
+          3. a original é copiada (copy job) para <tabela>_backup_<data>;
+          4. a original é removida e a nova é renomeada para o nome original.
+        O passo 4 é o único sem a tabela de produção: se a renomeação falhar, os
+        dados continuam na nova tabela e no backup (o erro indica o comando
+        para concluir). As importações devem estar paradas durante a migração,
+        e tabelas com linhas no buffer de streaming não são migradas.
+        Retorna a lista de ações executadas (ou previstas, se dry_run).
+        """
+        table = self.get_table(refresh=True)
+        actions = []
+
+        current_partitioning = None
+        if table.time_partitioning:
+            current_partitioning = (table.time_partitioning.type_, table.time_partitioning.field)
+        desired_partitioning = None
+        if self.time_partitioning:
+            desired_partitioning = (self.time_partitioning.get('type', 'DAY'), self.time_partitioning.get('field'))
+
+        if current_partitioning != desired_partitioning:
+            suffix = time.strftime('%Y%m%d%H%M%S')
+            migrated_ref = f"{self.project_id}.{self.dataset_id}.{self.table_id}_migrated_{suffix}"
+            backup_ref = f"{self.project_id}.{self.dataset_id}.{self.table_id}_backup_{suffix}"
+            layout = f"particionamento {desired_partitioning or 'nenhum'}, clustering {self.clustering_fields}"
+            actions.append(f"recriar {self.table_ref} com {layout} (backup em {backup_ref})")
+            if table.streaming_buffer is not None:
+                message = (f"{self.table_ref} tem linhas no buffer de streaming; a migração só pode ser feita "
+                           f"após o buffer esvaziar (até ~90 minutos sem inserções via streaming)")
+                if not dry_run:
+                    raise RuntimeError(message)
+                logger.warning(message)
+            if not dry_run:
+                self._recreate_table(table, migrated_ref, backup_ref)
+        elif list(table.clustering_fields or []) != list(self.clustering_fields or []):
+            actions.append(f"alterar clustering de {table.clustering_fields} para {self.clustering_fields}")
+            if not dry_run:
+                table.clustering_fields = list(self.clustering_fields) if self.clustering_fields else None
+                self._table = self.client.update_table(table, ['clustering_fields'])
+
+        for action in actions:
+            logger.info(f"{'[dry-run] ' if dry_run else ''}Migração: {action}")
+        if not actions:
+            logger.info(f"Tabela {self.table_ref} já está com o layout configurado")
+        return actions
+
+    def _recreate_table(self, table, migrated_ref, backup_ref):
+        """Recria a tabela com o layout configurado (passos de migrate_table_layout)"""
+        schema = self.build_schema()
+        existing = {field.name for field in table.schema}
+        required = [field.name for field in schema if field.mode == 'REQUIRED' and field.name not in existing]
+        if required:
+            raise RuntimeError(f"Colunas REQUIRED ausentes em {self.table_ref}: {required}")
+        # Colunas novas do table_schema (NULLABLE) ficam nulas nas linhas copiadas
+        columns = ', '.join(f"`{field.name}`" for field in schema if field.name in existing)
+
+        migrated = self.apply_table_layout(bigquery.Table(migrated_ref, schema=schema))
+        self.client.create_table(migrated)
+        logger.info(f"Migração: tabela {migrated_ref} criada; copiando os dados")
+        self.client.query(
+            f"INSERT INTO `{migrated_ref}` ({columns}) SELECT {columns} FROM `{self.table_ref}`"
+        ).result()
+
+        def count(ref):
+            return next(iter(self.client.query(f"SELECT COUNT(*) AS total FROM `{ref}`").result())).total
+        copied, original = count(migrated_ref), count(self.table_ref)
+        if copied != original:
+            raise RuntimeError(f"Migração interrompida: {copied} linhas em {migrated_ref}, "
+                               f"{original} em {self.table_ref} (a tabela original não foi alterada)")
+
+        copy_config = bigquery.CopyJobConfig(write_disposition='WRITE_EMPTY')
+        self.client.copy_table(self.table_ref, backup_ref, job_config=copy_config).result()
+        logger.info(f"Migração: backup de {original} linhas em {backup_ref}")
+
+        self.client.delete_table(self.table_ref)
+        self.invalidate_table_cache()
+        try:
+            self.client.query(f"ALTER TABLE `{migrated_ref}` RENAME TO `{self.table_id}`").result()
         except Exception as e:
-            logger.error(f"Erro ao criar tabela: {str(e)}")
+            logger.error(f"Migração: falha ao renomear {migrated_ref} para {self.table_id} ({str(e)}). "
+                         f"Os dados estão em {migrated_ref} e em {backup_ref}; conclua com "
+                         f"ALTER TABLE `{migrated_ref}` RENAME TO `{self.table_id}`")
             raise
 
+    def deduplicate_orders(self, key='order_id', start_date=None, end_date=None):
+        """Mantém uma única linha por pedido (a de created_at mais recente)
+
+        As linhas são reescritas em uma transação (tabela temporária
+        deduplicada, DELETE e INSERT), preservando schema, partições e
+        clustering. Com start_date/end_date ("YYYY-MM-DD HH:MM:SS"), só as
+        partições da janela (com a margem de PARTITION_FILTER_MARGIN_DAYS) são
+        lidas e reescritas; sem eles, a tabela inteira.
+
+        Linhas no buffer de streaming não podem ser removidas por DML: com o
+        buffer ocupado (ex.: consumidor da fila em execução) a deduplicação é
+        recusada com RuntimeError. Deve ser usado após cargas via load job
+        (backfill). Retorna o número de duplicatas removidas.
+        """
+        table = self.get_table(refresh=True)
+        if table.streaming_buffer is not None:
+            raise RuntimeError(f"{self.table_ref} tem linhas no buffer de streaming; a deduplicação só pode ser "
+                               f"executada após o buffer esvaziar (até ~90 minutos sem inserções via streaming)")
+
+        # Filtro constante no campo de partição: só as partições da janela são lidas
+        window_filter = 'TRUE'
+        query_parameters = []
+        if start_date or end_date:
+            field = (self.time_partitioning or {}).get('field', 'created_date')
+            field_type = next(schema_field.field_type for schema_field in self.build_schema()
+                              if schema_field.name == field)
+            margin = f"INTERVAL {PARTITION_FILTER_MARGIN_DAYS} DAY"
+            conditions = []
+            if start_date:
+                conditions.append(f"{field} >= {field_type}_SUB(@start_date, {margin})")
+                query_parameters.append(bigquery.ScalarQueryParameter("start_date", field_type, str(start_date)))
+            if end_date:
+                conditions.append(f"{field} <= {field_type}_ADD(@end_date, {margin})")
+                query_parameters.append(bigquery.ScalarQueryParameter("end_date", field_type, str(end_date)))
+            window_filter = ' AND '.join(conditions)
+        job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+
+        query = f"""
+        SELECT COUNT(*) - COUNT(DISTINCT {key}) AS duplicates
+        FROM `{self.table_ref}`
+        WHERE {window_filter}
+        """
+        duplicates = next(iter(self.client.query(query, job_config=job_config).result())).duplicates
+        if not duplicates:
+            logger.info("Nenhum registro duplicado encontrado.")
+            return 0
+
+        self.client.query(
+            f"""
+            BEGIN TRANSACTION;
+            CREATE TEMP TABLE deduplicated AS
+            SELECT * FROM `{self.table_ref}`
+            WHERE {window_filter}
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY {key} ORDER BY created_at DESC) = 1;
+            DELETE FROM `{self.table_ref}` WHERE {window_filter};
+            INSERT INTO `{self.table_ref}` SELECT * FROM deduplicated;
+            COMMIT TRANSACTION;
+            """,
+            job_config=job_config
+        ).result()
+        logger.info(f"{duplicates} registros duplicados removidos de {self.table_ref}"
+                    f"{f' entre {start_date} e {end_date}' if start_date or end_date else ''}")
+        return duplicates
+
     def insert_rows(self, rows):
         """Insere linhas na tabela"""
         try:
             # Garante que a tabela existe
             self.create_table_if_not_exists()
             
-            errors = self.client.insert_rows_json(self.table_ref, rows)
+            errors = self.write_rows_detailed(rows)
             if errors:
                 logger.error(f"Erro ao inserir linhas: {errors}")
                 return False
@@ -104,6 +393,157 @@ class BigQueryClient:
             logger.error(f"Erro ao inserir linhas: {str(e)}")
             raise
 
+    def insert_rows_detailed(self, rows):
+        """Insere linhas em uma única requisição e retorna os erros por linha
+
+        Retorna um dicionário {índice da linha: lista de erros}; vazio se todas
+        as linhas foram inseridas.
+        """
+        if not rows:
+            return {}
+        errors = self.client.insert_rows_json(self.table_ref, rows)
+        return {entry['index']: entry.get('errors', []) for entry in errors or []}
+
+    def write_rows_detailed(self, rows):
+        """Grava linhas conforme o write_mode configurado e retorna os erros por linha"""
+        if self.write_mode == 'upsert':
+            try:
+                self.upsert_rows(rows)
+            except BadRequest as e:
+                if 'streaming buffer' not in str(e).lower():
+                    raise
+                # Algum pedido do lote ainda está no buffer de streaming: o MERGE
+                # inteiro é recusado, mas os demais lotes seguem normalmente
+                logger.warning(f"MERGE de {len(rows)} linhas recusado (buffer de streaming): {str(e)}")
+                return {index: [{'reason': 'streamingBuffer', 'message': str(e)}] for index in range(len(rows))}
+            return {}
+        if self.write_mode == 'storage_write':
+            return self.storage_write_sink().write_rows_detailed(rows) if rows else {}
+        return self.insert_rows_detailed(rows)
+
+    def storage_write_sink(self):
+        """StorageWriteSink da tabela de pedidos, criado na primeira gravação"""
+        if self._storage_sink is None:
+            with self._table_lock:
+                if self._storage_sink is None:
+                    from storage_write import StorageWriteSink
+                    self._storage_sink = StorageWriteSink(
+                        self.table_ref, self.table_schema,
+                        stream_type=self.storage_write_config.get('stream_type', 'committed'),
+                        max_attempts=self.storage_write_config.get('max_attempts', 5)
+                    )
+        return self._storage_sink
+
+    def finish_writes(self):
+        """Encerra as gravações em andamento ao fechar um escritor
+
+        No write_mode storage_write finaliza o stream committed em uso; os
+        próximos lotes abrem outro stream.
+        """
+        if self._storage_sink is not None:
+            self._storage_sink.close()
+
+    def upsert_rows(self, rows, key='order_id'):
+        """Grava linhas de forma idempotente: staging + um único MERGE na tabela
+
+        O lote é carregado em uma tabela de staging temporária (load job, sem
+        streaming) e depois mesclado pela chave: pedidos existentes são
+        atualizados e pedidos novos inseridos. Retorna o número de linhas
+        afetadas pelo MERGE.
+
+        Com particionamento configurado, o MERGE só lê as partições entre o
+        menor e o maior valor do campo de partição do lote, com uma margem de
+        PARTITION_FILTER_MARGIN_DAYS de cada lado. O campo (ex.: created_date)
+        não deveria mudar entre versões de um pedido, mas linhas gravadas antes
+        da conversão de datas em UTC têm o horário deslocado pelo fuso; a margem
+        cobre esse deslocamento, e um pedido assim é encontrado e atualizado em
+        vez de ganhar uma segunda linha.
+        """
+        if not rows:
+            return 0
+        schema = self.build_schema()
+        staging_id = f"{self.table_id}_staging_{uuid.uuid4().hex}"
+        staging_ref = f"{self.project_id}.{self.dataset_id}.{staging_id}"
+
+        # A tabela de staging expira sozinha caso a remoção abaixo não aconteça
+        staging_table = bigquery.Table(staging_ref, schema=schema)
+        staging_table.expires = datetime.now(UTC) + timedelta(days=1)
+        self.client.create_table(staging_table)
+        try:
+            job_config = bigquery.LoadJobConfig(
+                schema=schema,
+                source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+                write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+            )
+            payload = b'\n'.join(self.json.dumps_bytes(row) for row in rows)
+            self.client.load_table_from_file(io.BytesIO(payload), staging_ref, job_config=job_config).result()
+
+            columns = [field.name for field in schema]
+            # Filtro constante no ON: permite ao BigQuery descartar as demais partições
+            partition_filter = ''
+            query_parameters = []
+            partition_field = (self.time_partitioning or {}).get('field')
+            partition_values = [row.get(partition_field) for row in rows] if partition_field else []
+            if partition_values and all(partition_values):
+                partition_type = next(field.field_type for field in schema if field.name == partition_field)
+                margin = f"INTERVAL {PARTITION_FILTER_MARGIN_DAYS} DAY"
+                partition_filter = (f"AND t.{partition_field} BETWEEN {partition_type}_SUB(@partition_start, {margin}) "
+                                    f"AND {partition_type}_ADD(@partition_end, {margin})")
+                query_parameters = [
+                    bigquery.ScalarQueryParameter("partition_start", partition_type, min(partition_values)),
+                    bigquery.ScalarQueryParameter("partition_end", partition_type, max(partition_values))
+                ]
+            updates = ',\n                '.join(f"{column} = s.{column}" for column in columns if column != key)
+            merge_query = f"""
+            MERGE `{self.table_ref}` t
+            USING (
+                SELECT * EXCEPT(_rn) FROM (
+                    SELECT *, ROW_NUMBER() OVER (PARTITION BY {key} ORDER BY created_at DESC) AS _rn
+                    FROM `{staging_ref}`
+                )
+                WHERE _rn = 1
+            ) s
+            ON t.{key} = s.{key} {partition_filter}
+            WHEN MATCHED THEN UPDATE SET
+                {updates}
+            WHEN NOT MATCHED THEN INSERT ({', '.join(columns)})
+                VALUES ({', '.join(f's.{column}' for column in columns)})
+            """
+            merge_job = self.client.query(merge_query,
+                                          job_config=bigquery.QueryJobConfig(query_parameters=query_parameters))
+            merge_job.result()
+            affected = merge_job.num_dml_affected_rows or 0
+            logger.info(f"MERGE de {len(rows)} linhas em {self.table_ref}: {affected} linhas afetadas")
+            return affected
+        finally:
+            self.client.delete_table(staging_ref, not_found_ok=True)
+
+    def load_file(self, path, file_format='ndjson'):
+        """Carrega um arquivo local (NDJSON ou Parquet) na tabela com um load job"""
+        job_config = bigquery.LoadJobConfig(
+            source_format=(bigquery.SourceFormat.PARQUET if file_format == 'parquet'
+                           else bigquery.SourceFormat.NEWLINE_DELIMITED_JSON),
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+            schema=self.build_schema()
+        )
+        if file_format == 'parquet':
+            # Listas do Parquet (pa.list_) viram colunas REPEATED, e não
+            # registros <coluna>.list.element
+            parquet_options = bigquery.ParquetOptions()
+            parquet_options.enable_list_inference = True
+            job_config.parquet_options = parquet_options
+        with open(path, 'rb') as source:
+            job = self.client.load_table_from_file(source, self.table_ref, job_config=job_config)
+        job.result()
+        return job
+
+    def buffered_writer(self, **overrides):
+        """Cria um escritor em buffer usando os limites de bigquery.write_buffer"""
+        settings = dict(self.write_buffer_config)
+        settings.update(overrides)
+        settings.setdefault('json_codec', self.json)
+        return BufferedWriter(self, **settings)
+
     def check_order_exists(self, value, by_number=False):
         """Verifica se um pedido já existe na tabela por order_id ou order_number"""
         try:
@@ -134,6 +574,73 @@ class BigQueryClient:
             logger.error(f"Erro ao verificar existência do pedido: {str(e)}")
             return False
 
+    def get_existing_order_keys(self, order_ids=None, order_numbers=None):
+        """Retorna os order_id e order_number já existentes na tabela com uma única consulta"""
+        order_ids = [str(value) for value in (order_ids or []) if value]
+        order_numbers = [str(value) for value in (order_numbers or []) if value]
+        if not order_ids and not order_numbers:
+            return set(), set()
+
+        query = f"""
+        SELECT DISTINCT order_id, order_number
+        FROM `{self.table_ref}`
+        WHERE order_id IN UNNEST(@ids) OR order_number IN UNNEST(@numbers)
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("ids", "STRING", order_ids),
+                bigquery.ArrayQueryParameter("numbers", "STRING", order_numbers)
+            ]
+        )
+        results = self.client.query(query, job_config=job_config).result()
+        existing_ids = set()
+        existing_numbers = set()
+        for row in results:
+            existing_ids.add(row.order_id)
+            existing_numbers.add(row.order_number)
+        return existing_ids, existing_numbers
+
+    def get_all_order_keys(self):
+        """Retorna todos os order_id e order_number da tabela"""
+        query = f"""
+        SELECT DISTINCT order_id, order_number
+        FROM `{self.table_ref}`
+        """
+        results = self.client.query(query).result()
+        existing_ids = set()
+        existing_numbers = set()
+        for row in results:
+            existing_ids.add(row.order_id)
+            existing_numbers.add(row.order_number)
+        return existing_ids, existing_numbers
+
+    def get_order_fingerprints(self, order_ids=None):
+        """Retorna {order_id: (fingerprint, written_at)} dos pedidos informados (todos, se None)
+
+        Com linhas duplicadas de um pedido vale a gravada por último (created_at),
+        que também dá o written_at. Pedidos sem fingerprint (importados antes da
+        detecção de alterações) aparecem com fingerprint None.
+        """
+        where = ""
+        query_parameters = []
+        if order_ids is not None:
+            order_ids = [str(value) for value in order_ids if value]
+            if not order_ids:
+                return {}
+            where = "WHERE order_id IN UNNEST(@ids)"
+            query_parameters.append(bigquery.ArrayQueryParameter("ids", "STRING", order_ids))
+
+        query = f"""
+        SELECT order_id, ARRAY_AGG(fingerprint ORDER BY created_at DESC LIMIT 1)[OFFSET(0)] AS fingerprint,
+               MAX(created_at) AS written_at
+        FROM `{self.table_ref}`
+        {where}
+        GROUP BY order_id
+        """
+        job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+        results = self.client.query(query, job_config=job_config).result()
+        return {row.order_id: (row.fingerprint, row.written_at) for row in results}
+
     def get_last_order_date(self):
         """Retorna a data do último pedido importado"""
         try:
@@ -158,4 +665,205 @@ class BigQueryClient:
                 
         except Exception as e:
             logger.error(f"Erro ao obter data do último pedido: {str(e)}")
-            return None 
\ No newline at end of file
+            return None
+
+
+# Motivos de erro do insert_rows_json que indicam que a linha pode ser reenviada.
+# "stopped" é devolvido para linhas válidas de um lote que contém alguma inválida.
+RETRYABLE_ROW_REASONS = {'stopped', 'backendError', 'internalError', 'timeout', 'rateLimitExceeded'}
+
+
+class BufferedWriter:
+    """Acumula linhas e as envia ao BigQuery em lotes.
+
+    O buffer é descarregado quando atinge o número máximo de linhas, o tamanho
+    máximo em bytes ou a idade máxima da linha mais antiga. Cada flush retorna
+    as chaves inseridas e as falhas por linha; linhas recusadas apenas por
+    causa de outras linhas do lote são reenviadas individualmente.
+    """
+
+    def __init__(self, bq_client, max_rows=500, max_bytes=5 * 1024 * 1024,
+                 max_age_seconds=30, max_row_retries=2, json_codec=None):
+        self.bq_client = bq_client
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.max_row_retries = max_row_retries
+        self.json = json_codec or get_codec()
+        self._rows = []
+        self._keys = []
+        self._bytes = 0
+        self._oldest = None
+        self._table_checked = False
+        self.requests = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, row, key=None):
+        """Adiciona uma linha; retorna o resultado do flush se ele ocorrer"""
+        size = len(self.json.dumps_bytes(row))
+        # Garante que um lote nunca ultrapasse o limite de bytes
+        if self._rows and self._bytes + size > self.max_bytes:
+            result = self.flush()
+            self._append(row, key, size)
+            return result
+        self._append(row, key, size)
+        if self.should_flush():
+            return self.flush()
+        return None
+
+    def _append(self, row, key, size):
+        if not self._rows:
+            self._oldest = time.monotonic()
+        self._rows.append(row)
+        self._keys.append(key)
+        self._bytes += size
+
+    def should_flush(self):
+        """Indica se algum dos limites de flush foi atingido"""
+        if not self._rows:
+            return False
+        if len(self._rows) >= self.max_rows or self._bytes >= self.max_bytes:
+            return True
+        return time.monotonic() - self._oldest >= self.max_age_seconds
+
+    def flush(self):
+        """Envia as linhas acumuladas
+
+        Retorna (inserted, failed): a lista de chaves inseridas e uma lista de
+        dicionários {'key', 'row', 'errors'} das linhas que falharam.
+        """
+        rows, keys = self._rows, self._keys
+        self._rows, self._keys, self._bytes, self._oldest = [], [], 0, None
+        if not rows:
+            return [], []
+
+        if not self._table_checked:
+            self.bq_client.create_table_if_not_exists()
+            self._table_checked = True
+
+        inserted = []
+        failed = []
+        pending = list(zip(keys, rows))
+        attempt = 0
+        while pending:
+            batch_rows = [row for _, row in pending]
+            try:
+                self.requests += 1
+                row_errors = self.bq_client.write_rows_detailed(batch_rows)
+            except Exception as e:
+                logger.error(f"Erro ao enviar lote de {len(batch_rows)} linhas: {str(e)}")
+                row_errors = {index: [{'reason': 'requestError', 'message': str(e)}]
+                              for index in range(len(batch_rows))}
+
+            retry = []
+            for index, (key, row) in enumerate(pending):
+                errors = row_errors.get(index)
+                if not errors:
+                    inserted.append(key)
+                elif attempt < self.max_row_retries and all(
+                        error.get('reason') in RETRYABLE_ROW_REASONS for error in errors):
+                    retry.append((key, row))
+                else:
+                    failed.append({'key': key, 'row': row, 'errors': errors})
+            pending = retry
+            attempt += 1
+
+        if failed:
+            logger.error(f"{len(failed)} linhas falharam no lote: {[entry['key'] for entry in failed]}")
+        logger.info(f"{len(inserted)} linhas inseridas em lote")
+        return inserted, failed
+
+    def close(self):
+        """Descarrega o que restar no buffer e encerra as gravações do cliente"""
+        try:
+            return self.flush()
+        finally:
+            self.bq_client.finish_writes()
+
+
+class KnownOrderIndex:
+    """Índice em memória dos pedidos já existentes no BigQuery.
+
+    Pode ser carregado inteiro uma vez por execução (preload) ou sob demanda,
+    com uma única consulta por página de pedidos. As verificações de
+    existência passam a ser buscas O(1) em conjuntos.
+
+    Com track_fingerprints=True também guarda o fingerprint gravado de cada
+    pedido e a data da gravação (detecção de alterações), com uma consulta
+    adicional por página.
+    """
+
+    def __init__(self, bq_client, preload=False, track_fingerprints=False):
+        self.bq_client = bq_client
+        self.order_ids = set()
+        self.order_numbers = set()
+        self.track_fingerprints = track_fingerprints
+        # {order_id: fingerprint} e {order_id: created_at da última linha} dos pedidos existentes
+        self.fingerprints = {}
+        self.written_at = {}
+        # Chaves já consultadas no BigQuery (existentes ou não)
+        self._checked_ids = set()
+        self._checked_numbers = set()
+        self.fully_loaded = False
+        self.queries = 0
+        if preload:
+            self.preload()
+
+    def preload(self):
+        """Carrega todas as chaves da tabela de uma só vez"""
+        self.order_ids, self.order_numbers = self.bq_client.get_all_order_keys()
+        self.queries += 1
+        if self.track_fingerprints:
+            self._add_fingerprints(self.bq_client.get_order_fingerprints())
+            self.queries += 1
+        self.fully_loaded = True
+        logger.info(f"Índice de pedidos carregado: {len(self.order_ids)} pedidos conhecidos")
+
+    def ensure(self, orders):
+        """Garante que as chaves de uma página de pedidos estejam no índice"""
+        if self.fully_loaded:
+            return
+        ids = {str(order.get('OrderID', '')) for order in orders} - self._checked_ids
+        numbers = {str(order.get('OrderNumber', '')) for order in orders} - self._checked_numbers
+        ids.discard('')
+        numbers.discard('')
+        if not ids and not numbers:
+            return
+        existing_ids, existing_numbers = self.bq_client.get_existing_order_keys(ids, numbers)
+        self.queries += 1
+        self.order_ids.update(existing_ids)
+        self.order_numbers.update(existing_numbers)
+        if self.track_fingerprints and existing_ids:
+            self._add_fingerprints(self.bq_client.get_order_fingerprints(existing_ids))
+            self.queries += 1
+        self._checked_ids.update(ids)
+        self._checked_numbers.update(numbers)
+
+    def _add_fingerprints(self, fingerprints):
+        for order_id, (fingerprint, written_at) in fingerprints.items():
+            self.fingerprints[order_id] = fingerprint
+            self.written_at[order_id] = written_at
+
+    def contains(self, order_id=None, order_number=None):
+        """Verifica se o pedido já existe por order_id ou order_number"""
+        return (order_id in self.order_ids) or (order_number in self.order_numbers)
+
+    def fingerprint(self, order_id):
+        """Fingerprint gravado do pedido (None se desconhecido ou sem fingerprint)"""
+        return self.fingerprints.get(order_id)
+
+    def written_since(self, order_id, since):
+        """Indica se a última linha do pedido foi gravada após since (datetime em UTC)"""
+        written_at = self.written_at.get(order_id)
+        return written_at is not None and written_at > since
+
+    def add(self, order_id, order_number, fingerprint=None):
+        """Registra um pedido recém-inserido"""
+        if order_id:
+            self.order_ids.add(str(order_id))
+            if fingerprint:
+                self.fingerprints[str(order_id)] = fingerprint
+        if order_number:
+            self.order_numbers.add(str(order_number))
@@ -0,0 +1,191 @@
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime, UTC
+from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
+
+logger = logging.getLogger(__name__)
+
+# Um checkpoint é um dicionário com:
+#   since             -> limite inferior (CreatedDate) usado no filtro da execução em andamento
+#   page_index        -> próxima página a processar (as anteriores já foram gravadas)
+#   last_created_date -> maior created_date já gravado no BigQuery
+#   in_flight         -> números dos pedidos que falharam na página page_index (reprocessados na retomada)
+#   updated_at        -> data da última atualização (UTC)
+
+def new_checkpoint(since=None, page_index=0, last_created_date=None, in_flight=None):
+    """Cria um checkpoint com os campos padrão"""
+    return {
+        'since': since,
+        'page_index': page_index,
+        'last_created_date': last_created_date,
+        'in_flight': list(in_flight or []),
+        'updated_at': datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+class SQLiteCheckpointStore:
+    """Checkpoints em um arquivo SQLite local (testes e execuções locais)"""
+
+    def __init__(self, path='checkpoints.db'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                name TEXT PRIMARY KEY,
+                since TEXT,
+                page_index INTEGER NOT NULL,
+                last_created_date TEXT,
+                in_flight TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def load(self, name):
+        """Retorna o checkpoint salvo ou None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT since, page_index, last_created_date, in_flight, updated_at FROM checkpoints WHERE name = ?",
+                (name,)
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            'since': row[0],
+            'page_index': row[1],
+            'last_created_date': row[2],
+            'in_flight': json.loads(row[3]),
+            'updated_at': row[4]
+        }
+
+    def save(self, name, checkpoint):
+        """Grava (ou substitui) o checkpoint"""
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO checkpoints (name, since, page_index, last_created_date, in_flight, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (name, checkpoint.get('since'), checkpoint.get('page_index', 0), checkpoint.get('last_created_date'),
+                 json.dumps(checkpoint.get('in_flight') or []), checkpoint['updated_at'])
+            )
+            self._conn.commit()
+
+    def delete(self, name):
+        """Remove o checkpoint"""
+        with self._lock:
+            self._conn.execute("DELETE FROM checkpoints WHERE name = ?", (name,))
+            self._conn.commit()
+
+
+class BigQueryCheckpointStore:
+    """Checkpoints em uma pequena tabela de metadados no BigQuery (produção)
+
+    A tabela tem uma linha por nome de checkpoint, então a leitura não depende
+    do tamanho da tabela de pedidos.
+    """
+
+    def __init__(self, bq_client, table_id='import_checkpoints'):
+        self.client = bq_client.client
+        self.table_ref = f"{bq_client.project_id}.{bq_client.dataset_id}.{table_id}"
+        # A tabela só é criada na primeira execução; depois basta ler os metadados
+        try:
+            self.client.get_table(self.table_ref)
+            return
+        except NotFound:
+            pass
+        logger.info(f"Criando a tabela de checkpoints {self.table_ref}")
+        self.client.query(
+            f"""
+            CREATE TABLE IF NOT EXISTS `{self.table_ref}` (
+                name STRING NOT NULL,
+                since STRING,
+                page_index INT64 NOT NULL,
+                last_created_date STRING,
+                in_flight ARRAY<STRING>,
+                updated_at TIMESTAMP NOT NULL
+            )
+            """
+        ).result()
+
+    def load(self, name):
+        """Retorna o checkpoint salvo ou None"""
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ScalarQueryParameter("name", "STRING", name)]
+        )
+        rows = list(self.client.query(
+            f"""
+            SELECT since, page_index, last_created_date, in_flight,
+                   FORMAT_TIMESTAMP('%Y-%m-%d %H:%M:%S', updated_at) AS updated_at
+            FROM `{self.table_ref}`
+            WHERE name = @name
+            LIMIT 1
+            """,
+            job_config=job_config
+        ).result())
+        if not rows:
+            return None
+        row = rows[0]
+        return {
+            'since': row.since,
+            'page_index': row.page_index,
+            'last_created_date': row.last_created_date,
+            'in_flight': list(row.in_flight or []),
+            'updated_at': row.updated_at
+        }
+
+    def save(self, name, checkpoint):
+        """Grava (ou substitui) o checkpoint com um MERGE"""
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("name", "STRING", name),
+                bigquery.ScalarQueryParameter("since", "STRING", checkpoint.get('since')),
+                bigquery.ScalarQueryParameter("page_index", "INT64", checkpoint.get('page_index', 0)),
+                bigquery.ScalarQueryParameter("last_created_date", "STRING", checkpoint.get('last_created_date')),
+                bigquery.ArrayQueryParameter("in_flight", "STRING", list(checkpoint.get('in_flight') or [])),
+                bigquery.ScalarQueryParameter("updated_at", "TIMESTAMP", checkpoint['updated_at'])
+            ]
+        )
+        self.client.query(
+            f"""
+            MERGE `{self.table_ref}` t
+            USING (SELECT @name AS name) s
+            ON t.name = s.name
+            WHEN MATCHED THEN UPDATE SET
+                since = @since, page_index = @page_index, last_created_date = @last_created_date,
+                in_flight = @in_flight, updated_at = @updated_at
+            WHEN NOT MATCHED THEN INSERT (name, since, page_index, last_created_date, in_flight, updated_at)
+                VALUES (@name, @since, @page_index, @last_created_date, @in_flight, @updated_at)
+            """,
+            job_config=job_config
+        ).result()
+
+    def delete(self, name):
+        """Remove o checkpoint"""
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ScalarQueryParameter("name", "STRING", name)]
+        )
+        self.client.query(f"DELETE FROM `{self.table_ref}` WHERE name = @name", job_config=job_config).result()
+
+
+def create_checkpoint_store(config, bq_client=None):
+    """Cria o armazenamento de checkpoints conforme a seção checkpoint do config.yaml
+
+    Retorna None quando o backend é "none".
+    """
+    settings = config.get('checkpoint') or {}
+    backend = settings.get('backend', 'sqlite')
+    if backend == 'none':
+        return None
+    if backend == 'sqlite':
+        return SQLiteCheckpointStore(settings.get('sqlite_path', 'checkpoints.db'))
+    if backend == 'bigquery':
+        if bq_client is None:
+            raise ValueError("O backend 'bigquery' de checkpoint requer um BigQueryClient")
+        return BigQueryCheckpointStore(bq_client, settings.get('table_id', 'import_checkpoints'))
+    raise ValueError(f"Backend de checkpoint desconhecido: {backend}")
@@ -14,7 +14,11 @@ logger = logging.getLogger(__name__)
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.join(os.path.dirname(os.path.dirname(__file__)), "credentials", "datalake-betminds.json")
 
 def clear_duplicates():
-    """Remove registros duplicados do BigQuery, mantendo apenas o mais recente de cada pedido"""
+    """Remove registros duplicados do BigQuery, mantendo apenas o mais recente de cada pedido
+
+    Necessário apenas com bigquery.write_mode "insert"; no modo "upsert" o MERGE
+    não gera duplicatas.
+    """
     try:
         # Inicializa o cliente BigQuery
         bq_client = BigQueryClient()
@@ -0,0 +1,48 @@
+import os
+import threading
+import yaml
+
+# Instâncias únicas por processo (configuração e clientes), criadas na
+# primeira utilização e reaproveitadas entre as requisições do Cloud Run
+_instances = {}
+# RLock: a criação de uma instância pode depender de outra (ex.: config)
+_lock = threading.RLock()
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config', 'config.yaml')
+
+def shared(name, factory):
+    """Retorna a instância `name` do processo, criando-a com factory() na primeira chamada"""
+    try:
+        return _instances[name]
+    except KeyError:
+        pass
+    with _lock:
+        if name not in _instances:
+            _instances[name] = factory()
+        return _instances[name]
+
+def reset(name=None):
+    """Descarta uma instância (ou todas); a próxima chamada a recria"""
+    with _lock:
+        if name is None:
+            _instances.clear()
+        else:
+            _instances.pop(name, None)
+
+def get_config():
+    """config.yaml lido uma vez por processo
+
+    O dicionário é compartilhado: quem precisar alterá-lo deve usar uma cópia
+    (copy.deepcopy).
+    """
+    def read():
+        with open(CONFIG_PATH, 'r') as file:
+            return yaml.safe_load(file)
+    return shared('config', read)
+
+def get_bq_client():
+    """BigQueryClient do processo (um único bigquery.Client, autenticado uma vez)"""
+    def create():
+        from bigquery_client import BigQueryClient
+        return BigQueryClient(get_config())
+    return shared('bq_client', create)
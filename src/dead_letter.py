@@ -0,0 +1,202 @@
+import sqlite3
+import logging
+import threading
+from datetime import datetime, UTC
+from google.api_core.exceptions import NotFound
+from json_codec import get_codec, codec_from_config
+
+logger = logging.getLogger(__name__)
+
+# Uma entrada de dead-letter é um dicionário com:
+#   key            -> chave do item (OrderNumber, no consumidor da fila)
+#   queue_item_ids -> QueueItemIDs removidos da fila junto com a entrada
+#   stage          -> estágio em que o item falhou (detalhes, transformacao, carga)
+#   error          -> última mensagem de erro
+#   payload        -> conteúdo bruto (itens da fila e pedido, quando obtido)
+#   attempts       -> tentativas feitas até desistir
+#   created_at     -> data da gravação (UTC)
+
+def new_dead_letter(key, stage, error, payload=None, attempts=1, queue_item_ids=None):
+    """Cria uma entrada de dead-letter com os campos padrão"""
+    return {
+        'key': str(key),
+        'queue_item_ids': [str(item_id) for item_id in (queue_item_ids or [])],
+        'stage': stage,
+        'error': str(error),
+        'payload': payload,
+        'attempts': attempts,
+        'created_at': datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+class SQLiteDeadLetterStore:
+    """Dead-letters e contagem de tentativas em um arquivo SQLite local
+
+    As tentativas de cada chave são persistidas, então o limite vale entre
+    execuções do consumidor.
+    """
+
+    def __init__(self, path='dead_letters.db', json_codec=None):
+        self.path = path
+        self.json = json_codec or get_codec()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS failures (
+                key TEXT PRIMARY KEY,
+                attempts INTEGER NOT NULL,
+                last_error TEXT,
+                updated_at TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                queue_item_ids TEXT NOT NULL,
+                stage TEXT,
+                error TEXT,
+                payload TEXT,
+                attempts INTEGER NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def record_failure(self, key, error):
+        """Registra uma falha da chave e retorna o total de tentativas"""
+        now = datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO failures (key, attempts, last_error, updated_at) VALUES (?, 1, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET attempts = attempts + 1, last_error = excluded.last_error,
+                    updated_at = excluded.updated_at
+                """,
+                (str(key), str(error), now)
+            )
+            attempts = self._conn.execute("SELECT attempts FROM failures WHERE key = ?", (str(key),)).fetchone()[0]
+            self._conn.commit()
+        return attempts
+
+    def reset(self, keys):
+        """Zera as tentativas das chaves processadas com sucesso"""
+        keys = [str(key) for key in keys]
+        if not keys:
+            return
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                self._conn.execute(f"DELETE FROM failures WHERE key IN ({', '.join('?' * len(batch))})", batch)
+            self._conn.commit()
+
+    def add(self, entry):
+        """Grava uma entrada de dead-letter e zera as tentativas da chave"""
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO dead_letters (key, queue_item_ids, stage, error, payload, attempts, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (entry['key'], self.json.dumps(entry['queue_item_ids']), entry['stage'], entry['error'],
+                 self.json.dumps(entry['payload']), entry['attempts'], entry['created_at'])
+            )
+            self._conn.execute("DELETE FROM failures WHERE key = ?", (entry['key'],))
+            self._conn.commit()
+
+    def list(self, limit=100):
+        """Entradas mais recentes"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, queue_item_ids, stage, error, payload, attempts, created_at "
+                "FROM dead_letters ORDER BY id DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [{
+            'key': row[0],
+            'queue_item_ids': self.json.loads(row[1]),
+            'stage': row[2],
+            'error': row[3],
+            'payload': self.json.loads(row[4]) if row[4] else None,
+            'attempts': row[5],
+            'created_at': row[6]
+        } for row in rows]
+
+
+class BigQueryDeadLetterStore:
+    """Dead-letters em uma tabela do BigQuery (produção)
+
+    As entradas são gravadas com insert_rows_json; as tentativas são contadas
+    em memória (o consumidor roda continuamente, e após um reinício cada item
+    recebe um novo limite de tentativas).
+    """
+
+    def __init__(self, bq_client, table_id='queue_dead_letters', json_codec=None):
+        self.client = bq_client.client
+        self.table_ref = f"{bq_client.project_id}.{bq_client.dataset_id}.{table_id}"
+        self.json = json_codec or get_codec()
+        self._attempts = {}
+        self._lock = threading.Lock()
+        # A tabela só é criada na primeira execução; depois basta ler os metadados
+        try:
+            self.client.get_table(self.table_ref)
+            return
+        except NotFound:
+            pass
+        logger.info(f"Criando a tabela de dead-letters {self.table_ref}")
+        self.client.query(
+            f"""
+            CREATE TABLE IF NOT EXISTS `{self.table_ref}` (
+                key STRING NOT NULL,
+                queue_item_ids ARRAY<STRING>,
+                stage STRING,
+                error STRING,
+                payload STRING,
+                attempts INT64 NOT NULL,
+                created_at TIMESTAMP NOT NULL
+            )
+            """
+        ).result()
+
+    def record_failure(self, key, error):
+        """Registra uma falha da chave e retorna o total de tentativas"""
+        with self._lock:
+            attempts = self._attempts.get(str(key), 0) + 1
+            self._attempts[str(key)] = attempts
+        return attempts
+
+    def reset(self, keys):
+        """Zera as tentativas das chaves processadas com sucesso"""
+        with self._lock:
+            for key in keys:
+                self._attempts.pop(str(key), None)
+
+    def add(self, entry):
+        """Grava uma entrada de dead-letter e zera as tentativas da chave"""
+        row = dict(entry, payload=self.json.dumps(entry['payload']))
+        errors = self.client.insert_rows_json(self.table_ref, [row])
+        if errors:
+            raise RuntimeError(f"Erro ao gravar dead-letter {entry['key']}: {errors}")
+        self.reset([entry['key']])
+
+
+def create_dead_letter_store(config, bq_client=None):
+    """Cria o armazenamento de dead-letters conforme a seção dead_letter do config.yaml
+
+    Retorna None quando o backend é "none" (itens com falha voltam à fila indefinidamente).
+    """
+    settings = config.get('dead_letter') or {}
+    backend = settings.get('backend', 'sqlite')
+    if backend == 'none':
+        return None
+    if backend == 'sqlite':
+        return SQLiteDeadLetterStore(settings.get('sqlite_path', 'dead_letters.db'), json_codec=codec_from_config(config))
+    if backend == 'bigquery':
+        if bq_client is None:
+            raise ValueError("O backend 'bigquery' de dead-letter requer um BigQueryClient")
+        return BigQueryDeadLetterStore(bq_client, settings.get('table_id', 'queue_dead_letters'),
+                                       json_codec=codec_from_config(config))
+    raise ValueError(f"Backend de dead-letter desconhecido: {backend}")
@@ -1,12 +1,18 @@
 import os
-import time
+import copy
 import logging
 import yaml
-import requests
-from datetime import datetime, UTC
+from datetime import datetime, timedelta, UTC
 from dotenv import load_dotenv
-from bigquery_client import BigQueryClient
-from tqdm import tqdm
+from bigquery_client import BigQueryClient, KnownOrderIndex
+from linx_api import LinxAPI as BaseLinxAPI
+from linx_dates import convert_linx_date
+from pipeline import StagedPipeline
+from checkpoint import create_checkpoint_store, new_checkpoint
+from load_jobs import ChunkedLoadWriter
+from order_transformer import ColumnarOrderTransformer, order_fingerprint
+from order_cache import create_order_cache
+from clients import shared, get_config, get_bq_client
 
 # Configuração de logging
 logging.basicConfig(
@@ -18,41 +24,6 @@ logger = logging.getLogger(__name__)
 # Carrega variáveis de ambiente
 load_dotenv()
 
-def convert_linx_date(date_str):
-    """Converte o formato de data do LINX (/Date(timestamp-offset)/) para o formato do BigQuery"""
-    if not date_str or not isinstance(date_str, str) or not date_str.startswith('/Date('):
-        return None
-    
-    try:
-        # Extrai o timestamp e o offset
-        timestamp_str = date_str.split('(')[1].split(')')[0]
-        if not timestamp_str:
-            logger.warning(f"Timestamp vazio: {date_str}")
-            return None
-            
-        # Separa o timestamp e o offset (considerando que o timestamp pode ser negativo)
-        if '-' in timestamp_str[1:]:  # Procura o segundo hífen (após o primeiro dígito)
-            timestamp_ms, offset = timestamp_str.split('-', 1)
-        else:
-            timestamp_ms = timestamp_str
-            offset = None
-            
-        if not timestamp_ms:
-            logger.warning(f"Timestamp vazio: {date_str}")
-            return None
-            
-        # Converte o timestamp para segundos
-        timestamp = int(timestamp_ms) / 1000
-        
-        # Converte para datetime
-        dt = datetime.fromtimestamp(timestamp)
-        
-        # Retorna no formato do BigQuery
-        return dt.strftime('%Y-%m-%d %H:%M:%S')
-    except Exception as e:
-        logger.warning(f"Erro ao converter data {date_str}: {str(e)}")
-        return None
-
 def safe_convert(value, target_type, default=None):
     """Converte valores de forma segura para o tipo desejado"""
     if value is None:
@@ -81,24 +52,22 @@ def load_config():
 if not os.environ.get('K_SERVICE'):  # Se não estiver no Cloud Run
     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.join(os.path.dirname(os.path.dirname(__file__)), "credentials", "datalake-betminds.json")
 
-class LinxAPI:
+def shared_clients():
+    """Configuração e clientes LINX/BigQuery únicos do processo (config.yaml padrão)
+
+    Reaproveitados entre as importações do Cloud Run: a sessão HTTP da LINX,
+    o limitador de taxa e o bigquery.Client são criados uma única vez.
+    """
+    config = get_config()
+    return config, shared('historical_linx_api', lambda: LinxAPI(config)), get_bq_client()
+
+class LinxAPI(BaseLinxAPI):
     def __init__(self, config):
         """Inicializa a API com as configurações do arquivo YAML"""
-        self.base_url = config['linx_api']['base_url']
-        self.username = config['linx_api']['username']
-        self.password = config['linx_api']['password']
-        
-        self.session = requests.Session()
-        self.session.auth = (self.username, self.password)
-        self.session.headers.update({
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        })
+        super().__init__(config)
 
-    def search_orders(self, page_index, page_size, start_date=None):
-        """Busca pedidos na API usando o formato correto da LINX"""
-        url = f"{self.base_url}/v1/Sales/API.svc/web/SearchOrders"
-        
+    def _search_orders_payload(self, page_index, page_size, start_date=None, end_date=None):
+        """Monta o payload do SearchOrders no formato correto da LINX"""
         payload = {
             "Page": {
                 "PageIndex": page_index,
@@ -110,180 +79,40 @@ class LinxAPI:
         if start_date:
             # Converte o formato LINX para string de data
             if start_date.startswith('/Date('):
-                try:
-                    # Extrai o timestamp
-                    timestamp_str = start_date.split('(')[1].split(')')[0]
-                    timestamp_ms = int(timestamp_str.split('-')[0])
-                    timestamp = timestamp_ms / 1000
-                    
-                    # Converte para datetime e depois para string
-                    from datetime import datetime
-                    dt = datetime.fromtimestamp(timestamp)
-                    date_string = dt.strftime('%Y-%m-%d %H:%M:%S')
-                    
+                date_string = convert_linx_date(start_date)
+                if date_string:
                     payload["Where"] = f'CreatedDate > "{date_string}"'
                     logger.info(f"Filtro aplicado: CreatedDate > \"{date_string}\"")
-                except Exception as e:
-                    logger.warning(f"Erro ao converter data LINX {start_date}: {str(e)}")
+                else:
                     # Se não conseguir converter, não aplica filtro
+                    logger.warning(f"Erro ao converter data LINX {start_date}")
             else:
                 # Se já for string, usa diretamente
                 payload["Where"] = f'CreatedDate > "{start_date}"'
                 logger.info(f"Filtro aplicado: CreatedDate > \"{start_date}\"")
         
-        response = self.session.post(url, json=payload)
-        response.raise_for_status()
-        return response.json()
-
-    def get_order_by_number(self, order_number):
-        """Obtém detalhes de um pedido pelo número"""
-        url = f"{self.base_url}/v1/Sales/API.svc/web/GetOrderByNumber"
-        response = self.session.post(url, json=order_number)
-        response.raise_for_status()
-        return response.json()
-
-    def process_order(self, order_data):
-        """Processa os dados do pedido para o formato do BigQuery"""
-        try:
-            # Extrai o endereço de entrega
-            delivery_address = None
-            for address in order_data.get('Addresses', []):
-                if address.get('AddressType') == 68:  # Tipo 68 é endereço de entrega
-                    delivery_address = address
-                    break
-
-            # Processa os itens do pedido
-            items = []
-            for item in order_data.get('Items', []):
-                items.append({
-                    'ProductID': str(item.get('ProductID', '')),
-                    'ProductName': str(item.get('ProductName', '')),
-                    'SKU': str(item.get('SKU', '')),
-                    'Qty': float(item.get('Qty', 0)),
-                    'Price': float(item.get('Price', 0)),
-                    'Total': float(item.get('Total', 0)),
-                    'Weight': float(item.get('Weight', 0)),
-                    'Width': float(item.get('Width', 0)),
-                    'Height': float(item.get('Height', 0)),
-                    'Depth': float(item.get('Depth', 0))
-                })
-
-            # Processa os métodos de pagamento
-            payment_methods = []
-            for payment in order_data.get('PaymentMethods', []):
-                payment_info = payment.get('PaymentInfo', {})
-                payment_methods.append({
-                    'PaymentMethodID': str(payment.get('PaymentMethodID', '')),
-                    'Amount': float(payment.get('Amount', 0)),
-                    'Status': str(payment.get('Status', '')),
-                    'PaymentDate': convert_linx_date(payment.get('PaymentDate')),
-                    'Installments': int(payment.get('Installments', 1)),
-                    'PaymentInfo': str(payment_info.get('Alias', '')),
-                    'PaymentType': str(payment_info.get('PaymentType', '')),
-                    'Provider': str(payment_info.get('Provider', '')),
-                    'AuthorizationCode': str(payment_info.get('AuthorizationCode', '')),
-                    'TransactionNumber': str(payment_info.get('TransactionNumber', ''))
-                })
-
-            # Processa os métodos de entrega
-            delivery_methods = []
-            for prop in order_data.get('Properties', []):
-                if prop.get('Type') == 'DeliveryMethod':
-                    delivery_methods.append({
-                        'DeliveryMethodAlias': str(prop.get('Reference', '')),
-                        'ETA': str(prop.get('Message', '')),
-                        'Amount': float(prop.get('Amount', 0)),
-                        'CarrierName': 'Personalizado'  # Valor padrão
-                    })
+        # Limite superior da janela de datas (backfill particionado)
+        if end_date:
+            upper = f'CreatedDate <= "{end_date}"'
+            payload["Where"] = f'{payload["Where"]} AND {upper}' if payload.get("Where") else upper
+            logger.info(f"Filtro aplicado: {payload['Where']}")
+        return payload
 
-            # Processa os envios
-            shipments = []
-            for shipment in order_data.get('Shipments', []):
-                shipment_number = str(shipment.get('ShipmentNumber', ''))
-                shipment_status = shipment.get('ShipmentStatus')
-                try:
-                    shipment_status = int(shipment_status)
-                except (ValueError, TypeError):
-                    shipment_status = 0  # Valor padrão
-                shipments.append({
-                    'ShipmentNumber': shipment_number,
-                    'ShipmentStatus': shipment_status
-                })
-
-            # Garante que campos obrigatórios não sejam nulos
-            order_id = str(order_data.get('OrderID', ''))
-            if not order_id:
-                raise ValueError("OrderID é obrigatório e não pode ser nulo")
-
-            order_number = str(order_data.get('OrderNumber', ''))
-            if not order_number:
-                raise ValueError("OrderNumber é obrigatório e não pode ser nulo")
+    def search_orders(self, page_index, page_size, start_date=None, end_date=None):
+        """Busca pedidos na API usando o formato correto da LINX
 
-            created_date = convert_linx_date(order_data.get('CreatedDate'))
-            if not created_date:
-                raise ValueError("CreatedDate é obrigatório e não pode ser nulo")
-
-            global_status = int(order_data.get('GlobalStatus', 0))
-            order_status_id = int(order_data.get('OrderStatusID', 0))
+        end_date (opcional) limita a busca a CreatedDate <= end_date.
+        """
+        url = f"{self.base_url}/v1/Sales/API.svc/web/SearchOrders"
+        payload = self._search_orders_payload(page_index, page_size, start_date, end_date)
+        response = self._post(url, payload)
+        return self.json.loads(response.content)
 
-            # Retorna os dados processados
-            return {
-                'order_id': order_id,
-                'order_number': order_number,
-                'created_date': created_date,
-                'acquired_date': convert_linx_date(order_data.get('AcquiredDate')),
-                'cancelled_date': convert_linx_date(order_data.get('CancelledDate')),
-                'global_status': global_status,
-                'order_status_id': order_status_id,
-                'total': float(order_data.get('Total', 0)),
-                'subtotal': float(order_data.get('SubTotal', 0)),
-                'delivery_amount': float(order_data.get('DeliveryAmount', 0)),
-                'discount_amount': float(order_data.get('DiscountAmount', 0)),
-                'tax_amount': float(order_data.get('TaxAmount', 0)),
-                
-                # Informações do cliente
-                'customer_id': int(order_data.get('CustomerID', 0)),
-                'customer_name': str(order_data.get('CustomerName', '')),
-                'customer_email': str(order_data.get('CustomerEmail', '')),
-                'customer_type': str(order_data.get('CustomerType', 'P')),  # P como padrão
-                'customer_cpf': str(order_data.get('CustomerCPF', '')),
-                'customer_cnpj': str(order_data.get('CustomerCNPJ', '')),
-                'customer_cell_phone': str(order_data.get('CustomerCellPhone', '')),
-                'customer_phone': str(order_data.get('CustomerPhone', '')),
-                'customer_gender': str(order_data.get('CustomerGender', '')),
-                'customer_birth_date': convert_linx_date(order_data.get('CustomerBirthDate')),
-                
-                # Endereço de entrega
-                'delivery_address_line': str(delivery_address.get('AddressLine', '')) if delivery_address else '',
-                'delivery_address_number': str(delivery_address.get('Number', '')) if delivery_address else '',
-                'delivery_neighbourhood': str(delivery_address.get('Neighbourhood', '')) if delivery_address else '',
-                'delivery_city': str(delivery_address.get('City', '')) if delivery_address else '',
-                'delivery_state': str(delivery_address.get('State', '')) if delivery_address else '',
-                'delivery_postal_code': str(delivery_address.get('PostalCode', '')) if delivery_address else '',
-                'delivery_contact_name': str(delivery_address.get('ContactName', '')) if delivery_address else '',
-                'delivery_contact_phone': str(delivery_address.get('ContactPhone', '')) if delivery_address else '',
-                
-                # Arrays
-                'items': items,
-                'payment_methods': payment_methods,
-                'delivery_methods': delivery_methods,
-                'shipments': shipments,
-                
-                # Status do envio
-                'shipment_status': int(order_data.get('ShipmentStatus', 0)),
-                
-                # Informações do vendedor
-                'seller_name': str(order_data.get('Seller', {}).get('Name', '')),
-                'seller_email': str(order_data.get('Seller', {}).get('EMail', '')),
-                'seller_phone': str(order_data.get('Seller', {}).get('Phone', '')),
-                'seller_integration_id': str(order_data.get('Seller', {}).get('IntegrationID', '')),
-                
-                # Metadados
-                'created_at': datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S')
-            }
-        except Exception as e:
-            logger.error(f"Erro ao processar pedido: {str(e)}")
-            raise
+    def iter_search_orders(self, page_index, page_size, start_date=None, end_date=None):
+        """Como search_orders, mas lê a resposta em streaming e gera os pedidos de Result um a um"""
+        url = f"{self.base_url}/v1/Sales/API.svc/web/SearchOrders"
+        payload = self._search_orders_payload(page_index, page_size, start_date, end_date)
+        return self._post_items(url, payload, 'Result')
 
 def convert_to_linx_date(dt):
     """Converte datetime para o formato da API LINX (/Date(timestamp)/)"""
@@ -292,134 +121,572 @@ def convert_to_linx_date(dt):
     timestamp = int(dt.timestamp() * 1000)
     return f"/Date({timestamp})/"
 
-def import_historical_orders(max_orders: int = None, only_new: bool = True):
-    """Importa pedidos históricos para o BigQuery"""
+def import_historical_orders(max_orders: int = None, only_new: bool = True, backfill: bool = False,
+                             chunk_size: int = None, file_format: str = None, start_date: str = None,
+                             end_date: str = None, checkpoint_name: str = None, config: dict = None,
+                             replay_from_cache: bool = False, detect_changes: bool = False,
+                             progress_callback=None):
+    """Importa pedidos históricos para o BigQuery
+
+    Com backfill=True os pedidos são gravados em arquivos locais (NDJSON ou
+    Parquet) em blocos de chunk_size linhas e cada bloco é enviado como um load
+    job, em vez de inserções via streaming.
+    
+    start_date/end_date ("YYYY-MM-DD HH:MM:SS") restringem a importação à
+    janela CreatedDate > start_date e CreatedDate <= end_date, com checkpoint
+    próprio (checkpoint_name); usado pelo backfill particionado.
+    
+    Com o cache de pedidos habilitado (order_cache), os detalhes já baixados
+    são reaproveitados. replay_from_cache=True reprocessa os pedidos do cache
+    (na janela start_date/end_date, se informada) sem chamar a API da LINX e
+    sem usar o checkpoint; as linhas reprocessadas substituem as existentes
+    via MERGE (write_mode upsert) ou pela deduplicação ao final (backfill).
+    
+    detect_changes=True também reimporta pedidos já existentes cujo fingerprint
+    (hash dos campos de status do resumo do SearchOrders) difere do gravado;
+    os demais continuam sem busca de detalhes. As linhas são gravadas via
+    MERGE (write_mode upsert) e o checkpoint não é usado: a janela
+    start_date/end_date é percorrida inteira a cada execução.
+    
+    progress_callback, se informado, é chamado após a gravação de cada página
+    com os totais parciais (pages, processed, imported, skipped, changed, failed).
+    
+    Retorna um dicionário com os totais da execução.
+    """
     try:
-        # Carrega configurações
-        config = load_config()
-        
-        # Inicializa clientes
-        linx_api = LinxAPI(config)
-        bq_client = BigQueryClient()
-        
-        # Sempre obtém a data do último pedido importado para continuar de onde parou
-        last_date = bq_client.get_last_order_date()
-        if last_date:
-            # Se for string, converte para datetime
-            if isinstance(last_date, str):
-                try:
-                    last_date = datetime.strptime(last_date, '%Y-%m-%d %H:%M:%S')
-                except Exception:
-                    last_date = datetime.fromisoformat(last_date)
-            
-            # Converte para o formato da API LINX
-            linx_last_date = convert_to_linx_date(last_date)
-            logger.info(f"Último pedido importado em: {last_date}")
-            logger.info(f"Continuando importação após: {linx_last_date}")
+        from tqdm import tqdm
+        
+        if detect_changes and (backfill or replay_from_cache):
+            raise ValueError("A detecção de alterações não pode ser combinada com --backfill ou --replay-from-cache")
+        
+        # Inicializa clientes: sem config explícita, usa os do processo (config.yaml)
+        shared_config = config is None
+        if shared_config:
+            config, linx_api, bq_client = shared_clients()
+        else:
+            linx_api = LinxAPI(config)
+            bq_client = BigQueryClient(config)
+        
+        # Sem MERGE nem deduplicação ao final, o reprocessamento gravaria cada
+        # pedido do cache como uma nova linha
+        if replay_from_cache and not backfill and bq_client.write_mode != 'upsert':
+            raise ValueError(f"--replay-from-cache com write_mode {bq_client.write_mode} duplicaria os pedidos: "
+                             f"use write_mode upsert ou --backfill (com deduplicação ao final)")
+        
+        # Pedidos gravados via streaming depois deste instante podem estar no
+        # buffer de streaming, e o MERGE não atualiza essas linhas
+        buffered_since = None
+        if detect_changes and bq_client.write_mode != 'upsert':
+            buffer_minutes = (config.get('change_detection') or {}).get('streaming_buffer_minutes', 90)
+            buffered_since = datetime.now(UTC) - timedelta(minutes=buffer_minutes)
+        
+        if detect_changes:
+            # Pedidos alterados substituem a linha existente (cópia: o cliente pode ser compartilhado)
+            if bq_client.write_mode != 'upsert':
+                logger.info("Detecção de alterações: usando write_mode upsert")
+                bq_client = copy.copy(bq_client)
+                bq_client.write_mode = 'upsert'
+            # Garante a coluna fingerprint antes de consultá-la
+            bq_client.create_table_if_not_exists()
+        
+        # Índice em memória dos pedidos já importados (evita uma consulta por pedido).
+        # No modo upsert o MERGE já é idempotente e a verificação é dispensada
+        # (exceto no backfill, em que os load jobs apenas acrescentam linhas, e na
+        # detecção de alterações, que compara os fingerprints gravados).
+        # No reprocessamento do cache todos os pedidos são regravados.
+        known_orders = None
+        if not replay_from_cache and (bq_client.write_mode != 'upsert' or backfill or detect_changes):
+            known_orders = KnownOrderIndex(
+                bq_client,
+                preload=config['bigquery'].get('preload_known_orders', False),
+                track_fingerprints=detect_changes
+            )
+        
+        # Checkpoint da importação: retoma do último ponto gravado sem varrer a tabela
+        checkpoint_name = checkpoint_name or (config.get('checkpoint') or {}).get('name', 'import_historical_orders')
+        if replay_from_cache or detect_changes:
+            checkpoint_store = None
+        elif shared_config:
+            checkpoint_store = shared('checkpoint_store', lambda: create_checkpoint_store(config, bq_client))
+        else:
+            checkpoint_store = create_checkpoint_store(config, bq_client)
+        saved = checkpoint_store.load(checkpoint_name) if checkpoint_store else None
+        
+        if saved:
+            linx_last_date = saved['since']
+            start_page = saved['page_index']
+            last_created_date = saved['last_created_date']
+            logger.info(f"Checkpoint encontrado: após {linx_last_date or 'início'}, página {start_page + 1}")
+            if saved['in_flight']:
+                logger.warning(f"{len(saved['in_flight'])} pedidos falharam na execução anterior e serão "
+                               f"reprocessados a partir da página {start_page + 1}: {saved['in_flight']}")
+        elif start_date or end_date or replay_from_cache:
+            # Janela explícita de datas (ou todo o cache no reprocessamento)
+            start_page = 0
+            linx_last_date = start_date
+            last_created_date = None
+            logger.info(f"Importando janela: após {start_date or 'início'} até {end_date or 'agora'}")
         else:
-            linx_last_date = None
-            logger.info("Nenhum pedido encontrado na tabela. Importando todos os pedidos.")
+            start_page = 0
+            # Sem checkpoint: obtém a data do último pedido importado para continuar de onde parou
+            last_date = bq_client.get_last_order_date()
+            if last_date:
+                # Se for string, converte para datetime
+                if isinstance(last_date, str):
+                    try:
+                        last_date = datetime.strptime(last_date, '%Y-%m-%d %H:%M:%S')
+                    except Exception:
+                        last_date = datetime.fromisoformat(last_date)
+                
+                # Converte para o formato da API LINX
+                linx_last_date = convert_to_linx_date(last_date)
+                last_created_date = last_date.strftime('%Y-%m-%d %H:%M:%S')
+                logger.info(f"Último pedido importado em: {last_date}")
+                logger.info(f"Continuando importação após: {linx_last_date}")
+            else:
+                linx_last_date = None
+                last_created_date = None
+                logger.info("Nenhum pedido encontrado na tabela. Importando todos os pedidos.")
         
         # Busca pedidos
-        page_index = 0  # Começa do índice 0 conforme especificação da LINX
-        page_size = 100
+        pipeline_config = config.get('pipeline') or {}
+        page_size = pipeline_config.get('page_size', 100)
         total_imported = 0
         total_skipped = 0
+        total_changed = 0
         total_processed = 0
+        total_failed = 0
+        total_queued = 0
+        total_pages = 0
         
-        while True:
-            try:
+        if backfill:
+            # Backfill: blocos em arquivos locais enviados como load jobs
+            backfill_config = config.get('backfill') or {}
+            writer = ChunkedLoadWriter(
+                bq_client,
+                chunk_size=chunk_size or backfill_config.get('chunk_size', 50000),
+                file_format=file_format or backfill_config.get('format', 'ndjson'),
+                output_dir=backfill_config.get('output_dir'),
+                keep_files=backfill_config.get('keep_files', False),
+                json_codec=bq_client.json
+            )
+        else:
+            # Escritor em buffer: um insert_rows_json por lote em vez de um por pedido
+            writer = bq_client.buffered_writer()
+        # Parquet: cada página é convertida de uma vez em colunas do Arrow
+        columnar = None
+        if backfill and writer.file_format == 'parquet':
+            columnar = ColumnarOrderTransformer(config['table_schema'])
+        # Cache local dos documentos brutos (GetOrderByNumber)
+        order_cache = create_order_cache(config, force=replay_from_cache)
+        progress = tqdm(desc="Pedidos", unit="pedido")
+        
+        # Páginas já entregues ao escritor, aguardando a gravação de todas as suas linhas
+        awaiting_pages = []
+        # Uma página com pedidos que falharam interrompe o checkpoint: a próxima
+        # execução recomeça nela em vez de pular esses pedidos
+        checkpoint_state = {'blocked': False}
+        listing = {'exhausted': False}
+        
+        stream_pages = pipeline_config.get('stream_pages', False)
+        stream_batch_size = pipeline_config.get('stream_batch_size', 100)
+        
+        def page_batches(page_index):
+            """Pedidos de uma página em lotes: um lote só, ou lotes de stream_batch_size
+            lidos em streaming à medida que a resposta chega"""
+            if not stream_pages:
+                response = linx_api.search_orders(page_index, page_size, linx_last_date, end_date)
+                yield response.get('Result', [])
+                return
+            batch = []
+            for order in linx_api.iter_search_orders(page_index, page_size, linx_last_date, end_date):
+                batch.append(order)
+                if len(batch) >= stream_batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        
+        def list_pages():
+            """Estágio 1: lista as páginas de pedidos e seleciona os pedidos novos"""
+            nonlocal total_processed, total_skipped, total_changed
+            page_index = start_page  # Começa do índice 0 conforme especificação da LINX
+            selected = 0
+            while True:
                 # Busca pedidos na API
                 logger.info(f"Buscando página {page_index + 1} com {page_size} pedidos...")
-                response = linx_api.search_orders(page_index, page_size, linx_last_date)
-                orders = response.get('Result', [])
-                
-                if not orders:
-                    logger.info("Nenhum pedido encontrado nesta página. Finalizando importação.")
-                    break
-                
-                logger.info(f"Encontrados {len(orders)} pedidos na página {page_index + 1}")
-                
-                # Processa cada pedido
-                for order in tqdm(orders, desc=f"Página {page_index + 1}"):
-                    total_processed += 1
+                batches = page_batches(page_index)
+                part = 0
+                limit_reached = False
+                try:
+                    orders = next(batches, None)
+                    if not orders:
+                        logger.info("Nenhum pedido encontrado nesta página. Finalizando importação.")
+                        listing['exhausted'] = True
+                        return
                     
-                    try:
-                        order_id = str(order.get('OrderID', ''))
-                        order_number = str(order.get('OrderNumber', ''))
-                        
-                        if not order_id:
-                            logger.warning(f"Pedido sem OrderID na página {page_index + 1}. Pulando...")
-                            continue
+                    while orders is not None:
+                        # O próximo lote é lido antes para saber se este é o último da página
+                        following = next(batches, None)
+                        logger.info(f"Encontrados {len(orders)} pedidos na página {page_index + 1}")
                         
-                        # Verifica se o pedido já existe por order_id
-                        if bq_client.check_order_exists(order_id):
-                            logger.debug(f"Pedido {order_id} (OrderNumber: {order_number}) já existe. Pulando...")
-                            total_skipped += 1
-                            continue
+                        # Carrega as chaves existentes do lote com uma única consulta
+                        if known_orders:
+                            known_orders.ensure(orders)
                         
-                        # Verifica também por order_number para garantir
-                        if bq_client.check_order_exists(order_number, by_number=True):
-                            logger.debug(f"Pedido com OrderNumber {order_number} já existe. Pulando...")
-                            total_skipped += 1
-                            continue
+                        # Seleciona os pedidos novos (ou alterados) do lote
+                        to_fetch = []
+                        fingerprints = {}
+                        for order in orders:
+                            total_processed += 1
+                            order_id = str(order.get('OrderID', ''))
+                            order_number = str(order.get('OrderNumber', ''))
+                            
+                            if not order_id:
+                                logger.warning(f"Pedido sem OrderID na página {page_index + 1}. Pulando...")
+                                continue
+                            
+                            # Fingerprint do resumo: comparado com o gravado e salvo na linha
+                            fingerprint = order_fingerprint(order)
+                            
+                            # Verifica se o pedido já existe por order_id ou order_number
+                            if known_orders and known_orders.contains(order_id, order_number):
+                                if not detect_changes or known_orders.fingerprint(order_id) == fingerprint:
+                                    logger.debug(f"Pedido {order_id} (OrderNumber: {order_number}) já existe. Pulando...")
+                                    total_skipped += 1
+                                    continue
+                                if buffered_since and known_orders.written_since(order_id, buffered_since):
+                                    logger.debug(f"Pedido {order_id} (OrderNumber: {order_number}) alterado, mas gravado "
+                                                 f"há pouco (buffer de streaming). Fica para a próxima verificação...")
+                                    total_skipped += 1
+                                    continue
+                                logger.debug(f"Pedido {order_id} (OrderNumber: {order_number}) alterado. Reimportando...")
+                                total_changed += 1
+                            
+                            to_fetch.append((order_id, order_number))
+                            fingerprints[order_number] = fingerprint
+                            
+                            # Verifica se atingiu o limite de pedidos
+                            if max_orders and selected + len(to_fetch) >= max_orders:
+                                logger.info(f"Limite de {max_orders} pedidos atingido")
+                                limit_reached = True
+                                break
                         
-                        # Obtém detalhes completos do pedido
-                        logger.debug(f"Obtendo detalhes do pedido {order_number}...")
-                        order_details = linx_api.get_order_by_number(order_number)
-                        processed_order = linx_api.process_order(order_details)
+                        selected += len(to_fetch)
+                        # Só o último lote de uma página não interrompida pelo limite conclui a página
+                        complete = following is None and not limit_reached
+                        yield {'page_index': page_index, 'to_fetch': to_fetch,
+                               'fingerprints': fingerprints, 'complete': complete}
                         
-                        # Insere no BigQuery
-                        if bq_client.insert_rows([processed_order]):
-                            total_imported += 1
-                            logger.info(f"✅ Pedido {order_id} (OrderNumber: {order_number}) importado com sucesso")
-                        else:
-                            logger.error(f"❌ Falha ao inserir pedido {order_id} (OrderNumber: {order_number})")
-                        
-                        # Verifica se atingiu o limite de pedidos
-                        if max_orders and total_imported >= max_orders:
-                            logger.info(f"Limite de {max_orders} pedidos atingido")
-                            break
-                    
-                    except Exception as e:
-                        logger.error(f"Erro ao processar pedido {order.get('OrderNumber', 'N/A')}: {str(e)}")
-                        continue
-                
-                # Se atingiu o limite, sai do loop
-                if max_orders and total_imported >= max_orders:
-                    break
+                        if limit_reached:
+                            return
+                        orders = following
+                        part += 1
+                except Exception as e:
+                    logger.error(f"Erro ao buscar pedidos na página {page_index + 1}: {str(e)}")
+                    return
+                finally:
+                    batches.close()
                 
-                # Incrementa página
+                # Incrementa página (o ritmo das requisições é controlado pelo limitador da LinxAPI)
                 page_index += 1
-                
-                # Pausa entre páginas para não sobrecarregar a API
-                time.sleep(1)
-                
-            except Exception as e:
-                logger.error(f"Erro ao buscar pedidos na página {page_index + 1}: {str(e)}")
-                break
+        
+        def list_cached_pages():
+            """Estágio 1 (reprocessamento): lê os pedidos do cache em páginas, sem chamar a API"""
+            nonlocal total_processed
+            page_index = 0
+            page = []
+            cached_orders = order_cache.iter_orders(start_date, end_date, batch_size=page_size)
+            for order in cached_orders:
+                if max_orders and total_processed >= max_orders:
+                    logger.info(f"Limite de {max_orders} pedidos atingido")
+                    break
+                total_processed += 1
+                page.append(order)
+                if len(page) >= page_size:
+                    yield cached_page(page_index, page)
+                    page_index += 1
+                    page = []
+            else:
+                listing['exhausted'] = True
+            if page:
+                yield cached_page(page_index, page)
+        
+        def cached_page(page_index, orders):
+            to_fetch = [(str(order.get('OrderID', '')), str(order.get('OrderNumber', ''))) for order in orders]
+            return {
+                'page_index': page_index,
+                'to_fetch': to_fetch,
+                'fetched': [(number, order, None) for (_, number), order in zip(to_fetch, orders)],
+                'complete': True
+            }
+        
+        def fetch_details(page):
+            """Estágio 2: obtém os detalhes dos pedidos em paralelo (ordem da página preservada)"""
+            logger.debug(f"Obtendo detalhes de {len(page['to_fetch'])} pedidos...")
+            numbers = [number for _, number in page['to_fetch']]
+            if order_cache and detect_changes:
+                # Pedidos alterados: o documento em cache está desatualizado
+                page['fetched'] = linx_api.get_orders_by_number(numbers)
+                order_cache.put_many([(number, order) for number, order, error in page['fetched'] if error is None and order])
+            elif order_cache:
+                page['fetched'] = order_cache.fetch_through(numbers, linx_api.get_orders_by_number)
+            else:
+                page['fetched'] = linx_api.get_orders_by_number(numbers)
+            return page
+        
+        def transform(page):
+            """Estágio 3: converte os pedidos para o formato do BigQuery"""
+            if columnar:
+                try:
+                    return transform_columnar(page)
+                except Exception as e:
+                    logger.warning(f"Erro na conversão em colunas da página {page['page_index'] + 1}, "
+                                   f"convertendo pedido a pedido: {str(e)}")
+            rows = []
+            fingerprints = page.get('fingerprints') or {}
+            for (order_id, order_number), (_, order_details, error) in zip(page['to_fetch'], page.pop('fetched')):
+                try:
+                    if error:
+                        raise error
+                    row = linx_api.process_order(order_details)
+                    if order_number in fingerprints:
+                        row['fingerprint'] = fingerprints[order_number]
+                    rows.append(((order_id, order_number), row))
+                except Exception as e:
+                    logger.error(f"Erro ao processar pedido {order_number}: {str(e)}")
+            page['rows'] = rows
+            return page
+        
+        def transform_columnar(page):
+            """Estágio 3 (parquet): converte a página inteira em um RecordBatch"""
+            keys, orders = [], []
+            for (order_id, order_number), (_, order_details, error) in zip(page['to_fetch'], page['fetched']):
+                if error:
+                    logger.error(f"Erro ao processar pedido {order_number}: {str(error)}")
+                    continue
+                keys.append((order_id, order_number))
+                orders.append(order_details)
+            batch, errors = columnar.to_record_batch(orders)
+            rejected = {index for index, _ in errors}
+            for index, message in errors:
+                logger.error(f"Erro ao processar pedido {keys[index][1]}: {message}")
+            page.pop('fetched')
+            keys = [key for index, key in enumerate(keys) if index not in rejected]
+            fingerprints = page.get('fingerprints') or {}
+            if fingerprints:
+                batch = columnar.with_column(batch, 'fingerprint', [fingerprints.get(number) for _, number in keys])
+            page['created_dates'] = [convert_linx_date(order.get('CreatedDate'))
+                                     for index, order in enumerate(orders) if index not in rejected]
+            page['batch'] = (batch, keys)
+            return page
+        
+        def load(page):
+            """Estágio 4: grava os pedidos da página em lote no BigQuery"""
+            nonlocal total_queued, total_pages
+            if 'batch' in page:
+                batch, keys = page.pop('batch')
+                page['remaining'] = set(keys)
+                page['failed'] = set()
+                awaiting_pages.append(page)
+                record_flush(writer.add_batch(batch, keys))
+                total_queued += len(keys)
+            else:
+                page['created_dates'] = [row.get('created_date') for _, row in page['rows']]
+                page['remaining'] = {key for key, _ in page['rows']}
+                page['failed'] = set()
+                awaiting_pages.append(page)
+                for key, row in page.pop('rows'):
+                    record_flush(writer.add(row, key=key))
+                    total_queued += 1
+            record_flush(writer.flush())
+            progress.update(len(page['to_fetch']))
+            commit_ready_pages()
+            total_pages += 1
+            if progress_callback:
+                progress_callback({
+                    'pages': total_pages,
+                    'processed': total_processed,
+                    'imported': total_imported,
+                    'skipped': total_skipped,
+                    'changed': total_changed,
+                    'failed': total_failed
+                })
+        
+        def commit_ready_pages():
+            """Confirma, em ordem, as páginas cujas linhas já foram todas gravadas"""
+            while awaiting_pages and not awaiting_pages[0]['remaining']:
+                page = awaiting_pages.pop(0)
+                if checkpoint_state['blocked']:
+                    continue
+                if page['failed']:
+                    block_checkpoint(page)
+                else:
+                    commit_page(page)
+        
+        def commit_page(page):
+            """Registra no checkpoint que a página foi gravada"""
+            nonlocal last_created_date
+            for created_date in page.pop('created_dates'):
+                if created_date and (not last_created_date or created_date > last_created_date):
+                    last_created_date = created_date
+            if not checkpoint_store:
+                return
+            next_page = page['page_index'] + 1 if page['complete'] else page['page_index']
+            checkpoint_store.save(checkpoint_name, new_checkpoint(linx_last_date, next_page, last_created_date))
+        
+        def block_checkpoint(page):
+            """Para o checkpoint na página com pedidos que falharam
+
+            Nem a página nem as seguintes avançam o checkpoint (page_index e
+            last_created_date): a próxima execução recomeça nesta página, pula os
+            pedidos já gravados e tenta de novo os que falharam.
+            """
+            checkpoint_state['blocked'] = True
+            failed_numbers = sorted(number for _, number in page['failed'])
+            logger.warning(f"Checkpoint interrompido na página {page['page_index'] + 1}: "
+                           f"{len(failed_numbers)} pedidos falharam e serão reprocessados na próxima execução")
+            if checkpoint_store:
+                checkpoint_store.save(checkpoint_name, new_checkpoint(linx_last_date, page['page_index'],
+                                                                      last_created_date, failed_numbers))
+        
+        def record_flush(result):
+            """Contabiliza o resultado de um flush do escritor"""
+            nonlocal total_imported, total_failed
+            if not result:
+                return
+            inserted, failed = result
+            failed_keys = {entry['key'] for entry in failed}
+            done = set(inserted) | failed_keys
+            for page in awaiting_pages:
+                page['failed'] |= page['remaining'] & failed_keys
+                page['remaining'] -= done
+            for order_id, order_number in inserted:
+                if known_orders:
+                    known_orders.add(order_id, order_number)
+                logger.info(f"✅ Pedido {order_id} (OrderNumber: {order_number}) importado com sucesso")
+            for entry in failed:
+                order_id, order_number = entry['key']
+                logger.error(f"❌ Falha ao inserir pedido {order_id} (OrderNumber: {order_number}): {entry['errors']}")
+            total_imported += len(inserted)
+            total_failed += len(failed)
+        
+        # Listagem, detalhes, transformação e carga rodam sobrepostos, ligados
+        # por filas limitadas (backpressure mantém a memória estável)
+        if replay_from_cache:
+            source, stages = list_cached_pages(), [('transformacao', transform), ('carga', load)]
+        else:
+            source, stages = list_pages(), [('detalhes', fetch_details), ('transformacao', transform), ('carga', load)]
+        pipeline = StagedPipeline(
+            source,
+            stages,
+            queue_size=pipeline_config.get('queue_size', 2),
+            source_name='cache' if replay_from_cache else 'listagem'
+        )
+        try:
+            pipeline.run()
+        finally:
+            progress.close()
+            record_flush(writer.close())
+            commit_ready_pages()
+            if order_cache:
+                if not replay_from_cache:
+                    order_cache.evict()
+                cache_stats = order_cache.stats()
+                order_cache.close()
+        
+        # Todas as páginas foram lidas: a próxima execução parte do último pedido
+        # gravado (ou do fim da janela, que assim fica marcada como concluída)
+        if checkpoint_store and listing['exhausted'] and not checkpoint_state['blocked']:
+            checkpoint_store.save(checkpoint_name, new_checkpoint(end_date or last_created_date, 0, last_created_date))
         
         logger.info(f"🎉 Importação concluída!")
         logger.info(f"📊 Resumo:")
         logger.info(f"   - Total processado: {total_processed}")
         logger.info(f"   - Total importado: {total_imported}")
         logger.info(f"   - Total pulado (já existia): {total_skipped}")
+        if detect_changes:
+            logger.info(f"   - Total alterado (reimportado): {total_changed}")
+        logger.info(f"   - Total com falha na inserção: {total_failed}")
+        logger.info(f"   - Requisições de inserção: {writer.requests}")
+        logger.info(f"   - Conexões LINX: {linx_api.connection_stats()}")
+        if order_cache:
+            logger.info(f"   - Cache de pedidos: {cache_stats}")
+        if backfill:
+            backfill_summary = writer.summary()
+            logger.info(f"   - Load jobs: {backfill_summary['jobs']} "
+                        f"({backfill_summary['rows']} linhas, {backfill_summary['file_bytes']} bytes)")
+            for job in writer.jobs:
+                logger.info(f"     • {job['job_id']}: {job['rows']} linhas, {job['file_bytes']} bytes, {job['seconds']}s")
         
         if total_imported > 0:
             logger.info(f"✅ {total_imported} novos pedidos foram importados com sucesso!")
         else:
             logger.info("ℹ️  Nenhum novo pedido foi importado.")
+        
+        # Reprocessamento sem MERGE: as novas linhas (created_at mais recente) substituem as antigas
+        if replay_from_cache and backfill and total_imported and bq_client.write_mode != 'upsert':
+            bq_client.deduplicate_orders(start_date=start_date, end_date=end_date)
+        
+        return {
+            'processed': total_processed,
+            'imported': total_imported,
+            'skipped': total_skipped,
+            'changed': total_changed,
+            'failed': total_failed,
+            'completed': listing['exhausted']
+        }
             
     except Exception as e:
         logger.error(f"Erro na importação: {str(e)}")
         raise
 
+def refresh_changed_orders(lookback_days: int = None, max_orders: int = None, config: dict = None,
+                           progress_callback=None):
+    """Reimporta os pedidos dos últimos lookback_days dias cujo status mudou
+
+    Percorre a janela CreatedDate > agora - lookback_days com a detecção de
+    alterações (import_historical_orders com detect_changes=True): só os
+    pedidos novos ou com fingerprint diferente do gravado têm os detalhes
+    buscados e são gravados via MERGE. lookback_days padrão:
+    change_detection.lookback_days do config.yaml.
+
+    Fora do write_mode upsert, pedidos alterados cuja linha foi gravada nos
+    últimos change_detection.streaming_buffer_minutes (created_at no BigQuery,
+    não a CreatedDate do pedido) ficam para as verificações seguintes: linhas
+    ainda no buffer de streaming não podem ser atualizadas pelo MERGE. Se mesmo
+    assim um MERGE for recusado pelo buffer, só os pedidos daquele lote falham.
+    """
+    settings = (config or get_config()).get('change_detection') or {}
+    lookback_days = lookback_days or settings.get('lookback_days', 7)
+    start_date = (datetime.now(UTC) - timedelta(days=lookback_days)).strftime('%Y-%m-%d %H:%M:%S')
+    logger.info(f"🔄 Verificando alterações nos pedidos dos últimos {lookback_days} dias...")
+    return import_historical_orders(max_orders=max_orders, start_date=start_date, config=config,
+                                    detect_changes=True, progress_callback=progress_callback)
+
 if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description='Importa pedidos do LINX para o BigQuery')
     parser.add_argument('--max-orders', type=int, help='Número máximo de pedidos a importar')
     parser.add_argument('--only-new', action='store_true', help='Importa apenas pedidos novos')
+    parser.add_argument('--backfill', action='store_true', help='Carga histórica via load jobs em vez de streaming')
+    parser.add_argument('--chunk-size', type=int, help='Linhas por arquivo/load job no modo --backfill')
+    parser.add_argument('--format', dest='file_format', choices=['ndjson', 'parquet'],
+                        help='Formato dos arquivos no modo --backfill')
+    parser.add_argument('--replay-from-cache', action='store_true',
+                        help='Reprocessa os pedidos do cache local sem chamar a API da LINX')
+    parser.add_argument('--start-date', help='Início da janela (exclusivo), YYYY-MM-DD HH:MM:SS')
+    parser.add_argument('--end-date', help='Fim da janela (inclusivo), YYYY-MM-DD HH:MM:SS')
+    parser.add_argument('--refresh-changes', action='store_true',
+                        help='Reimporta os pedidos recentes cujo status mudou (fingerprint)')
+    parser.add_argument('--lookback-days', type=int, help='Dias verificados no modo --refresh-changes')
     args = parser.parse_args()
     
-    import_historical_orders(args.max_orders, args.only_new) 
\ No newline at end of file
+    if args.refresh_changes:
+        refresh_changed_orders(args.lookback_days, args.max_orders)
+    else:
+        import_historical_orders(args.max_orders, args.only_new, backfill=args.backfill,
+                                 chunk_size=args.chunk_size, file_format=args.file_format,
+                                 start_date=args.start_date, end_date=args.end_date,
+                                 replay_from_cache=args.replay_from_cache) 
@@ -0,0 +1,165 @@
+import time
+import uuid
+import logging
+import threading
+from collections import deque, OrderedDict
+from datetime import datetime, UTC
+
+logger = logging.getLogger(__name__)
+
+class ImportJobRunning(Exception):
+    """Já existe uma importação em andamento (single-flight)"""
+
+    def __init__(self, job):
+        super().__init__(f"Importação {job.id} já em andamento")
+        self.job = job
+
+# Threads de trabalho iniciadas pela importação (StagedPipeline e buscas em
+# paralelo da LinxAPI): como só um job roda por vez, são as do job em andamento
+JOB_WORKER_THREAD_PREFIXES = ('pipeline-', 'linx-fetch')
+
+class _ErrorCollector(logging.Handler):
+    """Guarda as últimas mensagens de erro registradas pelas threads de um job
+
+    O handler fica no logger raiz enquanto o job roda; registros de outras
+    threads (requisições do serviço, warm-up) são ignorados.
+    """
+
+    def __init__(self, max_errors=20):
+        super().__init__(level=logging.ERROR)
+        self.errors = deque(maxlen=max_errors)
+        self.thread_id = None
+
+    def emit(self, record):
+        if record.thread != self.thread_id and not (record.threadName or '').startswith(JOB_WORKER_THREAD_PREFIXES):
+            return
+        try:
+            self.errors.append(record.getMessage())
+        except Exception:
+            pass
+
+def _now():
+    return datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S')
+
+class ImportJob:
+    """Uma execução de importação em segundo plano e o seu progresso"""
+
+    def __init__(self, kind, params=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params or {}
+        self.status = 'queued'
+        self.phase = None
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = _now()
+        self.started_at = None
+        self.finished_at = None
+        self._started = None
+        self._elapsed = None
+        self._phase_started = None
+        self._errors = _ErrorCollector()
+
+    def set_phase(self, phase):
+        """Inicia uma fase do job (ex.: importacao, alteracoes); o progresso recomeça"""
+        self.phase = phase
+        self.progress = {}
+        self._phase_started = time.monotonic()
+
+    def update(self, progress):
+        """Callback de progresso de import_historical_orders"""
+        elapsed = time.monotonic() - (self._phase_started or self._started)
+        self.progress = dict(progress, orders_per_second=round(progress.get('imported', 0) / elapsed, 2) if elapsed else 0.0)
+
+    def to_dict(self):
+        elapsed = None
+        if self._started is not None:
+            elapsed = round(time.monotonic() - self._started, 1) if self.status == 'running' else self._elapsed
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'params': self.params,
+            'status': self.status,
+            'phase': self.phase,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+            'errors': list(self._errors.errors),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'elapsed_seconds': elapsed
+        }
+
+class JobManager:
+    """Executa importações em uma thread em segundo plano, uma de cada vez
+
+    submit() recusa (ImportJobRunning) um novo job enquanto outro estiver em
+    andamento, evitando importações sobrepostas que duplicariam pedidos. Os
+    últimos max_history jobs ficam disponíveis para consulta em get().
+
+    O estado é do processo: o serviço deve rodar com uma única instância e um
+    único processo (workers do gunicorn = 1, com threads).
+    """
+
+    def __init__(self, max_history=50):
+        self.max_history = max_history
+        self._jobs = OrderedDict()
+        self._running = None
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, params=None):
+        """Agenda fn(job) em segundo plano e retorna o job
+
+        fn recebe o ImportJob para informar fases (set_phase) e progresso
+        (update); o valor retornado vira job.result.
+        """
+        with self._lock:
+            if self._running is not None:
+                raise ImportJobRunning(self._running)
+            job = ImportJob(kind, params)
+            self._running = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_history:
+                self._jobs.popitem(last=False)
+        thread = threading.Thread(target=self._run, args=(job, fn), name=f"import-job-{job.id}", daemon=True)
+        thread.start()
+        return job
+
+    def _run(self, job, fn):
+        root = logging.getLogger()
+        job._errors.thread_id = threading.get_ident()
+        root.addHandler(job._errors)
+        job.status = 'running'
+        job.started_at = _now()
+        job._started = time.monotonic()
+        logger.info(f"🚀 Job {job.id} ({job.kind}) iniciado")
+        try:
+            job.result = fn(job)
+            job.status = 'succeeded'
+            logger.info(f"✅ Job {job.id} concluído")
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            logger.error(f"❌ Job {job.id} falhou: {str(e)}")
+        finally:
+            root.removeHandler(job._errors)
+            job._elapsed = round(time.monotonic() - job._started, 1)
+            job.finished_at = _now()
+            with self._lock:
+                self._running = None
+
+    def get(self, job_id):
+        """Job pelo id (None se desconhecido ou já descartado do histórico)"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def running(self):
+        with self._lock:
+            return self._running
+
+    def list(self):
+        """Jobs mais recentes primeiro"""
+        with self._lock:
+            return list(reversed(self._jobs.values()))
@@ -0,0 +1,60 @@
+import json
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+class StdlibCodec:
+    """Codec JSON da biblioteca padrão"""
+    name = 'stdlib'
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj):
+        return json.dumps(obj, ensure_ascii=False, default=str, separators=(',', ':'))
+
+    def dumps_bytes(self, obj):
+        return self.dumps(obj).encode('utf-8')
+
+class OrjsonCodec:
+    """Codec JSON com orjson (decodifica direto de bytes e gera bytes UTF-8)"""
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._loads = orjson.loads
+        self._dumps = orjson.dumps
+
+    def loads(self, data):
+        return self._loads(data)
+
+    def dumps(self, obj):
+        return self._dumps(obj, default=str).decode('utf-8')
+
+    def dumps_bytes(self, obj):
+        return self._dumps(obj, default=str)
+
+@lru_cache(maxsize=None)
+def get_codec(name=None):
+    """Retorna o codec JSON configurado (json.codec: auto | orjson | stdlib)
+
+    "auto" (padrão) usa orjson se estiver instalado e a biblioteca padrão caso
+    contrário; "orjson" exige o pacote.
+    """
+    name = name or 'auto'
+    if name == 'stdlib':
+        return StdlibCodec()
+    if name not in ('auto', 'orjson'):
+        raise ValueError(f"Codec JSON desconhecido: {name}")
+    try:
+        return OrjsonCodec()
+    except ImportError:
+        if name == 'orjson':
+            raise ImportError("O codec orjson requer o pacote orjson (pip install orjson)")
+        logger.debug("orjson não instalado; usando o json da biblioteca padrão")
+        return StdlibCodec()
+
+def codec_from_config(config):
+    """Codec definido em json.codec do config.yaml"""
+    return get_codec((config.get('json') or {}).get('codec'))
@@ -0,0 +1,97 @@
+import json
+import codecs
+
+_WHITESPACE = ' \t\n\r'
+_decoder = json.JSONDecoder()
+
+class _StreamBuffer:
+    """Texto decodificado dos blocos recebidos, consumido da esquerda para a direita"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decode = codecs.getincrementaldecoder('utf-8')().decode
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Acrescenta o próximo bloco, descartando o que já foi consumido; False no fim"""
+        if self.eof:
+            return False
+        for chunk in self._chunks:
+            text = self._decode(chunk) if chunk else ''
+            if text:
+                self.text = self.text[self.pos:] + text
+                self.pos = 0
+                return True
+        self.text = self.text[self.pos:] + self._decode(b'', final=True)
+        self.pos = 0
+        self.eof = True
+        return False
+
+    def peek(self):
+        """Próximo caractere que não é espaço (None no fim do conteúdo)"""
+        while True:
+            text, pos = self.text, self.pos
+            while pos < len(text) and text[pos] in _WHITESPACE:
+                pos += 1
+            self.pos = pos
+            if pos < len(text):
+                return text[pos]
+            if not self.fill():
+                return None
+
+    def expect(self, chars):
+        """Consome um dos caracteres esperados e o retorna"""
+        char = self.peek()
+        if char is None or char not in chars:
+            found = 'fim do conteúdo' if char is None else f"'{char}'"
+            raise ValueError(f"JSON inválido: esperado {' ou '.join(repr(c) for c in chars)}, encontrado {found}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decodifica o próximo valor JSON completo, lendo mais blocos se necessário"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+                # Um número no fim do buffer pode continuar no próximo bloco
+                if end < len(self.text) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+def iter_array_items(chunks, key, meta=None):
+    """Gera, um a um, os elementos da lista `key` de um objeto JSON recebido em blocos
+
+    chunks é um iterável de bytes (ex.: response.iter_content()). Só o elemento
+    atual e o bloco em leitura ficam em memória, independentemente do tamanho
+    da lista. Os demais campos de primeiro nível são decodificados inteiros e,
+    se meta for um dicionário, guardados nele.
+    """
+    buffer = _StreamBuffer(chunks)
+    buffer.expect('{')
+    if buffer.peek() == '}':
+        return
+    while True:
+        name = buffer.value()
+        buffer.expect(':')
+        if name == key and buffer.peek() == '[':
+            buffer.expect('[')
+            if buffer.peek() == ']':
+                buffer.expect(']')
+            else:
+                while True:
+                    yield buffer.value()
+                    if buffer.expect(',]') == ']':
+                        break
+        else:
+            value = buffer.value()
+            if meta is not None:
+                meta[name] = value
+        if buffer.expect(',}') == '}':
+            return
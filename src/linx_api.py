@@ -1,47 +1,133 @@
 import requests
-import json
-import datetime
 import yaml
-import os
 import logging
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from rate_limiter import AdaptiveRateLimiter, parse_retry_after, backoff_delay
+from order_transformer import OrderTransformer
+from json_stream import iter_array_items
+from json_codec import codec_from_config
 
 logger = logging.getLogger(__name__)
 
-def convert_linx_date(date_str): 
-    """Converte o formato de data do LINX (/Date(timestamp-offset)/) para o formato do BigQuery"""
-    if not date_str or not date_str.startswith('/Date('):
-        return None
-    
-    try:
-        # Extrai o timestamp e o offset
-        timestamp_str = date_str.split('(')[1].split(')')[0]
-        timestamp = int(timestamp_str.split('-')[0]) / 1000  # Converte de milissegundos para segundos
-        
-        # Converte para datetime
-        dt = datetime.fromtimestamp(timestamp)
+class LinxAPI:
+    def __init__(self, config=None):
+        """Inicializa a API com as configurações do arquivo YAML ou dicionário"""
+        if not isinstance(config, dict):
+            config_path = config if config else 'config/config.yaml'
+            with open(config_path, 'r') as file:
+                config = yaml.safe_load(file)
+        self.base_url = config['linx_api']['base_url']
+        self.username = config['linx_api']['username']
+        self.password = config['linx_api']['password']
+        # Número máximo de requisições simultâneas de detalhes de pedidos
+        self.max_in_flight = config['linx_api'].get('max_in_flight', 8)
         
-        # Retorna no formato do BigQuery
-        return dt.strftime('%Y-%m-%d %H:%M:%S')
-    except Exception as e:
-        logger.warning(f"Erro ao converter data {date_str}: {str(e)}")
-        return None
+        # Limitador de taxa compartilhado entre as threads e política de retentativas
+        self.rate_limiter = AdaptiveRateLimiter(**(config['linx_api'].get('rate_limit') or {}))
+        retry = config['linx_api'].get('retry') or {}
+        self.max_attempts = retry.get('max_attempts', 5)
+        self.base_delay = retry.get('base_delay', 0.5)
+        self.max_delay = retry.get('max_delay', 30)
 
-class LinxAPI:
-    def __init__(self, config_path='config/config.yaml'):
-        """Inicializa a API com as configurações do arquivo YAML"""
-        with open(config_path, 'r') as file:
-            config = yaml.safe_load(file)
-            self.base_url = config['linx_api']['base_url']
-            self.username = config['linx_api']['username']
-            self.password = config['linx_api']['password']
+        # Codec JSON dos payloads e respostas (json.codec)
+        self.json = codec_from_config(config)
+
+        # Plano de conversão pedido LINX -> linha do BigQuery (montado uma vez)
+        self.transformer = OrderTransformer(config['table_schema'])
+
+        # Pool de conexões, keep-alive, compressão e timeouts (linx_api.http)
+        http = config['linx_api'].get('http') or {}
+        self.timeout = (http.get('connect_timeout', 5), http.get('read_timeout', 60))
+        # Tamanho dos blocos lidos das respostas em streaming
+        self.stream_chunk_size = http.get('stream_chunk_size', 65536)
         
         self.session = requests.Session()
         self.session.auth = (self.username, self.password)
         self.session.headers.update({
             'Content-Type': 'application/json',
-            'Accept': 'application/json'
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate' if http.get('gzip', True) else 'identity',
+            'Connection': 'keep-alive' if http.get('keep_alive', True) else 'close'
         })
+        # O pool precisa comportar todas as requisições simultâneas (no mínimo
+        # max_in_flight conexões, mesmo com pool_maxsize menor); pool_block
+        # faz uma thread excedente aguardar uma conexão livre em vez de abrir
+        # conexões descartáveis
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=http.get('pool_connections', 4),
+            pool_maxsize=max(http.get('pool_maxsize') or 10, self.max_in_flight),
+            pool_block=True
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def connection_stats(self):
+        """Estatísticas de reutilização de conexões do pool HTTP"""
+        adapter = self.session.get_adapter(self.base_url)
+        pools = adapter.poolmanager.pools
+        connections = 0
+        requests_sent = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            requests_sent += pool.num_requests
+        return {
+            'connections_opened': connections,
+            'requests': requests_sent,
+            'connections_reused': max(0, requests_sent - connections),
+            'reuse_ratio': round((requests_sent - connections) / requests_sent, 3) if requests_sent else 0.0
+        }
+
+    def _post(self, url, payload, **kwargs):
+        """Executa um POST respeitando o limitador de taxa, com retentativas
+
+        Repete a requisição com backoff exponencial (com jitter) em respostas
+        429/5xx, erros de conexão e timeouts, respeitando o Retry-After.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.max_attempts):
+            last_attempt = attempt == self.max_attempts - 1
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.post(url, data=self.json.dumps_bytes(payload), **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.rate_limiter.on_throttle()
+                if last_attempt:
+                    raise
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                logger.warning(f"Falha de conexão em {url} ({str(e)}). Nova tentativa em {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            if response.status_code == 429 or response.status_code >= 500:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                self.rate_limiter.on_throttle(retry_after)
+                if last_attempt:
+                    response.raise_for_status()
+                delay = max(backoff_delay(attempt, self.base_delay, self.max_delay), retry_after or 0)
+                logger.warning(f"Resposta {response.status_code} em {url}. Nova tentativa em {delay:.1f}s")
+                response.close()
+                time.sleep(delay)
+                continue
+
+            response.raise_for_status()
+            self.rate_limiter.on_success()
+            return response
+
+    def _post_items(self, url, payload, key='Result'):
+        """POST com a resposta lida em streaming: gera os elementos da lista `key` à medida que chegam
+
+        As retentativas de _post cobrem a requisição até o recebimento dos
+        cabeçalhos; uma falha no meio da leitura do corpo é propagada.
+        """
+        response = self._post(url, payload, stream=True)
+        try:
+            yield from iter_array_items(response.iter_content(self.stream_chunk_size), key)
+        finally:
+            response.close()
 
     def search_queue_items(self, queue_id=31, page_size=10):
         """Busca itens na fila de pedidos"""
@@ -56,16 +142,38 @@ class LinxAPI:
             }
         }
         
-        response = self.session.post(url, json=payload)
-        response.raise_for_status()
-        return response.json()
+        response = self._post(url, payload)
+        return self.json.loads(response.content)
 
     def get_order_by_number(self, order_number):
         """Obtém detalhes de um pedido pelo número"""
         url = f"{self.base_url}/v1/Sales/API.svc/web/GetOrderByNumber"
-        response = self.session.post(url, json=order_number)
-        response.raise_for_status()
-        return response.json()
+        response = self._post(url, order_number)
+        return self.json.loads(response.content)
+
+    def get_orders_by_number(self, order_numbers, max_workers=None):
+        """Obtém detalhes de vários pedidos em paralelo
+
+        Retorna uma lista de tuplas (order_number, order_data, error) na mesma
+        ordem de order_numbers; error é None quando a busca foi bem-sucedida.
+        """
+        order_numbers = list(order_numbers)
+        if not order_numbers:
+            return []
+
+        def fetch(order_number):
+            try:
+                return order_number, self.get_order_by_number(order_number), None
+            except Exception as e:
+                return order_number, None, e
+
+        workers = min(max_workers or self.max_in_flight, len(order_numbers))
+        if workers <= 1:
+            return [fetch(order_number) for order_number in order_numbers]
+        # executor.map limita o número de requisições em andamento a "workers"
+        # e devolve os resultados na ordem de entrada
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='linx-fetch') as executor:
+            return list(executor.map(fetch, order_numbers))
 
     def dequeue_queue_items(self, queue_items):
         """Remove itens da fila após processamento"""
@@ -75,151 +183,16 @@ class LinxAPI:
             "QueueItems": queue_items
         }
         
-        response = self.session.post(url, json=payload)
-        response.raise_for_status()
-        return response.json()
-
-    def safe_convert(self, value, target_type, default=None):
-        """Converte valores de forma segura para o tipo desejado"""
-        if value is None:
-            return default
-        
-        try:
-            if target_type == int:
-                return int(float(str(value)))
-            elif target_type == float:
-                return float(str(value))
-            elif target_type == str:
-                return str(value)
-            else:
-                return value
-        except (ValueError, TypeError):
-            logger.warning(f"Não foi possível converter o valor '{value}' para {target_type.__name__}")
-            return default
+        response = self._post(url, payload)
+        return self.json.loads(response.content)
 
     def process_order(self, order_data):
         """Processa os dados do pedido para o formato do BigQuery"""
         try:
-            # Extrai o endereço de entrega
-            delivery_address = None
-            for address in order_data.get('Addresses', []):
-                if address.get('AddressType') == 68:  # Tipo 68 é endereço de entrega
-                    delivery_address = address
-                    break
-
-            # Processa os itens do pedido
-            items = []
-            for item in order_data.get('Items', []):
-                items.append({
-                    'ProductID': item.get('ProductID'),
-                    'ProductName': item.get('ProductName'),
-                    'SKU': item.get('SKU'),
-                    'Qty': float(item.get('Qty', 0)),
-                    'Price': float(item.get('Price', 0)),
-                    'Total': float(item.get('Total', 0)),
-                    'Weight': float(item.get('Weight', 0)),
-                    'Width': float(item.get('Width', 0)),
-                    'Height': float(item.get('Height', 0)),
-                    'Depth': float(item.get('Depth', 0))
-                })
-
-            # Processa os métodos de pagamento
-            payment_methods = []
-            for payment in order_data.get('PaymentMethods', []):
-                payment_info = payment.get('PaymentInfo', {})
-                payment_methods.append({
-                    'PaymentMethodID': payment.get('PaymentMethodID'),
-                    'Amount': float(payment.get('Amount', 0)),
-                    'Status': payment.get('Status'),
-                    'PaymentDate': convert_linx_date(payment.get('PaymentDate')),
-                    'Installments': payment.get('Installments'),
-                    'PaymentInfo': payment_info.get('Alias'),
-                    'PaymentType': payment_info.get('PaymentType'),
-                    'Provider': payment_info.get('Provider'),
-                    'AuthorizationCode': payment_info.get('AuthorizationCode'),
-                    'TransactionNumber': payment_info.get('TransactionNumber')
-                })
-
-            # Processa os métodos de entrega
-            delivery_methods = []
-            for prop in order_data.get('Properties', []):
-                if prop.get('Type') == 'DeliveryMethod':
-                    delivery_methods.append({
-                        'DeliveryMethodAlias': prop.get('Reference'),
-                        'ETA': prop.get('Message'),
-                        'Amount': float(prop.get('Amount', 0)),
-                        'CarrierName': 'Personalizado'  # Valor padrão
-                    })
-
-            # Processa os envios
-            shipments = []
-            for shipment in order_data.get('Shipments', []):
-                shipment_number = str(shipment.get('ShipmentNumber', ''))
-                shipment_status = shipment.get('ShipmentStatus')
-                try:
-                    shipment_status = int(shipment_status)
-                except (ValueError, TypeError):
-                    shipment_status = None
-                shipments.append({
-                    'ShipmentNumber': shipment_number,
-                    'ShipmentStatus': shipment_status
-                })
-
-            # Retorna os dados processados
-            return {
-                'order_id': order_data.get('OrderID'),
-                'order_number': order_data.get('OrderNumber'),
-                'created_date': convert_linx_date(order_data.get('CreatedDate')),
-                'global_status': order_data.get('GlobalStatus'),
-                'order_status_id': order_data.get('OrderStatusID'),
-                'total': float(order_data.get('Total', 0)),
-                'subtotal': float(order_data.get('SubTotal', 0)),
-                'delivery_amount': float(order_data.get('DeliveryAmount', 0)),
-                'discount_amount': float(order_data.get('DiscountAmount', 0)),
-                'tax_amount': float(order_data.get('TaxAmount', 0)),
-                
-                # Informações do cliente
-                'customer_id': order_data.get('CustomerID'),
-                'customer_name': order_data.get('CustomerName'),
-                'customer_email': order_data.get('CustomerEmail'),
-                'customer_type': order_data.get('CustomerType'),
-                'customer_cpf': order_data.get('CustomerCPF'),
-                'customer_cnpj': order_data.get('CustomerCNPJ'),
-                'customer_cell_phone': order_data.get('CustomerCellPhone'),
-                'customer_phone': order_data.get('CustomerPhone'),
-                'customer_gender': order_data.get('CustomerGender'),
-                'customer_birth_date': convert_linx_date(order_data.get('CustomerBirthDate')),
-                
-                # Endereço de entrega
-                'delivery_address_line': delivery_address.get('AddressLine') if delivery_address else None,
-                'delivery_address_number': delivery_address.get('Number') if delivery_address else None,
-                'delivery_neighbourhood': delivery_address.get('Neighbourhood') if delivery_address else None,
-                'delivery_city': delivery_address.get('City') if delivery_address else None,
-                'delivery_state': delivery_address.get('State') if delivery_address else None,
-                'delivery_postal_code': delivery_address.get('PostalCode') if delivery_address else None,
-                'delivery_contact_name': delivery_address.get('ContactName') if delivery_address else None,
-                'delivery_contact_phone': delivery_address.get('ContactPhone') if delivery_address else None,
-                
-                # Arrays
-                'items': items,
-                'payment_methods': payment_methods,
-                'delivery_methods': delivery_methods,
-                'shipments': shipments,
-                
-                # Status do envio
-                'shipment_status': order_data.get('ShipmentStatus'),
-                
-                # Informações do vendedor
-                'seller_name': order_data.get('Seller', {}).get('Name'),
-                'seller_email': order_data.get('Seller', {}).get('EMail'),
-                'seller_phone': order_data.get('Seller', {}).get('Phone'),
-                'seller_integration_id': order_data.get('Seller', {}).get('IntegrationID'),
-                # Metadados
-                'created_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-            }
+            return self.transformer.transform(order_data)
         except Exception as e:
             logger.error(f"Erro ao processar pedido: {str(e)}")
-            raise 
+            raise
 
     def search_orders(self, page_index: int = 1, page_size: int = 100, last_date: str = None) -> dict:
         """Busca pedidos na API LINX"""
@@ -232,9 +205,8 @@ class LinxAPI:
             }
             if last_date:
                 payload["OrderDate"] = last_date
-            response = self.session.post(f"{self.base_url}/v1/Sales/API.svc/web/SearchOrders", json=payload)
-            response.raise_for_status()
-            return response.json()
+            response = self._post(f"{self.base_url}/v1/Sales/API.svc/web/SearchOrders", payload)
+            return self.json.loads(response.content)
         except Exception as e:
             logger.error(f"Erro ao buscar pedidos: {str(e)}")
             raise 
\ No newline at end of file
@@ -0,0 +1,91 @@
+import re
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# /Date(1700000000000-0300)/ : milissegundos desde a época (UTC) e, opcionalmente,
+# o fuso de origem. O fuso é apenas informativo: o instante já está em UTC.
+_LINX_DATE_RE = re.compile(r'/Date\((-?\d+)(?:[+-]\d{4})?\)/')
+
+def _civil_from_days(days):
+    """Converte dias desde 1970-01-01 em (ano, mês, dia) usando só aritmética inteira"""
+    days += 719468
+    era = (days if days >= 0 else days - 146096) // 146097
+    day_of_era = days - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    month_index = (5 * day_of_year + 2) // 153
+    day = day_of_year - (153 * month_index + 2) // 5 + 1
+    month = month_index + 3 if month_index < 10 else month_index - 9
+    year = year_of_era + era * 400 + (1 if month <= 2 else 0)
+    return year, month, day
+
+# "00".."59": evita formatar números com f-string a cada conversão
+_TWO_DIGITS = [f"{value:02d}" for value in range(60)]
+
+@lru_cache(maxsize=8192)
+def _format_day(days):
+    year, month, day = _civil_from_days(days)
+    return f"{year:04d}-{_TWO_DIGITS[month]}-{_TWO_DIGITS[day]} "
+
+def format_epoch_ms(timestamp_ms):
+    """Formata milissegundos desde a época como "YYYY-MM-DD HH:MM:SS" em UTC"""
+    days, seconds = divmod(timestamp_ms // 1000, 86400)
+    hour, seconds = divmod(seconds, 3600)
+    minute, second = divmod(seconds, 60)
+    return _format_day(days) + _TWO_DIGITS[hour] + ':' + _TWO_DIGITS[minute] + ':' + _TWO_DIGITS[second]
+
+def linx_date_to_epoch_ms(date_str):
+    """Extrai os milissegundos (UTC) de uma data LINX; None se inválida"""
+    if type(date_str) is not str:
+        return None
+    match = _LINX_DATE_RE.fullmatch(date_str)
+    if not match:
+        return None
+    return int(match.group(1))
+
+@lru_cache(maxsize=65536)
+def _convert_cached(date_str):
+    match = _LINX_DATE_RE.fullmatch(date_str)
+    if not match:
+        if date_str.startswith('/Date('):
+            logger.warning(f"Erro ao converter data {date_str}: formato inválido")
+        return None
+    return format_epoch_ms(int(match.group(1)))
+
+def convert_linx_date(date_str):
+    """Converte o formato de data do LINX (/Date(timestamp-offset)/) para o formato do BigQuery (UTC)"""
+    if not date_str or type(date_str) is not str:
+        return None
+    return _convert_cached(date_str)
+
+def convert_linx_dates(values):
+    """Converte uma lista de datas LINX de uma vez
+
+    Cada valor distinto é convertido uma única vez; com numpy disponível a
+    formatação é feita em bloco (datetime64).
+    """
+    unique = {value for value in values if value and type(value) is str}
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+    if np is None or len(unique) < 64:
+        converted = {value: _convert_cached(value) for value in unique}
+    else:
+        converted = {}
+        keys, millis = [], []
+        for value in unique:
+            timestamp_ms = linx_date_to_epoch_ms(value)
+            if timestamp_ms is None:
+                converted[value] = _convert_cached(value)
+            else:
+                keys.append(value)
+                millis.append(timestamp_ms)
+        if keys:
+            seconds = np.floor_divide(np.array(millis, dtype=np.int64), 1000).astype('datetime64[s]')
+            for value, text in zip(keys, np.datetime_as_string(seconds, unit='s')):
+                converted[value] = text.replace('T', ' ')
+    return [converted.get(value) for value in values]
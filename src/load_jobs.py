@@ -0,0 +1,212 @@
+import os
+import time
+import logging
+from datetime import datetime, UTC
+from json_codec import get_codec
+
+logger = logging.getLogger(__name__)
+
+# Tipos do BigQuery que são gravados como timestamp no Parquet
+TIMESTAMP_TYPES = {'TIMESTAMP', 'DATETIME'}
+
+def arrow_schema(table_schema):
+    """Monta o schema do pyarrow equivalente ao table_schema do config.yaml"""
+    import pyarrow as pa
+
+    def arrow_type(field):
+        field_type = field['type']
+        if field_type == 'RECORD':
+            return pa.struct([pa.field(sub['name'], arrow_type(sub)) for sub in field.get('fields', [])])
+        if field_type in ('INTEGER', 'INT64'):
+            return pa.int64()
+        if field_type in ('FLOAT', 'FLOAT64', 'NUMERIC'):
+            return pa.float64()
+        if field_type in ('BOOLEAN', 'BOOL'):
+            return pa.bool_()
+        if field_type in TIMESTAMP_TYPES:
+            return pa.timestamp('us', tz='UTC')
+        return pa.string()
+
+    fields = []
+    for field in table_schema:
+        field_type = arrow_type(field)
+        if field.get('mode') == 'REPEATED':
+            field_type = pa.list_(field_type)
+        fields.append(pa.field(field['name'], field_type, nullable=field.get('mode') != 'REQUIRED'))
+    return pa.schema(fields)
+
+
+def _parse_timestamp(value):
+    if not value or not isinstance(value, str):
+        return value
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=UTC)
+
+
+def _timestamp_paths(table_schema):
+    """Lista os campos de data (de primeiro nível e dentro de RECORDs)"""
+    top, nested = [], []
+    for field in table_schema:
+        if field['type'] in TIMESTAMP_TYPES:
+            top.append(field['name'])
+        elif field['type'] == 'RECORD':
+            for sub in field.get('fields', []):
+                if sub['type'] in TIMESTAMP_TYPES:
+                    nested.append((field['name'], sub['name']))
+    return top, nested
+
+
+class ChunkedLoadWriter:
+    """Grava linhas em arquivos locais e envia cada arquivo como um load job.
+
+    Tem a mesma interface do BufferedWriter (add/flush/close retornando
+    (inserted, failed)), mas um flush só acontece quando o bloco atinge
+    chunk_size linhas ou no close(). NDJSON é gravado em disco à medida que as
+    linhas chegam; Parquet (requer pyarrow) acumula o bloco e é escrito de uma
+    vez, e também aceita lotes já em colunas (add_batch). Load jobs não têm o
+    custo nem os limites por requisição do streaming.
+    """
+
+    def __init__(self, bq_client, chunk_size=50000, file_format='ndjson', output_dir=None, keep_files=False,
+                 json_codec=None):
+        if file_format not in ('ndjson', 'parquet'):
+            raise ValueError(f"Formato de backfill desconhecido: {file_format}")
+        if file_format == 'parquet':
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ImportError("O formato parquet requer o pacote pyarrow (pip install pyarrow)")
+        self.bq_client = bq_client
+        self.chunk_size = chunk_size
+        self.file_format = file_format
+        self.output_dir = output_dir or os.path.join('/tmp', 'linx_backfill')
+        self.keep_files = keep_files
+        self.json = json_codec or get_codec()
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.jobs = []
+        self.requests = 0
+        self._chunk_index = 0
+        self._keys = []
+        self._rows = []
+        self._batches = []
+        self._file = None
+        self._path = None
+        self._table_checked = False
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _open_chunk(self):
+        self._chunk_index += 1
+        extension = 'json' if self.file_format == 'ndjson' else 'parquet'
+        self._path = os.path.join(self.output_dir, f"chunk_{os.getpid()}_{int(time.time())}_{self._chunk_index:05d}.{extension}")
+        if self.file_format == 'ndjson':
+            self._file = open(self._path, 'wb')
+
+    def add(self, row, key=None):
+        """Adiciona uma linha ao bloco atual; retorna o resultado se o bloco for enviado"""
+        if not self._keys:
+            self._open_chunk()
+        if self.file_format == 'ndjson':
+            self._file.write(self.json.dumps_bytes(row))
+            self._file.write(b'\n')
+        else:
+            self._rows.append(row)
+        self._keys.append(key)
+        if len(self._keys) >= self.chunk_size:
+            return self._submit()
+        return None
+
+    def add_batch(self, batch, keys):
+        """Adiciona um pyarrow.RecordBatch (formato parquet) com a chave de cada linha
+
+        O lote é dividido se ultrapassar o bloco atual; retorna (inserted, failed)
+        dos blocos enviados.
+        """
+        if self.file_format != 'parquet':
+            raise ValueError("add_batch requer o formato parquet")
+        inserted, failed = [], []
+        offset = 0
+        while offset < len(keys):
+            if not self._keys:
+                self._open_chunk()
+            part = batch.slice(offset, self.chunk_size - len(self._keys))
+            self._batches.append(part)
+            self._keys.extend(keys[offset:offset + part.num_rows])
+            offset += part.num_rows
+            if len(self._keys) >= self.chunk_size:
+                done, errors = self._submit()
+                inserted.extend(done)
+                failed.extend(errors)
+        return inserted, failed
+
+    def flush(self):
+        """Não envia blocos incompletos; o envio ocorre por tamanho ou no close()"""
+        return [], []
+
+    def close(self):
+        """Envia o bloco incompleto restante"""
+        if not self._keys:
+            return [], []
+        return self._submit()
+
+    def _write_parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table_schema = self.bq_client.table_schema
+        schema = arrow_schema(table_schema)
+        batches = list(self._batches)
+        if self._rows:
+            top, nested = _timestamp_paths(table_schema)
+            for row in self._rows:
+                for name in top:
+                    row[name] = _parse_timestamp(row.get(name))
+                for record, sub in nested:
+                    for entry in row.get(record) or []:
+                        entry[sub] = _parse_timestamp(entry.get(sub))
+            batches.append(pa.RecordBatch.from_pylist(self._rows, schema=schema))
+        pq.write_table(pa.Table.from_batches(batches, schema=schema), self._path, compression='snappy')
+
+    def _submit(self):
+        keys, path = self._keys, self._path
+        if self.file_format == 'ndjson':
+            self._file.close()
+            self._file = None
+        else:
+            self._write_parquet()
+        self._keys, self._rows, self._batches = [], [], []
+
+        if not self._table_checked:
+            self.bq_client.create_table_if_not_exists()
+            self._table_checked = True
+
+        started = time.perf_counter()
+        try:
+            self.requests += 1
+            job = self.bq_client.load_file(path, self.file_format)
+        except Exception as e:
+            logger.error(f"Erro no load job do arquivo {path}: {str(e)}")
+            return [], [{'key': key, 'row': None, 'errors': [{'reason': 'loadJobError', 'message': str(e)}]}
+                        for key in keys]
+
+        summary = {
+            'file': os.path.basename(path),
+            'job_id': job.job_id,
+            'rows': job.output_rows,
+            'file_bytes': os.path.getsize(path),
+            'seconds': round(time.perf_counter() - started, 1)
+        }
+        self.jobs.append(summary)
+        logger.info(f"Load job {summary['job_id']}: {summary['rows']} linhas, "
+                    f"{summary['file_bytes']} bytes ({summary['file']}) em {summary['seconds']}s")
+        if not self.keep_files:
+            os.remove(path)
+        return keys, []
+
+    def summary(self):
+        """Totais de linhas/bytes dos load jobs executados"""
+        return {
+            'jobs': len(self.jobs),
+            'rows': sum(job['rows'] or 0 for job in self.jobs),
+            'file_bytes': sum(job['file_bytes'] for job in self.jobs)
+        }
@@ -1,6 +1,10 @@
 from linx_api import LinxAPI
 from bigquery_client import BigQueryClient
-import time
+from queue_consumer import QueueConsumer
+from dead_letter import create_dead_letter_store
+import signal
+import argparse
+import yaml
 import logging
 
 # Configuração do logging
@@ -10,64 +14,47 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def main():
-    try:
-        # Inicializa os clientes
-        linx_api = LinxAPI()
-        bq_client = BigQueryClient()
-
-        # Cria a tabela se não existir
-        bq_client.create_table_if_not_exists()
-
-        # Busca itens na fila
-        queue_response = linx_api.search_queue_items()
-        
-        if not queue_response.get('Result'):
-            logger.info("Nenhum pedido encontrado na fila")
-            return
+def main(config_path='config/config.yaml', once=False, max_items=None, max_runtime_seconds=None):
+    """Consome a fila de pedidos da LINX e grava os pedidos no BigQuery
 
-        # Lista para armazenar os IDs dos itens processados
-        processed_items = []
-        # Lista para armazenar os dados processados
-        processed_data = []
-
-        # Processa cada item da fila
-        for item in queue_response['Result']:
-            try:
-                # Obtém o número do pedido
-                order_number = item.get('EntityKeyValue')
-                if not order_number:
-                    continue
+    Por padrão roda continuamente até receber SIGTERM/SIGINT; once=True
+    encerra quando a fila esvazia. Os limites de queue no config.yaml podem
+    ser sobrescritos por max_items e max_runtime_seconds.
+    """
+    try:
+        with open(config_path, 'r') as file:
+            config = yaml.safe_load(file)
+        queue_config = config['queue'] = dict(config.get('queue') or {})
+        if once:
+            queue_config['exit_when_empty'] = True
+        if max_items:
+            queue_config['max_items'] = max_items
+        if max_runtime_seconds:
+            queue_config['max_runtime_seconds'] = max_runtime_seconds
 
-                # Busca os detalhes do pedido
-                order_data = linx_api.get_order_by_number(order_number)
-                
-                # Processa os dados do pedido
-                processed_order = linx_api.process_order(order_data)
-                processed_data.append(processed_order)
-                
-                # Adiciona o ID do item à lista de processados
-                processed_items.append(item.get('QueueItemID'))
-                
-                logger.info(f"Pedido {order_number} processado com sucesso")
+        # Inicializa os clientes
+        linx_api = LinxAPI(config)
+        bq_client = BigQueryClient(config)
+        consumer = QueueConsumer(linx_api, bq_client, config,
+                                 dead_letters=create_dead_letter_store(config, bq_client))
 
-            except Exception as e:
-                logger.error(f"Erro ao processar pedido {order_number}: {str(e)}")
-                continue
+        # Encerramento gracioso: conclui os itens em andamento antes de sair
+        def handle_signal(signum, frame):
+            logger.info(f"Sinal {signal.Signals(signum).name} recebido")
+            consumer.stop()
+        signal.signal(signal.SIGTERM, handle_signal)
+        signal.signal(signal.SIGINT, handle_signal)
 
-        # Insere os dados no BigQuery
-        if processed_data:
-            success = bq_client.insert_rows(processed_data)
-            if success:
-                # Remove os itens processados da fila
-                if processed_items:
-                    linx_api.dequeue_queue_items(processed_items)
-                logger.info(f"{len(processed_data)} pedidos inseridos com sucesso")
-            else:
-                logger.error("Erro ao inserir dados no BigQuery")
+        return consumer.run()
 
     except Exception as e:
         logger.error(f"Erro durante a execução: {str(e)}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Consome a fila de pedidos da LINX')
+    parser.add_argument('--once', action='store_true', help='Encerra quando a fila estiver vazia')
+    parser.add_argument('--max-items', type=int, help='Encerra após ler N itens da fila')
+    parser.add_argument('--max-runtime', type=int, help='Encerra após N segundos')
+    args = parser.parse_args()
+
+    main(once=args.once, max_items=args.max_items, max_runtime_seconds=args.max_runtime)
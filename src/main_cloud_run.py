@@ -2,11 +2,19 @@
 """
 Entry point para Cloud Run - Importação de pedidos LINX
 Equivale a executar: python3 src/import_historical_orders.py --only-new
+
+As importações rodam em segundo plano: POST /import responde 202 com o id do
+job e GET /jobs/<id> informa o progresso. Apenas uma importação roda por vez.
+
+Em produção o app é servido pelo gunicorn (cloud-run/gunicorn.conf.py);
+executar este arquivo diretamente usa o servidor de desenvolvimento do Flask.
 """
 
 import os
 import sys
 import logging
+import threading
+import importlib.util
 from datetime import datetime
 from flask import Flask, request, jsonify
 
@@ -17,88 +25,119 @@ logger = logging.getLogger(__name__)
 # Adiciona o diretório src ao path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-# Importação com tratamento de erro
-try:
-    from import_historical_orders import import_historical_orders
-    logger.info("✅ Módulo import_historical_orders carregado com sucesso")
-except ImportError as e:
-    logger.error(f"❌ Erro ao importar módulo: {e}")
-    # Fallback: define uma função vazia
-    def import_historical_orders(*args, **kwargs):
-        raise Exception("Módulo import_historical_orders não pôde ser carregado")
+# O módulo de importação (google-cloud-bigquery, pyarrow, tqdm...) é importado
+# sob demanda, no aquecimento do worker ou na primeira importação, para que o
+# app responda ao health check logo após iniciar
+from import_jobs import JobManager, ImportJobRunning
+from clients import get_config
 
 # Cria a aplicação Flask
 app = Flask(__name__)
 
+# Importações em segundo plano (uma por vez)
+jobs = JobManager()
+
+def warm_up():
+    """Inicialização antecipada (hook post_worker_init do gunicorn)
+
+    Importa o módulo de importação e cria a configuração e os clientes
+    compartilhados do processo (clients.py), reaproveitados por todas as
+    importações seguintes.
+    """
+    from import_historical_orders import shared_clients
+    shared_clients()
+    logger.info("🔥 Worker aquecido")
+
+def warm_up_in_background():
+    """Executa warm_up() em uma thread, sem atrasar as primeiras requisições"""
+    def run():
+        try:
+            warm_up()
+        except Exception as e:
+            # A primeira importação refaz a inicialização
+            logger.warning(f"Falha no aquecimento do worker: {e}")
+    thread = threading.Thread(target=run, name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+def run_import(job, max_orders=None):
+    """Importa os pedidos novos e, se habilitado, reimporta os alterados"""
+    from import_historical_orders import import_historical_orders, refresh_changed_orders
+    job.set_phase('importacao')
+    result = {'import': import_historical_orders(max_orders=max_orders, only_new=True, progress_callback=job.update)}
+    
+    # Reimporta os pedidos recentes com status alterado
+    if max_orders is None and (get_config().get('change_detection') or {}).get('enabled', False):
+        job.set_phase('alteracoes')
+        result['changes'] = refresh_changed_orders(progress_callback=job.update)
+    return result
+
+def submit_import(kind, **params):
+    """Agenda a importação e responde 202, ou 409 se já houver uma em andamento"""
+    try:
+        job = jobs.submit(kind, lambda job: run_import(job, **params), params)
+    except ImportJobRunning as e:
+        logger.info(f"⏳ Importação {e.job.id} já em andamento; nova solicitação ignorada")
+        return jsonify({
+            'status': 'running',
+            'message': 'Já existe uma importação em andamento',
+            'job_id': e.job.id,
+            'status_url': f"/jobs/{e.job.id}"
+        }), 409
+    return jsonify({
+        'status': 'accepted',
+        'mode': kind,
+        'job_id': job.id,
+        'status_url': f"/jobs/{job.id}"
+    }), 202
+
 @app.route('/', methods=['GET'])
 def health_check():
     """Health check para Cloud Run"""
-    try:
-        # Verifica se o módulo está carregado
-        import import_historical_orders
+    # Verifica se o módulo de importação está disponível (sem importá-lo)
+    if 'import_historical_orders' in sys.modules:
         module_status = "loaded"
-    except ImportError:
+    elif importlib.util.find_spec('import_historical_orders') is not None:
+        module_status = "available"
+    else:
         module_status = "error"
     
+    running = jobs.running()
     return jsonify({
         'status': 'healthy',
         'service': 'linx-orders-importer',
         'version': '1.0.0',
         'module_status': module_status,
+        'running_job': running.id if running else None,
         'timestamp': str(datetime.now())
     })
 
 @app.route('/import', methods=['POST'])
 def import_orders():
-    """Endpoint para importar pedidos (equivalente ao --only-new)"""
-    try:
-        logger.info("🚀 Iniciando importação de pedidos LINX...")
-        
-        # Executa a importação (sempre com only_new=True)
-        import_historical_orders(max_orders=None, only_new=True)
-        
-        logger.info("✅ Importação concluída com sucesso!")
-        
-        return jsonify({
-            'status': 'success',
-            'message': 'Importação de pedidos concluída com sucesso',
-            'mode': 'only_new'
-        }), 200
-        
-    except Exception as e:
-        logger.error(f"❌ Erro na importação: {str(e)}")
-        return jsonify({
-            'status': 'error',
-            'error': str(e)
-        }), 500
+    """Endpoint para importar pedidos (equivalente ao --only-new), em segundo plano"""
+    logger.info("🚀 Solicitação de importação de pedidos LINX recebida")
+    return submit_import('only_new')
 
 @app.route('/import-test', methods=['POST'])
 def import_orders_test():
-    """Endpoint para teste com limite de pedidos"""
-    try:
-        data = request.get_json() or {}
-        max_orders = data.get('max_orders', 5)  # Padrão: 5 pedidos
-        
-        logger.info(f"🧪 Iniciando importação de teste (máx: {max_orders} pedidos)...")
-        
-        # Executa a importação com limite
-        import_historical_orders(max_orders=max_orders, only_new=True)
-        
-        logger.info("✅ Importação de teste concluída com sucesso!")
-        
-        return jsonify({
-            'status': 'success',
-            'message': f'Importação de teste concluída (máx: {max_orders} pedidos)',
-            'mode': 'test',
-            'max_orders': max_orders
-        }), 200
-        
-    except Exception as e:
-        logger.error(f"❌ Erro na importação de teste: {str(e)}")
-        return jsonify({
-            'status': 'error',
-            'error': str(e)
-        }), 500
+    """Endpoint para teste com limite de pedidos, em segundo plano"""
+    data = request.get_json(silent=True) or {}
+    max_orders = data.get('max_orders', 5)  # Padrão: 5 pedidos
+    logger.info(f"🧪 Solicitação de importação de teste (máx: {max_orders} pedidos)")
+    return submit_import('test', max_orders=max_orders)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Status e progresso de uma importação"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'error': f"Job {job_id} não encontrado"}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """Importações recentes (mais recentes primeiro)"""
+    return jsonify({'jobs': [job.to_dict() for job in jobs.list()]}), 200
 
 if __name__ == '__main__':
     # Cloud Run define a porta via variável de ambiente
@@ -112,17 +151,15 @@ if __name__ == '__main__':
     logger.info("   - GET  / : Health check")
     logger.info("   - POST /import : Importação completa (--only-new)")
     logger.info("   - POST /import-test : Importação de teste")
+    logger.info("   - GET  /jobs/<id> : Progresso de uma importação")
     
     try:
-        # Executa em modo de desenvolvimento se não for Cloud Run
+        # Servidor de desenvolvimento (em produção: gunicorn --config cloud-run/gunicorn.conf.py)
         if os.environ.get('K_SERVICE'):
-            # Modo Cloud Run
-            logger.info("☁️ Executando em modo Cloud Run")
-            app.run(host='0.0.0.0', port=port, threaded=True)
+            logger.warning("⚠️ Servidor de desenvolvimento do Flask no Cloud Run; use o gunicorn")
         else:
-            # Modo local para testes
-            logger.info("🔧 Modo local - use: python3 src/main_cloud_run.py")
-            app.run(host='0.0.0.0', port=port, debug=True)
+            logger.info("🔧 Modo local - use: python3 src/main_cloud_run.py (FLASK_DEBUG=1 para depuração)")
+        app.run(host='0.0.0.0', port=port, threaded=True, debug=os.environ.get('FLASK_DEBUG') == '1')
     except Exception as e:
         logger.error(f"❌ Erro ao iniciar servidor: {e}")
         sys.exit(1)
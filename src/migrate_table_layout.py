@@ -0,0 +1,49 @@
+import logging
+import os
+import argparse
+from bigquery_client import BigQueryClient
+
+# Configuração de logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Configura credenciais do Google Cloud
+os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.join(os.path.dirname(os.path.dirname(__file__)), "credentials", "datalake-betminds.json")
+
+def migrate_table_layout(dry_run=False):
+    """Aplica o particionamento e o clustering do config.yaml à tabela de pedidos existente"""
+    try:
+        bq_client = BigQueryClient()
+        actions = bq_client.migrate_table_layout(dry_run=dry_run)
+        if actions and not dry_run:
+            logger.info("Migração concluída com sucesso!")
+        return actions
+    except Exception as e:
+        logger.error(f"Erro ao migrar layout da tabela: {str(e)}")
+        raise
+
+def check_schema():
+    """Compara o schema da tabela de pedidos com o table_schema do config.yaml"""
+    bq_client = BigQueryClient()
+    drift = bq_client.check_schema_drift()
+    if not drift:
+        logger.info(f"Schema de {bq_client.table_ref} igual ao table_schema")
+    for kind, fields in drift.items():
+        for field in fields:
+            logger.warning(f"{kind}: {field}")
+    return drift
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Aplica particionamento/clustering à tabela de pedidos')
+    parser.add_argument('--dry-run', action='store_true', help='Apenas mostra as ações que seriam executadas')
+    parser.add_argument('--check-schema', action='store_true',
+                        help='Apenas compara o schema da tabela com o table_schema do config.yaml')
+    args = parser.parse_args()
+
+    if args.check_schema:
+        check_schema()
+    else:
+        migrate_table_layout(args.dry_run)
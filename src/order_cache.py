@@ -0,0 +1,216 @@
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from json_codec import get_codec, codec_from_config
+from linx_dates import convert_linx_date
+
+logger = logging.getLogger(__name__)
+
+# Limite de parâmetros por consulta IN (...) do SQLite
+_SQLITE_BATCH = 500
+
+class OrderCache:
+    """Cache local dos documentos brutos de pedidos da LINX (GetOrderByNumber)
+
+    Cada pedido é guardado uma vez por OrderNumber, como JSON comprimido com
+    zlib, junto com o hash SHA-256 do conteúdo, o CreatedDate e o momento do
+    download. Documentos com menos de ttl_hours são servidos sem chamar a API;
+    evict() remove os baixados há mais de retention_days e mantém no máximo
+    max_entries (os mais recentes). iter_orders() percorre o cache inteiro por
+    CreatedDate, usado no modo de reprocessamento (--replay-from-cache).
+    """
+
+    def __init__(self, path='order_cache.db', ttl_hours=168, retention_days=None, max_entries=None,
+                 compress_level=6, json_codec=None):
+        self.path = path
+        self.ttl_seconds = ttl_hours * 3600 if ttl_hours is not None else None
+        self.retention_seconds = retention_days * 86400 if retention_days is not None else None
+        self.max_entries = max_entries
+        self.compress_level = compress_level
+        self.json = json_codec or get_codec()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        # WAL + timeout: processos do backfill particionado compartilham o arquivo
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS orders (
+                order_number TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                created_date TEXT,
+                fetched_at REAL NOT NULL,
+                data BLOB NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS orders_created_date ON orders (created_date, order_number)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS orders_fetched_at ON orders (fetched_at)")
+        self._conn.commit()
+
+    def _decode(self, data):
+        return self.json.loads(zlib.decompress(data))
+
+    def get_many(self, order_numbers):
+        """Pedidos em cache e dentro do TTL: {order_number: pedido}"""
+        order_numbers = [str(number) for number in order_numbers]
+        min_fetched_at = time.time() - self.ttl_seconds if self.ttl_seconds is not None else 0
+        found = {}
+        with self._lock:
+            for start in range(0, len(order_numbers), _SQLITE_BATCH):
+                batch = order_numbers[start:start + _SQLITE_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT order_number, data FROM orders "
+                    f"WHERE order_number IN ({', '.join('?' * len(batch))}) AND fetched_at >= ?",
+                    (*batch, min_fetched_at)
+                ).fetchall()
+                found.update(rows)
+        return {number: self._decode(data) for number, data in found.items()}
+
+    def get(self, order_number):
+        """Pedido em cache (dentro do TTL) ou None"""
+        return self.get_many([order_number]).get(str(order_number))
+
+    def put_many(self, orders):
+        """Grava pedidos [(order_number, pedido)]; retorna os números cujo conteúdo mudou
+
+        Pedidos com o mesmo hash do que já está em cache só têm a data do
+        download atualizada (o documento não é regravado).
+        """
+        now = time.time()
+        encoded = {}
+        for order_number, order in orders:
+            raw = self.json.dumps_bytes(order)
+            encoded[str(order_number)] = (hashlib.sha256(raw).hexdigest(), raw, convert_linx_date(order.get('CreatedDate')))
+
+        changed = []
+        with self._lock:
+            numbers = list(encoded)
+            current = {}
+            for start in range(0, len(numbers), _SQLITE_BATCH):
+                batch = numbers[start:start + _SQLITE_BATCH]
+                current.update(self._conn.execute(
+                    f"SELECT order_number, content_hash FROM orders WHERE order_number IN ({', '.join('?' * len(batch))})",
+                    batch
+                ).fetchall())
+            for order_number, (content_hash, raw, created_date) in encoded.items():
+                if current.get(order_number) == content_hash:
+                    self._conn.execute("UPDATE orders SET fetched_at = ? WHERE order_number = ?", (now, order_number))
+                    continue
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO orders (order_number, content_hash, created_date, fetched_at, data) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (order_number, content_hash, created_date, now, zlib.compress(raw, self.compress_level))
+                )
+                changed.append(order_number)
+            self._conn.commit()
+        self.writes += len(changed)
+        return changed
+
+    def put(self, order_number, order):
+        """Grava um pedido; True se o conteúdo mudou"""
+        return bool(self.put_many([(order_number, order)]))
+
+    def fetch_through(self, order_numbers, fetch):
+        """Busca pedidos usando o cache: só os ausentes (ou expirados) são pedidos à API
+
+        fetch recebe a lista de números e retorna [(order_number, pedido, erro)],
+        como LinxAPI.get_orders_by_number; o resultado tem o mesmo formato e a
+        ordem de order_numbers. Os pedidos baixados com sucesso entram no cache.
+        """
+        order_numbers = list(order_numbers)
+        cached = self.get_many(order_numbers)
+        missing = [number for number in order_numbers if str(number) not in cached]
+        self.hits += len(order_numbers) - len(missing)
+        self.misses += len(missing)
+
+        fetched = {}
+        if missing:
+            for order_number, order, error in fetch(missing):
+                fetched[str(order_number)] = (order, error)
+            self.put_many([(number, order) for number, (order, error) in fetched.items() if error is None and order])
+
+        results = []
+        for order_number in order_numbers:
+            key = str(order_number)
+            if key in cached:
+                results.append((order_number, cached[key], None))
+            else:
+                order, error = fetched.get(key, (None, LookupError(f"Pedido {order_number} não retornado")))
+                results.append((order_number, order, error))
+        return results
+
+    def iter_orders(self, start_date=None, end_date=None, batch_size=500):
+        """Percorre os pedidos em cache por CreatedDate (ignora o TTL)
+
+        start_date/end_date ("YYYY-MM-DD HH:MM:SS") seguem o filtro da
+        importação: CreatedDate > start_date e CreatedDate <= end_date.
+        """
+        last = (start_date or '', '\uffff' if start_date else '')
+        while True:
+            with self._lock:
+                query = ("SELECT created_date, order_number, data FROM orders "
+                         "WHERE (COALESCE(created_date, ''), order_number) > (?, ?)")
+                params = list(last)
+                if end_date:
+                    query += " AND created_date <= ?"
+                    params.append(end_date)
+                query += " ORDER BY COALESCE(created_date, ''), order_number LIMIT ?"
+                rows = self._conn.execute(query, (*params, batch_size)).fetchall()
+            if not rows:
+                return
+            for created_date, order_number, data in rows:
+                yield self._decode(data)
+            last = (rows[-1][0] or '', rows[-1][1])
+
+    def evict(self):
+        """Remove entradas antigas (retention_days) e o excesso além de max_entries"""
+        removed = 0
+        with self._lock:
+            if self.retention_seconds is not None:
+                removed += self._conn.execute(
+                    "DELETE FROM orders WHERE fetched_at < ?", (time.time() - self.retention_seconds,)
+                ).rowcount
+            if self.max_entries:
+                removed += self._conn.execute(
+                    "DELETE FROM orders WHERE order_number IN ("
+                    "SELECT order_number FROM orders ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                ).rowcount
+            self._conn.commit()
+        if removed:
+            logger.info(f"Cache de pedidos: {removed} entradas removidas")
+        return removed
+
+    def stats(self):
+        """Acertos/falhas da execução e tamanho do cache"""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM orders").fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'writes': self.writes, 'entries': entries, 'bytes': size}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_order_cache(config, force=False):
+    """Cria o cache conforme order_cache do config.yaml (None se desabilitado)
+
+    force=True cria o cache mesmo com enabled: false (modo --replay-from-cache).
+    """
+    cache_config = config.get('order_cache') or {}
+    if not (cache_config.get('enabled', False) or force):
+        return None
+    return OrderCache(
+        path=cache_config.get('path', 'order_cache.db'),
+        ttl_hours=cache_config.get('ttl_hours', 168),
+        retention_days=cache_config.get('retention_days'),
+        max_entries=cache_config.get('max_entries'),
+        compress_level=cache_config.get('compress_level', 6),
+        json_codec=codec_from_config(config)
+    )
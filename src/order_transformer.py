@@ -0,0 +1,473 @@
+import re
+import json
+import time
+import hashlib
+import logging
+from operator import methodcaller
+from linx_dates import convert_linx_date, format_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+def _processed_at(order):
+    """Data/hora (UTC) em que a linha foi gerada"""
+    return format_epoch_ms(int(time.time() * 1000))
+
+# Campos do pedido que indicam uma alteração após a importação (status,
+# cancelamento, envios); presentes tanto no resumo do SearchOrders quanto nos
+# detalhes do GetOrderByNumber
+FINGERPRINT_FIELDS = (
+    'OrderStatusID',
+    'GlobalStatus',
+    'ShipmentStatus',
+    'CancelledDate',
+    'AcquiredDate',
+    'Total',
+    'Shipments'
+)
+
+def order_fingerprint(order):
+    """Hash (SHA-1) dos campos de FINGERPRINT_FIELDS do pedido
+
+    Campos ausentes contam como null; listas e objetos são serializados com
+    chaves ordenadas, então o hash independe da ordem das chaves no JSON.
+    """
+    values = [order.get(field) for field in FINGERPRINT_FIELDS]
+    encoded = json.dumps(values, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+# De onde vem cada coluna do table_schema no JSON do pedido LINX.
+#
+# Um valor pode ser apenas o caminho ("Seller.Name") ou um dicionário com:
+#   path     - caminho no pedido; "Lista[Campo=valor]" seleciona o primeiro
+#              elemento da lista com Campo == valor
+#   default  - valor quando o campo não vem ou não pode ser convertido
+#              (padrão: None em NULLABLE, o zero do tipo em REQUIRED)
+#   required - o pedido é rejeitado (ValueError) se o campo não vier
+#   const    - valor fixo
+#   compute  - função(pedido) que gera o valor final (sem conversão)
+#   where    - (RECORD) filtra os elementos da lista: {'Campo': valor}
+#   fields   - (RECORD) mapeamento dos subcampos, relativo a cada elemento
+ORDER_FIELD_MAPPING = {
+    'order_id': {'path': 'OrderID', 'required': True},
+    'order_number': {'path': 'OrderNumber', 'required': True},
+    'created_date': {'path': 'CreatedDate', 'required': True},
+    'acquired_date': 'AcquiredDate',
+    'cancelled_date': 'CancelledDate',
+    'global_status': 'GlobalStatus',
+    'order_status_id': 'OrderStatusID',
+    'total': 'Total',
+    'subtotal': 'SubTotal',
+    'delivery_amount': 'DeliveryAmount',
+    'discount_amount': 'DiscountAmount',
+    'tax_amount': 'TaxAmount',
+
+    # Informações do cliente
+    'customer_id': 'CustomerID',
+    'customer_name': 'CustomerName',
+    'customer_email': 'CustomerEmail',
+    'customer_cpf': 'CustomerCPF',
+    'customer_cnpj': 'CustomerCNPJ',
+    'customer_type': {'path': 'CustomerType', 'default': 'P'},
+    'customer_cell_phone': 'CustomerCellPhone',
+    'customer_phone': 'CustomerPhone',
+    'customer_gender': 'CustomerGender',
+    'customer_birth_date': 'CustomerBirthDate',
+
+    # Endereço de entrega (AddressType 68)
+    'delivery_address_line': 'Addresses[AddressType=68].AddressLine',
+    'delivery_address_number': 'Addresses[AddressType=68].Number',
+    'delivery_neighbourhood': 'Addresses[AddressType=68].Neighbourhood',
+    'delivery_city': 'Addresses[AddressType=68].City',
+    'delivery_state': 'Addresses[AddressType=68].State',
+    'delivery_postal_code': 'Addresses[AddressType=68].PostalCode',
+    'delivery_contact_name': 'Addresses[AddressType=68].ContactName',
+    'delivery_contact_phone': 'Addresses[AddressType=68].ContactPhone',
+
+    # Arrays
+    'items': {
+        'path': 'Items',
+        'fields': {
+            'ProductID': 'ProductID',
+            'ProductName': 'ProductName',
+            'SKU': 'SKU',
+            'Qty': 'Qty',
+            'Price': 'Price',
+            'Total': 'Total',
+            'Weight': 'Weight',
+            'Width': 'Width',
+            'Height': 'Height',
+            'Depth': 'Depth'
+        }
+    },
+    'payment_methods': {
+        'path': 'PaymentMethods',
+        'fields': {
+            'PaymentMethodID': 'PaymentMethodID',
+            'Amount': 'Amount',
+            'Status': 'Status',
+            'PaymentDate': 'PaymentDate',
+            'Installments': {'path': 'Installments', 'default': 1},
+            'PaymentInfo': 'PaymentInfo.Alias',
+            'PaymentType': 'PaymentInfo.PaymentType',
+            'Provider': 'PaymentInfo.Provider',
+            'AuthorizationCode': 'PaymentInfo.AuthorizationCode',
+            'TransactionNumber': 'PaymentInfo.TransactionNumber'
+        }
+    },
+    'delivery_methods': {
+        'path': 'Properties',
+        'where': {'Type': 'DeliveryMethod'},
+        'fields': {
+            'CarrierName': {'const': 'Personalizado'},
+            'DeliveryMethodAlias': 'Reference',
+            'ETA': 'Message',
+            'Amount': 'Amount'
+        }
+    },
+    'shipment_status': 'ShipmentStatus',
+    'shipments': {
+        'path': 'Shipments',
+        'fields': {
+            'ShipmentNumber': 'ShipmentNumber',
+            'ShipmentStatus': 'ShipmentStatus'
+        }
+    },
+
+    # Informações do vendedor
+    'seller_name': 'Seller.Name',
+    'seller_email': 'Seller.EMail',
+    'seller_phone': 'Seller.Phone',
+    'seller_integration_id': 'Seller.IntegrationID',
+
+    # Metadados
+    'created_at': {'compute': _processed_at},
+    'fingerprint': {'compute': order_fingerprint}
+}
+
+_SPEC_KEYS = {'path', 'default', 'required', 'const', 'compute', 'where', 'fields'}
+
+def _to_string(value):
+    return value if type(value) is str else str(value)
+
+def _to_integer(value):
+    return value if type(value) is int else int(float(value))
+
+def _to_float(value):
+    return value if type(value) is float else float(value)
+
+def _to_boolean(value):
+    return value if type(value) is bool else str(value).strip().lower() in ('true', '1')
+
+# Conversão e "zero" de cada tipo do BigQuery
+_CASTS = {
+    'STRING': (_to_string, ''),
+    'INTEGER': (_to_integer, 0),
+    'INT64': (_to_integer, 0),
+    'FLOAT': (_to_float, 0.0),
+    'FLOAT64': (_to_float, 0.0),
+    'NUMERIC': (_to_float, 0.0),
+    'BOOLEAN': (_to_boolean, False),
+    'BOOL': (_to_boolean, False),
+    'TIMESTAMP': (convert_linx_date, None),
+    'DATETIME': (convert_linx_date, None)
+}
+
+_STEP_RE = re.compile(r'(\w+)(?:\[(\w+)=([^\]]*)\])?')
+
+def _parse_path(path):
+    """"Addresses[AddressType=68].City" -> [('Addresses', ('AddressType', 68)), ('City', None)]"""
+    steps = []
+    for part in path.split('.'):
+        match = _STEP_RE.fullmatch(part)
+        if not match:
+            raise ValueError(f"Caminho inválido no mapeamento: {path}")
+        key, filter_key, filter_value = match.groups()
+        if filter_key is None:
+            steps.append((key, None))
+        else:
+            if filter_value.lstrip('-').isdigit():
+                filter_value = int(filter_value)
+            steps.append((key, (filter_key, filter_value)))
+    return steps
+
+def _compile_path(path):
+    """Gera a função que lê o caminho de um dicionário (None se algum nível faltar)"""
+    steps = _parse_path(path)
+    if len(steps) == 1 and steps[0][1] is None:
+        return methodcaller('get', steps[0][0])
+
+    def get(obj):
+        for key, match in steps:
+            if not isinstance(obj, dict):
+                return None
+            obj = obj.get(key)
+            if match is not None:
+                match_key, match_value = match
+                obj = next((entry for entry in obj or () if entry.get(match_key) == match_value), None)
+        return obj
+    return get
+
+def _normalize_spec(name, spec):
+    if isinstance(spec, str):
+        return {'path': spec}
+    unknown = set(spec) - _SPEC_KEYS
+    if unknown:
+        raise ValueError(f"Chaves desconhecidas no mapeamento de {name}: {sorted(unknown)}")
+    return spec
+
+def _compile_value(field, spec):
+    """Gera a função pedido -> valor convertido de um campo escalar"""
+    name = field['name']
+    if 'compute' in spec:
+        return spec['compute']
+    if 'const' in spec:
+        const = spec['const']
+        return lambda obj: const
+
+    cast, zero = _CASTS[field['type']]
+    get = _compile_path(spec['path'])
+
+    if spec.get('required'):
+        source = spec['path']
+
+        def read_required(obj):
+            value = get(obj)
+            if value is not None and value != '':
+                try:
+                    value = cast(value)
+                except (ValueError, TypeError):
+                    value = None
+            if value is None or value == '':
+                raise ValueError(f"{source} é obrigatório e não pode ser nulo")
+            return value
+        return read_required
+
+    if 'default' in spec:
+        default = spec['default']
+    else:
+        default = zero if field.get('mode') == 'REQUIRED' else None
+
+    def read(obj):
+        value = get(obj)
+        if value is None:
+            return default
+        try:
+            value = cast(value)
+        except (ValueError, TypeError):
+            logger.warning(f"Não foi possível converter o valor '{value}' de {name} para {field['type']}")
+            return default
+        return default if value is None else value
+    return read
+
+def _compile_record(field, spec):
+    """Gera a função pedido -> lista de dicionários de um RECORD REPEATED"""
+    get = _compile_path(spec['path'])
+    build = _compile_fields(field.get('fields', []), spec.get('fields') or {}, field['name'])
+    where = tuple((spec.get('where') or {}).items())
+
+    if field.get('mode') != 'REPEATED':
+        def read_one(obj):
+            value = get(obj)
+            return build(value) if isinstance(value, dict) else None
+        return read_one
+
+    if where:
+        def read_filtered(obj):
+            return [build(entry) for entry in get(obj) or ()
+                    if all(entry.get(key) == value for key, value in where)]
+        return read_filtered
+
+    def read_all(obj):
+        return [build(entry) for entry in get(obj) or ()]
+    return read_all
+
+def _check_mapping(fields, mapping, owner):
+    missing = [field['name'] for field in fields if field['name'] not in mapping]
+    if missing:
+        raise ValueError(f"Campos de {owner} sem mapeamento em ORDER_FIELD_MAPPING: {missing}")
+
+def _compile_fields(fields, mapping, owner):
+    """Monta o plano (coluna, leitor) na ordem do schema e a função que gera a linha"""
+    _check_mapping(fields, mapping, owner)
+    plan = []
+    for field in fields:
+        spec = _normalize_spec(field['name'], mapping[field['name']])
+        if field['type'] == 'RECORD' and 'fields' in spec:
+            plan.append((field['name'], _compile_record(field, spec)))
+        else:
+            plan.append((field['name'], _compile_value(field, spec)))
+    plan = tuple(plan)
+
+    def build(obj):
+        return {name: read(obj) for name, read in plan}
+    return build
+
+class OrderTransformer:
+    """Converte o JSON de um pedido LINX na linha da tabela do BigQuery.
+
+    O plano de conversão é montado uma única vez a partir do table_schema
+    (tipos, modos e ordem das colunas) e do mapeamento de campos: cada coluna
+    vira uma função que já sabe de onde ler o valor e como convertê-lo, então
+    transform() apenas executa o plano. Regras de valores ausentes: None em
+    NULLABLE e o zero do tipo em REQUIRED, salvo default explícito.
+    """
+
+    def __init__(self, table_schema, mapping=None):
+        self.mapping = mapping or ORDER_FIELD_MAPPING
+        self.columns = [field['name'] for field in table_schema]
+        self._build = _compile_fields(table_schema, self.mapping, 'table_schema')
+
+    def transform(self, order):
+        """Converte um pedido; ValueError se faltar um campo obrigatório"""
+        return self._build(order)
+
+    __call__ = transform
+
+# Mesma expressão de linx_dates, ancorada para o extract_regex do Arrow
+_ARROW_LINX_DATE = r'^/Date\((?P<ms>-?\d+)(?:[+-]\d{4})?\)/$'
+
+def _compile_columns(fields, mapping, owner, arrow_fields):
+    """Monta, na ordem do schema, as funções lista de objetos -> array do Arrow"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    _check_mapping(fields, mapping, owner)
+
+    def typed_array(values, field, arrow_type, default):
+        """Array tipado; o caminho rápido é uma única chamada ao pyarrow"""
+        try:
+            array = pa.array(values, type=arrow_type)
+        except (TypeError, ValueError):
+            try:
+                # Tipo homogêneo, mas diferente (ex.: IDs inteiros em coluna STRING)
+                array = pa.array(values).cast(arrow_type)
+            except (TypeError, ValueError):
+                cast = _CASTS[field['type']][0]
+                converted = []
+                for value in values:
+                    try:
+                        converted.append(None if value is None else cast(value))
+                    except (ValueError, TypeError):
+                        logger.warning(f"Não foi possível converter o valor '{value}' de {field['name']} para {field['type']}")
+                        converted.append(None)
+                array = pa.array(converted, type=arrow_type)
+        if default is not None and array.null_count:
+            array = pc.fill_null(array, default)
+        return array
+
+    def linx_timestamps(values, arrow_type):
+        """Datas /Date(ms-0300)/ -> timestamp UTC (truncado em segundos, como convert_linx_date)"""
+        strings = pa.array([value if type(value) is str else None for value in values], type=pa.string())
+        millis = pc.struct_field(pc.extract_regex(strings, _ARROW_LINX_DATE), [0])
+        timestamps = millis.cast(pa.int64()).cast(pa.timestamp('ms', tz='UTC'))
+        return pc.floor_temporal(timestamps, unit='second').cast(arrow_type)
+
+    def formatted_timestamps(values, arrow_type):
+        """Datas já formatadas ("YYYY-MM-DD HH:MM:SS", UTC) -> timestamp UTC"""
+        return pa.array(values, type=pa.string()).cast(pa.timestamp('us')).cast(arrow_type)
+
+    def compile_column(field, spec, arrow_type):
+        is_timestamp = field['type'] in ('TIMESTAMP', 'DATETIME')
+
+        if field['type'] == 'RECORD' and 'fields' in spec:
+            get = _compile_path(spec['path'])
+            where = tuple((spec.get('where') or {}).items())
+            struct_type = arrow_type.value_type
+            children = _compile_columns(field.get('fields', []), spec.get('fields') or {}, field['name'],
+                                        list(struct_type))
+
+            def build_record(objs):
+                # Elementos de todos os pedidos achatados + offsets de cada pedido
+                entries, offsets = [], [0]
+                for obj in objs:
+                    values = get(obj) or ()
+                    if where:
+                        values = [entry for entry in values if all(entry.get(key) == value for key, value in where)]
+                    entries.extend(values)
+                    offsets.append(len(entries))
+                struct = pa.StructArray.from_arrays([build(entries) for build in children], fields=list(struct_type))
+                return pa.ListArray.from_arrays(pa.array(offsets, type=pa.int32()), struct)
+            return build_record
+
+        if 'compute' in spec or 'const' in spec or spec.get('required'):
+            # Valores já no formato final da linha (datas como texto)
+            read = _compile_value(field, spec)
+
+            def build_values(objs):
+                values = [read(obj) for obj in objs]
+                if is_timestamp:
+                    return formatted_timestamps(values, arrow_type)
+                return typed_array(values, field, arrow_type, None)
+            return build_values
+
+        get = _compile_path(spec['path'])
+        if 'default' in spec:
+            default = spec['default']
+        else:
+            default = _CASTS[field['type']][1] if field.get('mode') == 'REQUIRED' else None
+
+        if is_timestamp:
+            return lambda objs: linx_timestamps([get(obj) for obj in objs], arrow_type)
+        return lambda objs: typed_array([get(obj) for obj in objs], field, arrow_type, default)
+
+    return [compile_column(field, _normalize_spec(field['name'], mapping[field['name']]), arrow_field.type)
+            for field, arrow_field in zip(fields, arrow_fields)]
+
+class ColumnarOrderTransformer:
+    """Converte um lote de pedidos LINX direto em um pyarrow.RecordBatch.
+
+    Usa o mesmo table_schema e mapeamento do OrderTransformer, mas monta uma
+    coluna por vez: os valores de cada campo viram um array tipado em uma única
+    chamada ao pyarrow e as datas LINX são convertidas com regex/cast
+    vetorizados. Itens, pagamentos e envios viram listas de structs a partir dos
+    elementos de todos os pedidos, sem criar um dicionário por pedido ou item.
+    O resultado tem o schema de load_jobs.arrow_schema e pode ser gravado
+    diretamente em Parquet. Requer pyarrow.
+    """
+
+    def __init__(self, table_schema, mapping=None):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("A conversão em colunas requer o pacote pyarrow (pip install pyarrow)")
+        from load_jobs import arrow_schema
+
+        self.mapping = mapping or ORDER_FIELD_MAPPING
+        self.schema = arrow_schema(table_schema)
+        self._columns = _compile_columns(table_schema, self.mapping, 'table_schema', list(self.schema))
+        # Campos obrigatórios: validados pedido a pedido antes de montar as colunas
+        self._required = []
+        for field in table_schema:
+            spec = _normalize_spec(field['name'], self.mapping[field['name']])
+            if spec.get('required'):
+                self._required.append(_compile_value(field, spec))
+
+    def to_record_batch(self, orders):
+        """Converte uma lista de pedidos
+
+        Retorna (batch, errors): batch tem uma linha por pedido válido, na ordem
+        de entrada; errors lista (índice, mensagem) dos pedidos rejeitados por
+        falta de um campo obrigatório.
+        """
+        import pyarrow as pa
+
+        errors = []
+        valid = []
+        for index, order in enumerate(orders):
+            try:
+                for read in self._required:
+                    read(order)
+            except ValueError as e:
+                errors.append((index, str(e)))
+                continue
+            valid.append(order)
+        batch = pa.RecordBatch.from_arrays([build(valid) for build in self._columns], schema=self.schema)
+        return batch, errors
+
+    def with_column(self, batch, name, values):
+        """Substitui os valores de uma coluna do lote (ex.: fingerprint calculado no resumo)"""
+        import pyarrow as pa
+
+        index = self.schema.get_field_index(name)
+        field = self.schema.field(index)
+        return batch.set_column(index, field, pa.array(values, type=field.type))
@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Marcador de fim de fluxo entre os estágios
+_END = object()
+
+class StagedPipeline:
+    """Pipeline de estágios executados em threads, ligados por filas limitadas.
+
+    A fonte (um iterável) roda em sua própria thread e cada estágio consome a
+    fila anterior e produz para a seguinte; o último estágio é o destino. As
+    filas limitadas fazem o backpressure: um estágio rápido bloqueia quando o
+    seguinte não dá conta, mantendo a memória estável. O tempo total tende ao
+    do estágio mais lento, e não à soma de todos.
+    """
+
+    def __init__(self, source, stages, queue_size=2, source_name='source'):
+        self.source = source
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.source_name = source_name
+        self.stats = {name: {'items': 0, 'busy_seconds': 0.0}
+                      for name in [source_name] + [name for name, _ in self.stages]}
+        self._stop = threading.Event()
+        self._error = None
+        self._error_lock = threading.Lock()
+
+    def stop(self):
+        """Interrompe todos os estágios"""
+        self._stop.set()
+
+    def _fail(self, name, error):
+        with self._error_lock:
+            if self._error is None:
+                logger.error(f"Erro no estágio {name}: {str(error)}")
+                self._error = error
+        self.stop()
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _record(self, name, started):
+        stats = self.stats[name]
+        stats['items'] += 1
+        stats['busy_seconds'] += time.perf_counter() - started
+
+    def _run_source(self, out_q):
+        try:
+            iterator = iter(self.source)
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                self._record(self.source_name, started)
+                if not self._put(out_q, item):
+                    break
+        except Exception as e:
+            self._fail(self.source_name, e)
+        finally:
+            self._put(out_q, _END)
+
+    def _run_stage(self, name, fn, in_q, out_q):
+        try:
+            while True:
+                item = self._get(in_q)
+                if item is _END:
+                    break
+                started = time.perf_counter()
+                result = fn(item)
+                self._record(name, started)
+                if out_q is not None and result is not None:
+                    if not self._put(out_q, result):
+                        break
+        except Exception as e:
+            self._fail(name, e)
+        finally:
+            if out_q is not None:
+                self._put(out_q, _END)
+
+    def run(self):
+        """Executa o pipeline até o fim da fonte e retorna as estatísticas por estágio"""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = [threading.Thread(target=self._run_source, args=(queues[0],),
+                                    name=f"pipeline-{self.source_name}", daemon=True)]
+        for index, (name, fn) in enumerate(self.stages):
+            out_q = queues[index + 1] if index + 1 < len(self.stages) else None
+            threads.append(threading.Thread(target=self._run_stage, args=(name, fn, queues[index], out_q),
+                                            name=f"pipeline-{name}", daemon=True))
+
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        for name, stats in self.stats.items():
+            logger.info(f"Estágio {name}: {stats['items']} lotes, {stats['busy_seconds']:.1f}s ocupado "
+                        f"({stats['busy_seconds'] / elapsed * 100 if elapsed else 0:.0f}% de {elapsed:.1f}s)")
+
+        if self._error is not None:
+            raise self._error
+        return self.stats
@@ -0,0 +1,275 @@
+import time
+import logging
+import threading
+import requests
+from pipeline import StagedPipeline
+from dead_letter import new_dead_letter
+
+logger = logging.getLogger(__name__)
+
+# Motivos de erro por linha do BigQuery causados pelo próprio pedido: contam
+# como tentativa. Os demais (backendError, requestError, stopped, buffer de
+# streaming...) são falhas do serviço e não levam o pedido ao dead-letter.
+PERMANENT_ROW_REASONS = {'invalid'}
+
+def is_permanent_failure(stage, error):
+    """Indica se a falha é do pedido (conta no limite de tentativas) e não transitória
+
+    Permanentes: erros da transformação, respostas 4xx (exceto 429) do
+    GetOrderByNumber e linhas recusadas pelo BigQuery com motivo "invalid".
+    Respostas 429/5xx e timeouts da LINX (já repetidos por LinxAPI._post) e
+    falhas do BigQuery são transitórias.
+    """
+    if stage == 'transformacao':
+        return True
+    if stage == 'detalhes':
+        response = getattr(error, 'response', None) if isinstance(error, requests.HTTPError) else None
+        return response is not None and 400 <= response.status_code < 500 and response.status_code != 429
+    return any(entry.get('reason') in PERMANENT_ROW_REASONS for entry in error)
+
+class AckBatcher:
+    """Acumula os QueueItemID já gravados e os remove da fila em lotes
+
+    O DequeueQueueItems é chamado quando o lote atinge batch_size itens, quando
+    o item mais antigo espera há max_age_seconds (os itens continuam travados
+    pelo LockItems enquanto isso) ou em flush(). Usado a partir de várias threads.
+    """
+
+    def __init__(self, linx_api, batch_size=500, max_age_seconds=10):
+        self.linx_api = linx_api
+        self.batch_size = batch_size
+        self.max_age_seconds = max_age_seconds
+        self.acked = 0
+        self.requests = 0
+        self._items = []
+        self._oldest = None
+        self._lock = threading.Lock()
+
+    def add(self, queue_item_ids):
+        """Registra itens prontos para remoção; envia o lote se algum limite foi atingido"""
+        with self._lock:
+            if queue_item_ids and not self._items:
+                self._oldest = time.monotonic()
+            self._items.extend(queue_item_ids)
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        with self._lock:
+            due = self._items and (len(self._items) >= self.batch_size
+                                   or time.monotonic() - self._oldest >= self.max_age_seconds)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Remove da fila todos os itens acumulados"""
+        with self._lock:
+            items, self._items, self._oldest = self._items, [], None
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                try:
+                    self.linx_api.dequeue_queue_items(batch)
+                    self.requests += 1
+                    self.acked += len(batch)
+                except Exception as e:
+                    # Os itens voltam à fila quando a trava expira e são reprocessados
+                    logger.error(f"Erro ao remover {len(batch)} itens da fila: {str(e)}")
+
+class QueueConsumer:
+    """Consumidor contínuo da fila de pedidos da LINX (SearchQueueItems)
+
+    Lê páginas de page_size itens em loop e as processa em um StagedPipeline
+    (leitura da fila → detalhes → transformação → carga), com as etapas
+    sobrepostas. Cada item só é removido da fila (DequeueQueueItems, em lotes)
+    depois que a linha do seu pedido foi gravada no BigQuery; itens que
+    falham continuam travados e voltam à fila quando a trava expira.
+
+    Com um armazenamento de dead-letter (dead_letter.create_dead_letter_store),
+    as falhas permanentes de cada pedido (is_permanent_failure) são contadas;
+    ao atingir max_attempts, os itens vão para o dead-letter com o erro e o
+    conteúdo bruto e são removidos da fila, para que um pedido inválido não
+    volte a ocupar o consumidor. Falhas transitórias (indisponibilidade da
+    LINX ou do BigQuery) não contam: os itens apenas voltam à fila.
+
+    A execução termina com stop() (SIGTERM/SIGINT em main.py) ou ao atingir
+    um limite: max_items, max_runtime_seconds ou fila vazia com
+    exit_when_empty. Ao terminar, as páginas já lidas são concluídas, o
+    buffer de escrita é descarregado e os itens gravados são removidos.
+    """
+
+    def __init__(self, linx_api, bq_client, config=None, dead_letters=None):
+        queue_config = (config or {}).get('queue') or {}
+        self.linx_api = linx_api
+        self.bq_client = bq_client
+        self.queue_id = queue_config.get('queue_id', 31)
+        self.page_size = queue_config.get('page_size', 100)
+        self.queue_size = queue_config.get('queue_size', 2)
+        self.idle_sleep_seconds = queue_config.get('idle_sleep_seconds', 15)
+        self.max_items = queue_config.get('max_items')
+        self.max_runtime_seconds = queue_config.get('max_runtime_seconds')
+        self.exit_when_empty = queue_config.get('exit_when_empty', False)
+        self.acks = AckBatcher(
+            linx_api,
+            batch_size=queue_config.get('ack_batch_size', 500),
+            max_age_seconds=queue_config.get('ack_max_age_seconds', 10)
+        )
+        self.dead_letters = dead_letters
+        self.max_attempts = ((config or {}).get('dead_letter') or {}).get('max_attempts', 3)
+        self.stats = {'polled': 0, 'written': 0, 'failed': 0, 'dead_lettered': 0, 'ignored': 0}
+        self._stop = threading.Event()
+        self._writer = None
+
+    def stop(self):
+        """Pede o encerramento: nenhuma página nova é lida e as em andamento são concluídas"""
+        if not self._stop.is_set():
+            logger.info("Encerramento solicitado: concluindo os itens em andamento...")
+        self._stop.set()
+
+    def poll(self):
+        """Estágio 1: lê páginas da fila até stop() ou um limite de execução"""
+        started = time.monotonic()
+        while not self._stop.is_set():
+            if self.max_items and self.stats['polled'] >= self.max_items:
+                logger.info(f"Limite de {self.max_items} itens atingido")
+                return
+            if self.max_runtime_seconds and time.monotonic() - started >= self.max_runtime_seconds:
+                logger.info(f"Tempo máximo de {self.max_runtime_seconds}s atingido")
+                return
+
+            page_size = self.page_size
+            if self.max_items:
+                page_size = min(page_size, self.max_items - self.stats['polled'])
+            try:
+                items = self.linx_api.search_queue_items(self.queue_id, page_size).get('Result') or []
+            except Exception as e:
+                logger.error(f"Erro ao ler a fila {self.queue_id}: {str(e)}")
+                items = None
+
+            # Enquanto espera, envia os itens já gravados cujo lote está vencido
+            self.acks.flush_if_due()
+            if not items:
+                if items is not None and self.exit_when_empty:
+                    logger.info("Fila vazia")
+                    return
+                self._stop.wait(self.idle_sleep_seconds)
+                continue
+
+            self.stats['polled'] += len(items)
+            logger.info(f"{len(items)} itens lidos da fila {self.queue_id}")
+            yield self._group(items)
+
+    def _group(self, items):
+        """Agrupa os itens da página por pedido: {order_number: [item da fila, ...]}"""
+        orders = {}
+        ignored = []
+        for item in items:
+            order_number = item.get('EntityKeyValue')
+            if not order_number:
+                ignored.append(item.get('QueueItemID'))
+                continue
+            orders.setdefault(str(order_number), []).append(item)
+        if ignored:
+            # Itens sem pedido associado não têm o que gravar
+            logger.warning(f"{len(ignored)} itens da fila sem EntityKeyValue removidos")
+            self.stats['ignored'] += len(ignored)
+            self.acks.add(ignored)
+        return {'orders': orders, 'details': {}}
+
+    def _queue_item_ids(self, page, order_number):
+        return [item.get('QueueItemID') for item in page['orders'][order_number]]
+
+    def fetch_details(self, page):
+        """Estágio 2: obtém os detalhes dos pedidos da página em paralelo"""
+        page['fetched'] = self.linx_api.get_orders_by_number(list(page['orders']))
+        return page
+
+    def transform(self, page):
+        """Estágio 3: converte os pedidos para o formato do BigQuery"""
+        rows = []
+        for order_number, order_data, error in page.pop('fetched'):
+            if error:
+                self._fail(page, order_number, 'detalhes', error)
+                continue
+            # Conteúdo bruto guardado até a gravação (para o dead-letter)
+            page['details'][order_number] = order_data
+            try:
+                rows.append((order_number, self.linx_api.process_order(order_data)))
+            except Exception as e:
+                self._fail(page, order_number, 'transformacao', e)
+        page['rows'] = rows
+        return page
+
+    def load(self, page):
+        """Estágio 4: grava as linhas e libera os itens da fila dos pedidos gravados"""
+        for order_number, row in page.pop('rows'):
+            self._record_flush(self._writer.add(row, key=order_number), page)
+        self._record_flush(self._writer.flush(), page)
+        page.pop('details')
+
+    def _record_flush(self, result, page):
+        """Remove da fila os itens dos pedidos gravados; as falhas seguem o limite de tentativas"""
+        if not result:
+            return
+        inserted, failed = result
+        for order_number in inserted:
+            queue_item_ids = self._queue_item_ids(page, order_number)
+            self.acks.add(queue_item_ids)
+            self.stats['written'] += len(queue_item_ids)
+            logger.info(f"Pedido {order_number} processado com sucesso")
+        if self.dead_letters and inserted:
+            self.dead_letters.reset(inserted)
+        for entry in failed:
+            self._fail(page, entry['key'], 'carga', entry['errors'])
+
+    def _fail(self, page, order_number, stage, error):
+        """Registra a falha de um pedido; esgotadas as tentativas, envia os itens ao dead-letter"""
+        queue_items = page['orders'][order_number]
+        if not self.dead_letters:
+            logger.error(f"Erro ao processar pedido {order_number} ({stage}): {str(error)}")
+            self.stats['failed'] += len(queue_items)
+            return
+        if not is_permanent_failure(stage, error):
+            # Os itens continuam travados e voltam à fila, sem contar tentativa
+            logger.warning(f"Falha transitória no pedido {order_number} ({stage}): {str(error)}")
+            self.stats['failed'] += len(queue_items)
+            return
+
+        attempts = self.dead_letters.record_failure(order_number, error)
+        if attempts < self.max_attempts:
+            # Os itens continuam travados e voltam à fila quando a trava expira
+            logger.warning(f"Erro ao processar pedido {order_number} ({stage}), "
+                           f"tentativa {attempts}/{self.max_attempts}: {str(error)}")
+            self.stats['failed'] += len(queue_items)
+            return
+
+        queue_item_ids = self._queue_item_ids(page, order_number)
+        payload = {'queue_items': queue_items, 'order': page['details'].get(order_number)}
+        try:
+            self.dead_letters.add(new_dead_letter(order_number, stage, error, payload, attempts, queue_item_ids))
+        except Exception as e:
+            logger.error(f"Erro ao gravar o dead-letter do pedido {order_number}: {str(e)}")
+            self.stats['failed'] += len(queue_items)
+            return
+        self.acks.add(queue_item_ids)
+        self.stats['dead_lettered'] += len(queue_items)
+        logger.error(f"☠️ Pedido {order_number} enviado ao dead-letter após {attempts} tentativas "
+                     f"({stage}): {str(error)}")
+
+    def run(self):
+        """Consome a fila até stop() ou um limite; retorna as estatísticas"""
+        self.bq_client.create_table_if_not_exists()
+        self._writer = self.bq_client.buffered_writer()
+        pipeline = StagedPipeline(
+            self.poll(),
+            [('detalhes', self.fetch_details), ('transformacao', self.transform), ('carga', self.load)],
+            queue_size=self.queue_size,
+            source_name='fila'
+        )
+        try:
+            pipeline.run()
+        finally:
+            # O buffer já é descarregado a cada página; close() encerra as gravações
+            self._writer.close()
+            self.acks.flush()
+        stats = dict(self.stats, dequeued=self.acks.acked, dequeue_requests=self.acks.requests)
+        logger.info(f"Consumo da fila encerrado: {stats}")
+        return stats
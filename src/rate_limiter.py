@@ -0,0 +1,90 @@
+import random
+import threading
+import time
+import logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+class AdaptiveRateLimiter:
+    """Token bucket compartilhado com ajuste AIMD da taxa.
+
+    A taxa (requisições por segundo) cresce de forma aditiva enquanto a API
+    responde bem e cai de forma multiplicativa quando ela sinaliza sobrecarga
+    (429, 5xx ou timeout). Um Retry-After pausa todas as threads que usam o
+    limitador até o prazo indicado.
+    """
+
+    def __init__(self, rate=5.0, min_rate=0.5, max_rate=20.0, burst=None,
+                 increase=0.5, decrease=0.5):
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.rate = min(self.max_rate, max(self.min_rate, float(rate)))
+        self.burst = float(burst) if burst else max(1.0, self.rate)
+        self.increase = float(increase)
+        self.decrease = float(decrease)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Bloqueia até haver um token disponível"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        """Aumento aditivo: cerca de +increase req/s por segundo de tráfego saudável"""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self, retry_after=None):
+        """Redução multiplicativa da taxa e pausa opcional (Retry-After)"""
+        with self._lock:
+            now = time.monotonic()
+            # Várias threads recebem o mesmo sinal de sobrecarga; reduz uma vez por janela
+            if now - self._last_decrease >= 1.0 / self.rate:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._tokens = min(self._tokens, 1.0)
+                self._last_decrease = now
+                logger.info(f"Taxa de requisições reduzida para {self.rate:.2f}/s")
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+
+def parse_retry_after(value):
+    """Converte o cabeçalho Retry-After (segundos ou data HTTP) em segundos"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base_delay=0.5, max_delay=30.0):
+    """Backoff exponencial com jitter completo"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
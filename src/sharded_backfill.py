@@ -0,0 +1,152 @@
+import os
+import copy
+import logging
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from import_historical_orders import import_historical_orders, load_config
+from bigquery_client import BigQueryClient
+
+# Configuração de logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def parse_date(value):
+    """Aceita "YYYY-MM-DD" ou "YYYY-MM-DD HH:MM:SS" """
+    try:
+        return datetime.strptime(value, DATE_FORMAT)
+    except ValueError:
+        return datetime.strptime(value, '%Y-%m-%d')
+
+def split_date_range(start, end, window_days):
+    """Divide [start, end) em janelas (início exclusivo, fim inclusivo) de window_days dias"""
+    shards = []
+    current = start
+    while current < end:
+        upper = min(current + timedelta(days=window_days), end)
+        shards.append((current.strftime(DATE_FORMAT), upper.strftime(DATE_FORMAT)))
+        current = upper
+    return shards
+
+def shard_checkpoint_name(base_name, shard):
+    """Nome do checkpoint de uma janela"""
+    start, end = shard
+    return f"{base_name}_shard_{start.replace(' ', 'T')}_{end.replace(' ', 'T')}"
+
+def shard_config(config, workers):
+    """Divide a taxa do limitador da LINX entre os processos"""
+    config = copy.deepcopy(config)
+    rate_limit = config['linx_api'].setdefault('rate_limit', {})
+    for key in ('rate', 'max_rate', 'burst'):
+        if key in rate_limit:
+            rate_limit[key] = max(rate_limit[key] / workers, rate_limit.get('min_rate', 0.5))
+    return config
+
+def run_shard(shard, config, backfill, chunk_size, file_format):
+    """Importa uma janela de datas (executado em um processo do pool ou em uma task do Cloud Run)"""
+    base_name = (config.get('checkpoint') or {}).get('name', 'import_historical_orders')
+    start, end = shard
+    logger.info(f"Iniciando janela {start} → {end}")
+    stats = import_historical_orders(
+        backfill=backfill,
+        chunk_size=chunk_size,
+        file_format=file_format,
+        start_date=start,
+        end_date=end,
+        checkpoint_name=shard_checkpoint_name(base_name, shard),
+        config=config
+    )
+    return shard, stats
+
+def sharded_backfill(start, end, window_days=30, workers=4, backfill=True, chunk_size=None,
+                     file_format=None, dedupe=True, task_index=None, task_count=None):
+    """Executa o backfill em janelas de datas processadas em paralelo
+
+    Cada janela tem filtro com limite inferior e superior e checkpoint próprio,
+    então uma janela interrompida é retomada de onde parou e janelas concluídas
+    não são refeitas. Com task_index/task_count (Cloud Run Jobs) cada task
+    processa apenas as janelas que lhe cabem; a deduplicação final deve então
+    ser executada à parte (--dedupe-only).
+    """
+    shards = split_date_range(start, end, window_days)
+    if task_count:
+        shards = shards[task_index::task_count]
+    logger.info(f"{len(shards)} janelas de {window_days} dias com {workers} processos")
+
+    config = shard_config(load_config(), workers)
+    totals = {'processed': 0, 'imported': 0, 'skipped': 0, 'failed': 0}
+    failed_shards = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_shard, shard, config, backfill, chunk_size, file_format): shard
+                   for shard in shards}
+        for future in as_completed(futures):
+            shard = futures[future]
+            try:
+                _, stats = future.result()
+            except Exception as e:
+                logger.error(f"Janela {shard[0]} → {shard[1]} falhou: {str(e)}")
+                failed_shards.append(shard)
+                continue
+            for key in totals:
+                totals[key] += stats[key]
+            if not stats['completed']:
+                failed_shards.append(shard)
+            logger.info(f"Janela {shard[0]} → {shard[1]} concluída: {stats}")
+
+    logger.info(f"📊 Backfill particionado: {totals}")
+    if failed_shards:
+        logger.warning(f"{len(failed_shards)} janelas não concluídas (execute novamente para retomar): {failed_shards}")
+    elif dedupe and not task_count:
+        # Etapa final: garante uma linha por pedido após as cargas paralelas
+        # (só nas partições da janela do backfill)
+        try:
+            BigQueryClient(config).deduplicate_orders(start_date=start.strftime(DATE_FORMAT),
+                                                      end_date=end.strftime(DATE_FORMAT))
+        except RuntimeError as e:
+            logger.error(f"Deduplicação não executada: {str(e)}. Execute depois com --dedupe-only "
+                         f"--start \"{start.strftime(DATE_FORMAT)}\" --end \"{end.strftime(DATE_FORMAT)}\"")
+    return totals, failed_shards
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Backfill de pedidos LINX em janelas de datas paralelas')
+    parser.add_argument('--start', help='Data inicial (YYYY-MM-DD [HH:MM:SS])')
+    parser.add_argument('--end', help='Data final (padrão: agora)')
+    parser.add_argument('--window-days', type=int, default=30, help='Tamanho de cada janela em dias')
+    parser.add_argument('--workers', type=int, default=4, help='Número de processos')
+    parser.add_argument('--streaming', action='store_true', help='Usa inserções via streaming em vez de load jobs')
+    parser.add_argument('--chunk-size', type=int, help='Linhas por arquivo/load job')
+    parser.add_argument('--format', dest='file_format', choices=['ndjson', 'parquet'], help='Formato dos arquivos')
+    parser.add_argument('--skip-dedupe', action='store_true', help='Não executa a deduplicação final')
+    parser.add_argument('--dedupe-only', action='store_true',
+                        help='Executa apenas a deduplicação final (na janela de --start/--end, se informados)')
+    args = parser.parse_args()
+
+    if args.dedupe_only:
+        BigQueryClient(load_config()).deduplicate_orders(
+            start_date=parse_date(args.start).strftime(DATE_FORMAT) if args.start else None,
+            end_date=parse_date(args.end).strftime(DATE_FORMAT) if args.end else None
+        )
+    else:
+        if not args.start:
+            parser.error('--start é obrigatório')
+        # Cloud Run Jobs: cada task processa uma fatia das janelas
+        task_count = int(os.environ.get('CLOUD_RUN_TASK_COUNT', 0)) or None
+        task_index = int(os.environ.get('CLOUD_RUN_TASK_INDEX', 0)) if task_count else None
+        sharded_backfill(
+            parse_date(args.start),
+            parse_date(args.end) if args.end else datetime.now(),
+            window_days=args.window_days,
+            workers=args.workers,
+            backfill=not args.streaming,
+            chunk_size=args.chunk_size,
+            file_format=args.file_format,
+            dedupe=not args.skip_dedupe,
+            task_index=task_index,
+            task_count=task_count
+        )
@@ -0,0 +1,439 @@
+import time
+import calendar
+import logging
+import threading
+from datetime import datetime, UTC
+from google.api_core import exceptions
+from rate_limiter import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+# Erros transitórios do AppendRows: o mesmo lote é reenviado com o mesmo offset
+_RETRYABLE_ERRORS = (
+    exceptions.ServiceUnavailable,
+    exceptions.InternalServerError,
+    exceptions.DeadlineExceeded,
+    exceptions.Aborted,
+    exceptions.TooManyRequests
+)
+# Erros em que o stream deixa de ser utilizável (finalizado, removido ou com o
+# offset fora de sincronia): o lote não foi gravado e o próximo usa um stream novo
+_STREAM_ERRORS = (
+    exceptions.NotFound,
+    exceptions.FailedPrecondition,
+    exceptions.OutOfRange
+)
+
+_PROTO_PACKAGE = 'linx_orders'
+_PROTO_MESSAGE = 'OrderRow'
+
+def _timestamp_micros(value):
+    """TIMESTAMP ("YYYY-MM-DD HH:MM:SS" em UTC ou datetime) -> microssegundos desde a época"""
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value))
+    if value.tzinfo is not None:
+        value = value.astimezone(UTC)
+    return calendar.timegm(value.timetuple()) * 1_000_000 + value.microsecond
+
+# Tipo do BigQuery -> (tipo do campo no proto, conversão do valor da linha).
+# TIMESTAMP vai como int64 em microssegundos; tipos sem equivalente direto
+# (DATE, NUMERIC, ...) vão como texto, que a API converte.
+def _proto_types():
+    from google.protobuf import descriptor_pb2
+    field = descriptor_pb2.FieldDescriptorProto
+    return {
+        'STRING': (field.TYPE_STRING, str),
+        'INTEGER': (field.TYPE_INT64, int),
+        'INT64': (field.TYPE_INT64, int),
+        'FLOAT': (field.TYPE_DOUBLE, float),
+        'FLOAT64': (field.TYPE_DOUBLE, float),
+        'BOOLEAN': (field.TYPE_BOOL, bool),
+        'BOOL': (field.TYPE_BOOL, bool),
+        'TIMESTAMP': (field.TYPE_INT64, _timestamp_micros)
+    }
+
+def proto_descriptor(table_schema):
+    """DescriptorProto autocontido de uma linha do table_schema (RECORDs como tipos aninhados)"""
+    from google.protobuf import descriptor_pb2
+    field_proto = descriptor_pb2.FieldDescriptorProto
+    types = _proto_types()
+
+    def describe(name, full_name, fields):
+        message = descriptor_pb2.DescriptorProto(name=name)
+        for number, field in enumerate(fields, start=1):
+            proto_field = message.field.add(name=field['name'], number=number)
+            repeated = field.get('mode', 'NULLABLE') == 'REPEATED'
+            proto_field.label = field_proto.LABEL_REPEATED if repeated else field_proto.LABEL_OPTIONAL
+            if field['type'] == 'RECORD':
+                nested_name = f"{field['name']}_record"
+                message.nested_type.append(describe(nested_name, f"{full_name}.{nested_name}", field.get('fields', [])))
+                proto_field.type = field_proto.TYPE_MESSAGE
+                proto_field.type_name = f".{full_name}.{nested_name}"
+            else:
+                proto_field.type = types.get(field['type'], (field_proto.TYPE_STRING, str))[0]
+        return message
+
+    return describe(_PROTO_MESSAGE, f"{_PROTO_PACKAGE}.{_PROTO_MESSAGE}", table_schema)
+
+def proto_message_class(descriptor):
+    """Classe de mensagem Python do DescriptorProto"""
+    from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+    file_proto = descriptor_pb2.FileDescriptorProto(
+        name=f"{_PROTO_PACKAGE}_{_PROTO_MESSAGE}.proto", package=_PROTO_PACKAGE, syntax='proto2'
+    )
+    file_proto.message_type.append(descriptor)
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    message_descriptor = pool.FindMessageTypeByName(f"{_PROTO_PACKAGE}.{descriptor.name}")
+    if hasattr(message_factory, 'GetMessageClass'):
+        return message_factory.GetMessageClass(message_descriptor)
+    return message_factory.MessageFactory(pool).GetPrototype(message_descriptor)
+
+def _compile_encoder(fields):
+    """Função linha (dict) -> argumentos da mensagem proto, com os valores convertidos"""
+    types = _proto_types()
+    converters = []
+    for field in fields:
+        if field['type'] == 'RECORD':
+            convert = _compile_encoder(field.get('fields', []))
+        else:
+            convert = types.get(field['type'], (None, str))[1]
+        converters.append((field['name'], convert, field.get('mode', 'NULLABLE') == 'REPEATED'))
+
+    def encode(row):
+        values = {}
+        for name, convert, repeated in converters:
+            value = row.get(name)
+            if value is None:
+                continue
+            if repeated:
+                values[name] = [convert(item) for item in value if item is not None]
+            else:
+                values[name] = convert(value)
+        return values
+    return encode
+
+
+class BigQueryWriteAPI:
+    """Interface mínima da Storage Write API usada pelo StorageWriteSink
+
+    create_stream(tipo) -> nome, append(nome, linhas serializadas, offset),
+    finalize(nome) e commit(nomes). Como no AppendRowsStream, os erros chegam
+    como exceções do google.api_core: linhas recusadas levantam InvalidArgument
+    com response.row_errors, e o commit de streams já confirmados levanta
+    AlreadyExists. Um fake com esses quatro métodos substitui a API nos testes.
+    """
+
+    def __init__(self, table_path, descriptor, write_client=None):
+        try:
+            from google.cloud import bigquery_storage_v1
+            from google.cloud.bigquery_storage_v1 import types, writer
+        except ImportError:
+            raise ImportError("O write_mode storage_write requer o pacote google-cloud-bigquery-storage "
+                              "(pip install google-cloud-bigquery-storage)")
+        self._types = types
+        self._writer = writer
+        self.client = write_client or bigquery_storage_v1.BigQueryWriteClient()
+        self.table_path = table_path
+        self.descriptor = descriptor
+        self._appenders = {}
+
+    def create_stream(self, stream_type):
+        write_stream = self._types.WriteStream()
+        write_stream.type_ = (self._types.WriteStream.Type.PENDING if stream_type == 'pending'
+                              else self._types.WriteStream.Type.COMMITTED)
+        return self.client.create_write_stream(parent=self.table_path, write_stream=write_stream).name
+
+    def _appender(self, stream_name):
+        appender = self._appenders.get(stream_name)
+        if appender is None:
+            template = self._types.AppendRowsRequest()
+            template.write_stream = stream_name
+            proto_data = self._types.AppendRowsRequest.ProtoData()
+            proto_data.writer_schema = self._types.ProtoSchema(proto_descriptor=self.descriptor)
+            template.proto_rows = proto_data
+            appender = self._writer.AppendRowsStream(self.client, template)
+            self._appenders[stream_name] = appender
+        return appender
+
+    def _close_appender(self, stream_name):
+        appender = self._appenders.pop(stream_name, None)
+        if appender is not None:
+            try:
+                appender.close()
+            except Exception:
+                pass
+
+    def append(self, stream_name, serialized_rows, offset):
+        request = self._types.AppendRowsRequest()
+        request.offset = offset
+        proto_data = self._types.AppendRowsRequest.ProtoData()
+        proto_data.rows = self._types.ProtoRows(serialized_rows=serialized_rows)
+        request.proto_rows = proto_data
+        try:
+            self._appender(stream_name).send(request).result()
+        except Exception:
+            # A conexão do AppendRows é descartada após um erro; a próxima tentativa abre outra
+            self._close_appender(stream_name)
+            raise
+
+    def finalize(self, stream_name):
+        self._close_appender(stream_name)
+        return self.client.finalize_write_stream(name=stream_name).row_count
+
+    def commit(self, stream_names):
+        request = self._types.BatchCommitWriteStreamsRequest(parent=self.table_path, write_streams=list(stream_names))
+        response = self.client.batch_commit_write_streams(request)
+        if not response.stream_errors:
+            return
+        messages = [error.error_message for error in response.stream_errors]
+        already_committed = self._types.StorageError.StorageErrorCode.STREAM_ALREADY_COMMITTED
+        if all(error.code == already_committed for error in response.stream_errors):
+            raise exceptions.AlreadyExists(f"Streams já confirmados: {messages}")
+        raise RuntimeError(f"Erro no commit dos streams: {messages}")
+
+    def close(self):
+        for stream_name in list(self._appenders):
+            self._close_appender(stream_name)
+
+
+class StorageWriteSink:
+    """Grava linhas com a BigQuery Storage Write API, sem duplicar linhas em retentativas
+
+    Cada lote é enviado com o offset em que deve começar no stream. Se a
+    resposta de um AppendRows se perde e o lote é reenviado, o BigQuery
+    responde ALREADY_EXISTS para o offset já gravado e o lote não é repetido.
+
+    stream_type:
+      committed - um stream por sink; as linhas ficam visíveis a cada AppendRows
+      pending   - um stream por lote, finalizado e confirmado (commit) ao fim do
+                  lote: o lote inteiro fica visível de uma vez ou não é gravado
+
+    Esgotadas as tentativas de um lote, não se sabe se ele foi gravado: o
+    stream e o offset são mantidos e o lote fica pendente de confirmação. Se o
+    mesmo lote é reenviado (retentativa do BufferedWriter), ele volta ao mesmo
+    offset; se chega outro lote, ele é enviado logo após o pendente, e a
+    resposta indica se o pendente foi gravado (OUT_OF_RANGE = não foi).
+
+    No modo pending vale o mesmo para o finalize e o commit: se a confirmação
+    se perde, o stream do lote é guardado e o reenvio do mesmo lote repete o
+    commit nesse stream (ALREADY_EXISTS se ele já tinha sido confirmado), em
+    vez de gravar o lote em um stream novo.
+
+    write_rows_detailed() segue o formato de BigQueryClient.insert_rows_detailed:
+    se alguma linha é recusada, o lote inteiro é descartado pelo BigQuery e as
+    demais linhas voltam com o motivo "stopped"; um lote sem confirmação volta
+    com "backendError". O BufferedWriter reenvia as linhas nos dois casos.
+    """
+
+    def __init__(self, table_ref, table_schema, stream_type='committed', max_attempts=5,
+                 base_delay=0.5, max_delay=30, api=None):
+        if stream_type not in ('committed', 'pending'):
+            raise ValueError(f"Tipo de stream desconhecido: {stream_type}")
+        project_id, dataset_id, table_id = table_ref.split('.')
+        self.table_path = f"projects/{project_id}/datasets/{dataset_id}/tables/{table_id}"
+        self.stream_type = stream_type
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.descriptor = proto_descriptor(table_schema)
+        self._message_class = proto_message_class(self.descriptor)
+        self._encode = _compile_encoder(table_schema)
+        self.api = api or BigQueryWriteAPI(self.table_path, self.descriptor)
+        self.appends = 0
+        self.deduplicated = 0
+        # Stream committed em uso, o offset da próxima linha e o lote enviado
+        # sem confirmação (offset, linhas serializadas)
+        self._stream = None
+        self._offset = 0
+        self._unconfirmed = None
+        # Modo pending: stream do lote sem confirmação do commit
+        # (stream, linhas serializadas, finalizado)
+        self._uncommitted = None
+        self._lock = threading.Lock()
+
+    def serialize(self, row):
+        """Linha (dict) -> bytes da mensagem proto"""
+        return self._message_class(**self._encode(row)).SerializeToString()
+
+    def write_rows_detailed(self, rows):
+        """Grava as linhas e retorna {índice: erros} das que não foram gravadas"""
+        errors = {}
+        serialized = []
+        positions = []
+        for index, row in enumerate(rows):
+            try:
+                serialized.append(self.serialize(row))
+                positions.append(index)
+            except (ValueError, TypeError) as e:
+                errors[index] = [{'reason': 'invalid', 'message': f"Erro ao converter a linha: {str(e)}"}]
+        if not serialized:
+            return errors
+
+        try:
+            with self._lock:
+                row_errors = self._append(serialized)
+        except _RETRYABLE_ERRORS as e:
+            for index in positions:
+                errors[index] = [{'reason': 'backendError', 'message': f"AppendRows sem confirmação: {str(e)}"}]
+            return errors
+        if row_errors:
+            rejected = dict(row_errors)
+            for position, index in enumerate(positions):
+                if position in rejected:
+                    errors[index] = [{'reason': 'invalid', 'message': rejected[position]}]
+                else:
+                    errors[index] = [{'reason': 'stopped', 'message': 'Lote recusado por causa de outra linha'}]
+        return errors
+
+    def _append(self, serialized):
+        """Envia um lote e retorna os erros por linha [(posição, mensagem)]"""
+        if self.stream_type == 'pending':
+            return self._append_pending(serialized)
+
+        if self._stream is None:
+            self._stream, self._offset, self._unconfirmed = self.api.create_stream('committed'), 0, None
+            logger.info(f"Stream committed criado: {self._stream}")
+        try:
+            if self._unconfirmed is not None and self._unconfirmed[1] != serialized:
+                row_errors = self._resolve_unconfirmed(serialized)
+                if row_errors is not None:
+                    return row_errors
+            try:
+                row_errors = self._send(self._stream, serialized, self._offset)
+            except _RETRYABLE_ERRORS:
+                self._unconfirmed = (self._offset, serialized)
+                raise
+        except _STREAM_ERRORS as e:
+            logger.warning(f"Stream {self._stream} descartado ({str(e)}); o próximo lote usa um stream novo")
+            if self._unconfirmed is not None:
+                logger.warning(f"{len(self._unconfirmed[1])} linhas sem confirmação no offset "
+                               f"{self._unconfirmed[0]} podem ter sido gravadas em {self._stream}")
+            self._stream, self._unconfirmed = None, None
+            raise
+        self._unconfirmed = None
+        if not row_errors:
+            self._offset += len(serialized)
+        return row_errors
+
+    def _append_pending(self, serialized):
+        """Envia o lote em um stream pending, finaliza e confirma (commit)
+
+        Um lote reenviado após uma falha transitória retoma o stream anterior:
+        o AppendRows volta ao offset 0 (ALREADY_EXISTS se gravado) ou, se o
+        stream já foi finalizado, só o commit é repetido.
+        """
+        if self._uncommitted is not None and self._uncommitted[1] == serialized:
+            stream, _, finalized = self._uncommitted
+            logger.info(f"Lote sem confirmação retomado no stream {stream}")
+        else:
+            self._abandon_uncommitted()
+            stream, finalized = self.api.create_stream('pending'), False
+        self._uncommitted = (stream, serialized, finalized)
+        try:
+            if not finalized:
+                row_errors = self._send(stream, serialized, 0)
+                if row_errors:
+                    self._uncommitted = None
+                    return row_errors
+                self._call('FinalizeWriteStream', self.api.finalize, stream)
+                self._uncommitted = (stream, serialized, True)
+            try:
+                self._call('BatchCommitWriteStreams', self.api.commit, [stream])
+            except exceptions.AlreadyExists:
+                # Um commit anterior, cuja resposta se perdeu, já confirmou o stream
+                logger.info(f"Stream {stream} já confirmado; retentativa ignorada")
+                self.deduplicated += 1
+        except _STREAM_ERRORS as e:
+            logger.warning(f"Stream {stream} descartado ({str(e)}); o lote não foi confirmado")
+            self._uncommitted = None
+            raise
+        self._uncommitted = None
+        return []
+
+    def _abandon_uncommitted(self):
+        if self._uncommitted is not None:
+            stream, pending_rows, finalized = self._uncommitted
+            if finalized:
+                logger.warning(f"{len(pending_rows)} linhas sem confirmação do commit podem ter sido "
+                               f"gravadas pelo stream {stream}")
+            self._uncommitted = None
+
+    def _resolve_unconfirmed(self, serialized):
+        """Envia um lote novo logo após o lote sem confirmação que não foi reenviado
+
+        OUT_OF_RANGE indica que o lote pendente não foi gravado: retorna None e
+        o lote novo ocupa o offset dele. Se o envio é aceito, o lote pendente
+        estava no stream; retorna os erros por linha do lote novo.
+        """
+        offset, pending_rows = self._unconfirmed
+        after = offset + len(pending_rows)
+        try:
+            row_errors = self._send(self._stream, serialized, after)
+        except exceptions.OutOfRange:
+            logger.info(f"Lote sem confirmação no offset {offset} não foi gravado em {self._stream}")
+            self._unconfirmed = None
+            return None
+        logger.warning(f"{len(pending_rows)} linhas informadas como não gravadas (offset {offset}) "
+                       f"estavam gravadas em {self._stream}")
+        self._unconfirmed = None
+        self._offset = after if row_errors else after + len(serialized)
+        return row_errors
+
+    def _send(self, stream, serialized, offset):
+        """AppendRows com retentativas no mesmo offset; retorna os erros por linha
+
+        Levanta a última exceção transitória se as tentativas se esgotam.
+        """
+        for attempt in range(self.max_attempts):
+            try:
+                self.appends += 1
+                self.api.append(stream, serialized, offset)
+                return []
+            except exceptions.AlreadyExists:
+                # Uma tentativa anterior já gravou o lote neste offset
+                logger.info(f"Lote no offset {offset} já gravado em {stream}; retentativa ignorada")
+                self.deduplicated += 1
+                return []
+            except exceptions.InvalidArgument as e:
+                # Linhas recusadas: o BigQuery descarta o lote inteiro
+                row_errors = getattr(getattr(e, 'response', None), 'row_errors', None)
+                if not row_errors:
+                    raise
+                return [(error.index, error.message) for error in row_errors]
+            except _RETRYABLE_ERRORS as e:
+                if attempt == self.max_attempts - 1:
+                    raise
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                logger.warning(f"Erro transitório no AppendRows ({str(e)}). Nova tentativa em {delay:.1f}s")
+                time.sleep(delay)
+
+    def _call(self, description, method, *args):
+        """Chamada à API (finalize/commit) com retentativas em erros transitórios"""
+        for attempt in range(self.max_attempts):
+            try:
+                return method(*args)
+            except _RETRYABLE_ERRORS as e:
+                if attempt == self.max_attempts - 1:
+                    raise
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                logger.warning(f"Erro transitório no {description} ({str(e)}). Nova tentativa em {delay:.1f}s")
+                time.sleep(delay)
+
+    def close(self):
+        """Finaliza o stream committed em uso (o próximo lote cria outro)"""
+        with self._lock:
+            self._abandon_uncommitted()
+            if self._unconfirmed is not None:
+                logger.warning(f"{len(self._unconfirmed[1])} linhas sem confirmação no offset "
+                               f"{self._unconfirmed[0]} podem ter sido gravadas em {self._stream}")
+                self._unconfirmed = None
+            if self._stream is not None:
+                try:
+                    self.api.finalize(self._stream)
+                except Exception as e:
+                    logger.warning(f"Erro ao finalizar o stream {self._stream}: {str(e)}")
+                self._stream = None
+            if hasattr(self.api, 'close'):
+                self.api.close()
@@ -0,0 +1,160 @@
+"""
+Teste do QueueConsumer sem acesso à LINX nem ao BigQuery.
+
+FakeLinx simula a fila (itens travados por leitura, removidos pelo
+DequeueQueueItems) e as respostas do GetOrderByNumber; FakeClient grava as
+linhas em memória pelo BufferedWriter, com erros por linha ou exceções
+injetados. Cada cenário roda o consumidor max_attempts vezes (como execuções
+seguidas, com as travas expiradas) e verifica que só as falhas permanentes
+levam o pedido ao dead-letter.
+
+Uso: python3 src/test_queue_consumer.py
+"""
+
+import logging
+import requests
+from bigquery_client import BufferedWriter
+from dead_letter import SQLiteDeadLetterStore
+from queue_consumer import QueueConsumer
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+CONFIG = {
+    'queue': {'exit_when_empty': True, 'page_size': 10, 'ack_batch_size': 10},
+    'dead_letter': {'max_attempts': MAX_ATTEMPTS}
+}
+
+def http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(f"{status_code} Erro", response=response)
+
+class FakeLinx:
+    """Fila e pedidos em memória; fetch_errors: {OrderNumber: exceção do GetOrderByNumber}"""
+
+    def __init__(self, order_numbers):
+        self.queue = [{'QueueItemID': index, 'EntityKeyValue': number}
+                      for index, number in enumerate(order_numbers, start=1)]
+        self.locked = set()
+        self.fetch_errors = {}
+        self.invalid_orders = set()
+
+    def search_queue_items(self, queue_id, page_size):
+        items = [item for item in self.queue if item['QueueItemID'] not in self.locked][:page_size]
+        self.locked.update(item['QueueItemID'] for item in items)
+        return {'Result': items}
+
+    def dequeue_queue_items(self, queue_item_ids):
+        self.queue = [item for item in self.queue if item['QueueItemID'] not in set(queue_item_ids)]
+
+    def get_orders_by_number(self, order_numbers):
+        return [(number, None, self.fetch_errors[number]) if number in self.fetch_errors
+                else (number, {'OrderNumber': number}, None) for number in order_numbers]
+
+    def process_order(self, order_data):
+        if order_data['OrderNumber'] in self.invalid_orders:
+            raise ValueError(f"Pedido {order_data['OrderNumber']} sem OrderID")
+        return {'order_id': order_data['OrderNumber'], 'order_number': order_data['OrderNumber']}
+
+    def expire_locks(self):
+        self.locked.clear()
+
+class FakeClient:
+    """O necessário do BigQueryClient para o consumidor; row_errors: {order_id: erros} e error: exceção do lote"""
+
+    def __init__(self):
+        self.table = []
+        self.row_errors = {}
+        self.error = None
+
+    def create_table_if_not_exists(self):
+        pass
+
+    def buffered_writer(self):
+        return BufferedWriter(self, max_rows=100)
+
+    def write_rows_detailed(self, rows):
+        if self.error:
+            raise self.error
+        errors = {index: self.row_errors[row['order_id']] for index, row in enumerate(rows)
+                  if row['order_id'] in self.row_errors}
+        self.table.extend(row for index, row in enumerate(rows) if index not in errors)
+        return errors
+
+    def finish_writes(self):
+        pass
+
+def run_consumer(linx, client, store, runs=MAX_ATTEMPTS):
+    for _ in range(runs):
+        linx.expire_locks()
+        QueueConsumer(linx, client, CONFIG, dead_letters=store).run()
+
+def dead_lettered(store):
+    return sorted(entry['key'] for entry in store.list())
+
+def test_backend_error_not_dead_lettered():
+    """backendError do BigQuery em todas as execuções: os itens ficam na fila, sem dead-letter"""
+    linx, client, store = FakeLinx(['1', '2']), FakeClient(), SQLiteDeadLetterStore(':memory:')
+    client.row_errors = {'1': [{'reason': 'backendError', 'message': 'indisponível'}]}
+    run_consumer(linx, client, store)
+    assert dead_lettered(store) == [], store.list()
+    assert [item['EntityKeyValue'] for item in linx.queue] == ['1']
+    # Quando o BigQuery volta, o pedido é gravado e sai da fila
+    client.row_errors = {}
+    run_consumer(linx, client, store, runs=1)
+    assert not linx.queue and sorted(row['order_id'] for row in client.table) == ['1', '2']
+    return True
+
+def test_request_error_not_dead_lettered():
+    """Exceção no envio do lote (requestError): nenhuma tentativa é contada"""
+    linx, client, store = FakeLinx(['1', '2']), FakeClient(), SQLiteDeadLetterStore(':memory:')
+    client.error = requests.ConnectionError('conexão recusada')
+    run_consumer(linx, client, store)
+    assert dead_lettered(store) == [] and len(linx.queue) == 2
+    return True
+
+def test_invalid_row_dead_lettered():
+    """Linha recusada com motivo invalid: dead-letter após max_attempts execuções"""
+    linx, client, store = FakeLinx(['1', '2']), FakeClient(), SQLiteDeadLetterStore(':memory:')
+    client.row_errors = {'1': [{'reason': 'invalid', 'message': 'valor inválido'}]}
+    run_consumer(linx, client, store, runs=MAX_ATTEMPTS - 1)
+    assert dead_lettered(store) == [] and len(linx.queue) == 1
+    run_consumer(linx, client, store, runs=1)
+    assert dead_lettered(store) == ['1'] and not linx.queue
+    return True
+
+def test_fetch_errors():
+    """GetOrderByNumber: 404 e erro de transformação são permanentes; 503 e timeout não"""
+    linx, client, store = FakeLinx(['1', '2', '3', '4']), FakeClient(), SQLiteDeadLetterStore(':memory:')
+    linx.fetch_errors = {'1': http_error(404), '2': http_error(503), '3': requests.Timeout('timeout')}
+    linx.invalid_orders = {'4'}
+    run_consumer(linx, client, store)
+    assert dead_lettered(store) == ['1', '4'], store.list()
+    assert sorted(item['EntityKeyValue'] for item in linx.queue) == ['2', '3']
+    return True
+
+def main():
+    """Executa os testes e mostra o resumo"""
+    tests = [test_backend_error_not_dead_lettered, test_request_error_not_dead_lettered,
+             test_invalid_row_dead_lettered, test_fetch_errors]
+    results = {}
+    for test in tests:
+        try:
+            results[test.__name__] = test()
+        except AssertionError as e:
+            logger.error(f"{test.__name__}: {str(e) or 'asserção falhou'}")
+            results[test.__name__] = False
+
+    logger.info("\nResumo dos testes:")
+    for name, ok in results.items():
+        logger.info(f"{name}: {'OK' if ok else 'FALHA'}")
+    if not all(results.values()):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Teste do StorageWriteSink (write_mode storage_write) sem acesso ao BigQuery.
+
+FakeWriteAPI reproduz as regras de offset da Storage Write API: um AppendRows
+em um offset já gravado recebe ALREADY_EXISTS e um offset à frente do fim do
+stream recebe OUT_OF_RANGE, e linhas recusadas levantam INVALID_ARGUMENT com
+response.row_errors (como o AppendRowsStream). Falhas transitórias podem ser
+injetadas antes ou depois da gravação (resposta perdida), no AppendRows e no
+commit dos streams pending, para verificar que as retentativas não duplicam
+linhas.
+
+Uso: python3 src/test_storage_write.py
+"""
+
+import os
+import logging
+from types import SimpleNamespace
+import yaml
+from google.api_core import exceptions
+from bigquery_client import BufferedWriter
+from storage_write import StorageWriteSink, _timestamp_micros
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config', 'config.yaml')
+TABLE_REF = 'projeto.dataset.pedidos'
+
+class FakeWriteAPI:
+    """Streams committed/pending em memória com as regras de offset da API"""
+
+    def __init__(self, message_class=None):
+        self.message_class = message_class
+        self.streams = {}
+        self.table = []
+        self.committed = []
+        # Falhas injetadas: ('before' | 'after', exceção) consumidas a cada append / commit
+        self.failures = []
+        self.commit_failures = []
+        self.invalid_order_ids = set()
+
+    def create_stream(self, stream_type):
+        name = f"streams/{len(self.streams) + 1}"
+        self.streams[name] = {'type': stream_type, 'rows': [], 'finalized': False}
+        return name
+
+    def append(self, stream_name, serialized_rows, offset):
+        stream = self.streams[stream_name]
+        if stream['finalized']:
+            raise exceptions.FailedPrecondition(f"Stream {stream_name} finalizado")
+        when, error = self.failures.pop(0) if self.failures else (None, None)
+        if when == 'before':
+            raise error
+        if offset < len(stream['rows']):
+            raise exceptions.AlreadyExists(f"Offset {offset} já gravado")
+        if offset > len(stream['rows']):
+            raise exceptions.OutOfRange(f"Offset {offset} além do fim do stream ({len(stream['rows'])})")
+
+        rows = [self.message_class.FromString(data) for data in serialized_rows]
+        row_errors = [(index, f"Pedido inválido: {row.order_id}") for index, row in enumerate(rows)
+                      if row.order_id in self.invalid_order_ids]
+        if row_errors:
+            response = SimpleNamespace(row_errors=[SimpleNamespace(index=index, message=message)
+                                                   for index, message in row_errors])
+            raise exceptions.InvalidArgument("Linhas recusadas", response=response)
+        stream['rows'].extend(rows)
+        if stream['type'] == 'committed':
+            self.table.extend(rows)
+        if when == 'after':
+            # O lote foi gravado mas a resposta se perdeu
+            raise error
+
+    def finalize(self, stream_name):
+        self.streams[stream_name]['finalized'] = True
+        return len(self.streams[stream_name]['rows'])
+
+    def commit(self, stream_names):
+        when, error = self.commit_failures.pop(0) if self.commit_failures else (None, None)
+        if when == 'before':
+            raise error
+        if all(name in self.committed for name in stream_names):
+            raise exceptions.AlreadyExists(f"Streams já confirmados: {stream_names}")
+        for name in stream_names:
+            stream = self.streams[name]
+            assert stream['type'] == 'pending' and stream['finalized'], f"Commit inválido de {name}"
+            self.table.extend(stream['rows'])
+            self.committed.append(name)
+        if when == 'after':
+            # O commit foi feito mas a resposta se perdeu
+            raise error
+
+class FakeClient:
+    """O necessário do BigQueryClient para o BufferedWriter"""
+
+    def __init__(self, sink):
+        self.sink = sink
+
+    def create_table_if_not_exists(self):
+        pass
+
+    def write_rows_detailed(self, rows):
+        return self.sink.write_rows_detailed(rows)
+
+    def finish_writes(self):
+        self.sink.close()
+
+def load_schema():
+    with open(CONFIG_PATH, 'r') as file:
+        return yaml.safe_load(file)['table_schema']
+
+def make_sink(stream_type='committed', max_attempts=5):
+    api = FakeWriteAPI()
+    sink = StorageWriteSink(TABLE_REF, load_schema(), stream_type=stream_type, max_attempts=max_attempts,
+                            base_delay=0, api=api)
+    api.message_class = sink._message_class
+    return sink, api
+
+def make_rows(first, count):
+    return [{
+        'order_id': f"{number}",
+        'order_number': f"PED-{number}",
+        'created_date': '2024-01-15 10:30:00',
+        'global_status': 1,
+        'total': 199.9,
+        'customer_id': number,
+        'customer_name': 'Cliente Teste',
+        'customer_email': None,
+        'items': [{'SKU': f"SKU-{number}", 'Qty': 2, 'Price': 99.95}],
+        'shipments': [],
+        'created_at': '2024-01-15 10:30:00'
+    } for number in range(first, first + count)]
+
+def order_ids(api):
+    return [row.order_id for row in api.table]
+
+def test_encoding():
+    """As linhas convertidas mantêm valores, RECORDs, REPEATED e nulos"""
+    sink, api = make_sink()
+    row = make_rows(1, 1)[0]
+    message = sink._message_class.FromString(sink.serialize(row))
+    assert message.order_id == '1'
+    assert message.created_date == _timestamp_micros('2024-01-15 10:30:00') == 1705314600 * 1_000_000
+    assert message.items[0].SKU == 'SKU-1' and message.items[0].Qty == 2.0
+    assert message.customer_id == 1 and message.customer_name == 'Cliente Teste'
+    assert not message.HasField('customer_email')
+    assert not message.HasField('cancelled_date')
+    assert len(message.shipments) == 0
+    return True
+
+def test_committed_offsets():
+    """Lotes em sequência no mesmo stream, com offsets crescentes"""
+    sink, api = make_sink()
+    for first in (1, 11, 21):
+        assert sink.write_rows_detailed(make_rows(first, 10)) == {}
+    assert order_ids(api) == [str(number) for number in range(1, 31)]
+    assert len(api.streams) == 1 and sink._offset == 30
+    return True
+
+def test_retry_after_lost_response():
+    """Resposta perdida após a gravação: a retentativa recebe ALREADY_EXISTS e não duplica"""
+    sink, api = make_sink()
+    sink.write_rows_detailed(make_rows(1, 5))
+    api.failures = [('after', exceptions.ServiceUnavailable('conexão perdida'))]
+    assert sink.write_rows_detailed(make_rows(6, 5)) == {}
+    api.failures = [('before', exceptions.DeadlineExceeded('timeout')),
+                    ('before', exceptions.ServiceUnavailable('indisponível'))]
+    assert sink.write_rows_detailed(make_rows(11, 5)) == {}
+    ids = order_ids(api)
+    assert ids == [str(number) for number in range(1, 16)], ids
+    assert sink.deduplicated == 1 and sink._offset == 15
+    return True
+
+def test_stream_replaced_after_error():
+    """Um erro não transitório descarta o stream; o lote seguinte usa um stream novo"""
+    sink, api = make_sink()
+    sink.write_rows_detailed(make_rows(1, 5))
+    api.failures = [('before', exceptions.FailedPrecondition('stream inválido'))]
+    try:
+        sink.write_rows_detailed(make_rows(6, 5))
+        raise AssertionError("O erro deveria ter sido propagado")
+    except exceptions.FailedPrecondition:
+        pass
+    assert sink.write_rows_detailed(make_rows(6, 5)) == {}
+    assert order_ids(api) == [str(number) for number in range(1, 11)]
+    assert len(api.streams) == 2 and sink._offset == 5
+    return True
+
+def test_exhausted_retries_resent_by_buffered_writer():
+    """Tentativas esgotadas com o lote gravado: o BufferedWriter reenvia o mesmo lote no mesmo offset"""
+    sink, api = make_sink(max_attempts=2)
+    writer = BufferedWriter(FakeClient(sink), max_rows=100)
+    api.failures = [('after', exceptions.ServiceUnavailable('conexão perdida')),
+                    ('before', exceptions.ServiceUnavailable('indisponível'))]
+    for row in make_rows(1, 5):
+        writer.add(row, key=row['order_id'])
+    inserted, failed = writer.close()
+    assert sorted(inserted) == ['1', '2', '3', '4', '5'] and not failed, (inserted, failed)
+    assert order_ids(api) == ['1', '2', '3', '4', '5']
+    assert sink.deduplicated == 1
+    # close() finaliza o stream; o lote seguinte abre outro
+    assert api.streams['streams/1']['finalized'] and sink._stream is None
+    return True
+
+def test_unconfirmed_batch_not_resent():
+    """Lote sem confirmação abandonado: o lote seguinte descobre se ele foi gravado, sem duplicar"""
+    for written in (True, False):
+        sink, api = make_sink(max_attempts=2)
+        api.failures = [('after' if written else 'before', exceptions.ServiceUnavailable('conexão perdida')),
+                        ('before', exceptions.ServiceUnavailable('indisponível'))]
+        errors = sink.write_rows_detailed(make_rows(1, 5))
+        assert len(errors) == 5 and errors[0][0]['reason'] == 'backendError'
+        assert sink.write_rows_detailed(make_rows(6, 5)) == {}
+        expected = list(range(1, 11)) if written else list(range(6, 11))
+        assert order_ids(api) == [str(number) for number in expected], order_ids(api)
+        assert len(api.streams) == 1 and sink._offset == len(expected) and sink._unconfirmed is None
+    return True
+
+def test_pending_commit():
+    """Modo pending: cada lote só aparece na tabela após finalize + commit"""
+    sink, api = make_sink('pending')
+    sink.write_rows_detailed(make_rows(1, 5))
+    api.failures = [('after', exceptions.InternalServerError('erro interno'))]
+    sink.write_rows_detailed(make_rows(6, 5))
+    assert order_ids(api) == [str(number) for number in range(1, 11)]
+    assert len(api.committed) == 2 and sink.deduplicated == 1
+    return True
+
+def test_pending_commit_retried_on_same_stream():
+    """Resposta do commit perdida: o commit é repetido no mesmo stream, sem duplicar o lote"""
+    sink, api = make_sink('pending')
+    api.commit_failures = [('after', exceptions.ServiceUnavailable('conexão perdida'))]
+    assert sink.write_rows_detailed(make_rows(1, 5)) == {}
+    assert order_ids(api) == ['1', '2', '3', '4', '5'] and sink.deduplicated == 1
+
+    # Tentativas esgotadas: o BufferedWriter reenvia o lote e o commit volta ao stream anterior
+    for committed in (True, False):
+        sink, api = make_sink('pending', max_attempts=2)
+        writer = BufferedWriter(FakeClient(sink), max_rows=100)
+        api.commit_failures = [('after' if committed else 'before', exceptions.ServiceUnavailable('conexão perdida')),
+                               ('before', exceptions.ServiceUnavailable('indisponível'))]
+        for row in make_rows(1, 5):
+            writer.add(row, key=row['order_id'])
+        inserted, failed = writer.flush()
+        assert sorted(inserted) == ['1', '2', '3', '4', '5'] and not failed, (inserted, failed)
+        assert order_ids(api) == ['1', '2', '3', '4', '5'], order_ids(api)
+        assert len(api.streams) == 1 and api.committed == ['streams/1'] and sink._uncommitted is None
+        assert sink.deduplicated == (1 if committed else 0)
+    return True
+
+def test_row_errors_with_buffered_writer():
+    """Linha recusada: o lote é descartado, as demais voltam como 'stopped' e são reenviadas"""
+    for stream_type in ('committed', 'pending'):
+        sink, api = make_sink(stream_type)
+        api.invalid_order_ids = {'3'}
+        writer = BufferedWriter(FakeClient(sink), max_rows=100)
+        rows = make_rows(1, 5)
+        for row in rows:
+            writer.add(row, key=row['order_id'])
+        inserted, failed = writer.flush()
+        assert sorted(inserted) == ['1', '2', '4', '5'], inserted
+        assert [entry['key'] for entry in failed] == ['3']
+        assert failed[0]['errors'][0]['reason'] == 'invalid'
+        assert sorted(order_ids(api)) == ['1', '2', '4', '5']
+    return True
+
+def test_conversion_error():
+    """Valor que não converte para o tipo da coluna é recusado sem afetar o lote"""
+    sink, api = make_sink()
+    rows = make_rows(1, 3)
+    rows[1]['total'] = 'não é número'
+    errors = sink.write_rows_detailed(rows)
+    assert list(errors) == [1] and errors[1][0]['reason'] == 'invalid'
+    assert order_ids(api) == ['1', '3']
+    return True
+
+def main():
+    """Executa os testes e mostra o resumo"""
+    tests = [test_encoding, test_committed_offsets, test_retry_after_lost_response,
+             test_stream_replaced_after_error, test_exhausted_retries_resent_by_buffered_writer,
+             test_unconfirmed_batch_not_resent, test_pending_commit, test_pending_commit_retried_on_same_stream,
+             test_row_errors_with_buffered_writer, test_conversion_error]
+    results = {}
+    for test in tests:
+        try:
+            results[test.__name__] = test()
+        except AssertionError as e:
+            logger.error(f"{test.__name__}: {str(e) or 'asserção falhou'}")
+            results[test.__name__] = False
+
+    logger.info("\nResumo dos testes:")
+    for name, ok in results.items():
+        logger.info(f"{name}: {'OK' if ok else 'FALHA'}")
+    if not all(results.values()):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()